@@ -0,0 +1,59 @@
+"""
+Measures how many logins per second the password hashing pool sustains at the configured bcrypt cost.
+
+A login costs one bcrypt verification. The benchmark verifies a password first on a single worker
+and then on the configured number of workers (PASSWORD_HASH_WORKERS, all cores when 0) through
+run_password_hashing, the way the login route does, and reports logins/sec in total and per core.
+
+Usage: python -m benchmarks.bench_bcrypt [--rounds N] [--workers N] [--seconds S]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from passlib.context import CryptContext
+
+from src.conf.config import settings
+from src.services import passwords
+
+
+async def run(context: CryptContext, hashed: str, concurrency: int, seconds: float) -> int:
+    deadline = time.perf_counter() + seconds
+    done = 0
+
+    async def client():
+        nonlocal done
+        while time.perf_counter() < deadline:
+            assert await passwords.run_password_hashing(context.verify, 'secret1', hashed)
+            done += 1
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=settings.bcrypt_rounds, help='bcrypt cost factor')
+    parser.add_argument('--workers', type=int, default=passwords.password_workers, help='size of the pool')
+    parser.add_argument('--seconds', type=float, default=5.0, help='duration of each run')
+    args = parser.parse_args()
+
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=args.rounds)
+    hashed = context.hash('secret1')
+    cores = os.cpu_count() or 1
+    print(f'bcrypt cost {args.rounds}, {cores} cores, {args.seconds:.0f}s per run')
+
+    for workers in sorted({1, args.workers}):
+        passwords.password_executor = passwords.ThreadPoolExecutor(max_workers=workers)
+        passwords.password_stats.reset()
+        logins = asyncio.run(run(context, hashed, workers * 2, args.seconds))
+        rate = logins / args.seconds
+        stats = passwords.password_stats.snapshot()
+        print(f'{workers:>3} workers: {rate:8.1f} logins/sec, {rate / min(workers, cores):7.1f} per core, '
+              f'run {stats["avg_run_ms"]:.1f} ms, queue avg {stats["avg_queue_ms"]:.1f} ms '
+              f'max {stats["max_queue_ms"]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
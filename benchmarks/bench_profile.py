@@ -0,0 +1,82 @@
+"""
+Compares the latency of a profile view for a user with few photos and a user with many photos.
+
+get_user_profile reads the maintained post_count/comment_count/rates_count counters of the user,
+so it costs the same single-row lookup for both users. For comparison the benchmark also times
+the COUNT(*) queries the counters replace, whose cost grows with the number of photos.
+
+The benchmark creates its own database (a SQLite file by default, any async SQLAlchemy url with --url);
+existing tables in it are dropped.
+
+Usage: python -m benchmarks.bench_profile [--photos N] [--runs N] [--url URL]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.database.models import Base, Comment, Photo, User
+from src.repository.users import get_user_profile
+
+
+async def create_user(db, username: str, photos: int, chunk: int = 50000) -> User:
+    user = User(username=username, email=f'{username}@example.com', password='x', post_count=photos)
+    db.add(user)
+    await db.commit()
+    for start in range(0, photos, chunk):
+        rows = [{'title': f'photo {i}', 'description': '', 'user_id': user.id}
+                for i in range(start, min(start + chunk, photos))]
+        await db.execute(insert(Photo), rows)
+        await db.commit()
+    return user
+
+
+async def count_queries(username: str, db):
+    user_id = await db.scalar(select(User.id).filter(User.username == username))
+    await db.scalar(select(func.count(Photo.id)).filter(Photo.user_id == user_id))
+    await db.scalar(select(func.count(Comment.id)).filter(Comment.user_id == user_id))
+
+
+async def measure(func, username: str, db, runs: int) -> tuple[float, float]:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await func(username, db)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+async def main(args):
+    engine = create_async_engine(args.url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+
+    sizes = {'small_user': 10, 'big_user': args.photos}
+    async with session() as db:
+        for username, photos in sizes.items():
+            started = time.perf_counter()
+            await create_user(db, username, photos)
+            print(f'created {username} with {photos} photos in {time.perf_counter() - started:.1f}s')
+
+    print(f'\n{"user":<12}{"photos":>10}{"counters p50/p95 ms":>24}{"COUNT(*) p50/p95 ms":>24}')
+    async with session() as db:
+        for username, photos in sizes.items():
+            profile = await measure(get_user_profile, username, db, args.runs)
+            counts = await measure(count_queries, username, db, max(args.runs // 10, 3))
+            print(f'{username:<12}{photos:>10}{profile[0]:>14.3f} /{profile[1]:>7.3f}'
+                  f'{counts[0]:>14.3f} /{counts[1]:>7.3f}')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--photos', type=int, default=1_000_000, help='photos of the big user')
+    parser.add_argument('--runs', type=int, default=200, help='profile views per user')
+    parser.add_argument('--url', default='sqlite+aiosqlite:///bench_profile.db', help='database url')
+    asyncio.run(main(parser.parse_args()))
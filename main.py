@@ -1,23 +1,42 @@
+import asyncio
+
 from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from src.database.db import get_db
+from src.database.db import get_db, engine, replica_engine
+from src.database.pool import get_pool_stats
+from src.database.models import Role
+from src.services.roles import RoleChecker
+from src.services.response_cache import photos_cache, profiles_cache
+from src.services.principal_cache import principal_cache
+from src.services.passwords import password_stats
+from src.services.uploads import UploadSizeLimitMiddleware
 
 import redis.asyncio as redis
 from fastapi_limiter import FastAPILimiter
 
-from src.routes import photos, photo_transformer, auth, tags, comments, users
+from src.routes import photos, photo_transformer, auth, tags, comments, ratings, users, media, jobs, admin
+from src.worker import run_workers
 
 from src.conf.config import settings
 
 app = FastAPI()
+app.add_middleware(UploadSizeLimitMiddleware)
+
+allowed_pool_stats = RoleChecker([Role.admin])
+allowed_cache_stats = RoleChecker([Role.admin])
+allowed_password_stats = RoleChecker([Role.admin])
 
 app.include_router(users.router, prefix='/api')
 app.include_router(photos.router, prefix='/api')
 app.include_router(tags.router, prefix='/api')
 app.include_router(photo_transformer.router, prefix='/api')
 app.include_router(comments.router, prefix='/api')
+app.include_router(ratings.router, prefix='/api')
+app.include_router(media.router, prefix='/api')
+app.include_router(jobs.router, prefix='/api')
+app.include_router(admin.router, prefix='/api')
 
 
 @app.on_event("startup")
@@ -25,12 +44,18 @@ async def startup():
     """
     The startup function is called when the application starts up.
     It's a good place to initialize things that are used by the app, such as databases or caches.
+    With the in-memory job queue the background workers run here as well.
+    With the Redis tier of the principal cache its invalidation listener is started.
 
     :return: A dictionary
     """
     r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
                           decode_responses=True)
     await FastAPILimiter.init(r)
+    if settings.job_backend == 'memory':
+        app.state.workers = asyncio.create_task(run_workers())
+    if principal_cache.client is not None:
+        app.state.principal_listener = asyncio.create_task(principal_cache.listen())
 
 
 @app.get("/")
@@ -39,18 +64,18 @@ def read_root():
 
 
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     """
     The healthchecker function is a simple function that checks the health of the database.
     It does this by making a request to the database and checking if it returns any results.
     If there are no results, then we know something is wrong with our connection.
 
-    :param db: Session: Get the database session from the dependency
+    :param db: AsyncSession: Get the database session from the dependency
     :return: A dictionary with a message
     """
     try:
         # Make request
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = (await db.execute(text("SELECT 1"))).fetchone()
         if result is None:
             raise HTTPException(status_code=500, detail="Database is not configured correctly")
         return {"message": "Welcome to FastAPI!"}
@@ -59,4 +84,40 @@ def healthchecker(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Error connecting to the database")
 
 
+@app.get("/api/pool_stats", dependencies=[Depends(allowed_pool_stats)])
+async def read_pool_stats():
+    """
+    The read_pool_stats function reports the state of the database connection pools.
+    It returns the pool size, checked in/out connections, overflow, how often requests had to wait
+    for a connection and the average/max checkout latency since the process started.
+
+    :return: A dictionary with the pool statistics of the primary and, if configured, the replica
+    """
+    stats = {"primary": get_pool_stats("primary").snapshot(engine.pool)}
+    if replica_engine is not None:
+        stats["replica"] = get_pool_stats("replica").snapshot(replica_engine.pool)
+    return stats
+
+
+@app.get("/api/cache_stats", dependencies=[Depends(allowed_cache_stats)])
+async def read_cache_stats():
+    """
+    The read_cache_stats function reports the hits, misses and hit ratio of the response caches.
+
+    :return: A dictionary with the statistics of each cache
+    """
+    return {"photos": await photos_cache.stats(), "profiles": await profiles_cache.stats()}
+
+
+@app.get("/api/password_stats", dependencies=[Depends(allowed_password_stats)])
+async def read_password_stats():
+    """
+    The read_password_stats function reports the load of the password hashing pool: how many bcrypt calls
+    ran, how many are waiting or running now and their average/max queue and run times.
+
+    :return: A dictionary with the password hashing statistics
+    """
+    return password_stats.snapshot()
+
+
 app.include_router(auth.router, prefix='/api')
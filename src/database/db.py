@@ -1,30 +1,143 @@
-from fastapi import HTTPException, status
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import asynccontextmanager
+
+import redis.asyncio as redis
+from fastapi import HTTPException, status, Request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
 
 from src.conf.config import settings
+from src.database.pool import InstrumentedQueuePool
+from src.database.routing import WriteTracker, request_subject
+
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_url(url: str) -> str:
+    """
+    The async_url function swaps the driver of a database url for its asyncio counterpart,
+    so the same setting can be used by the synchronous tools (alembic) and by the application.
+    For example postgresql+psycopg2://... becomes postgresql+asyncpg://...
+
+    :param url: str: The database url from the settings
+    :return: The database url with an async driver
+    """
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver and url.drivername != driver:
+        url = url.set(drivername=driver)
+    return url.render_as_string(hide_password=False)
+
 
+def engine_options(url: str, name: str) -> dict:
+    """
+    The engine_options function builds the keyword arguments for create_async_engine from the settings.
+    SQLite keeps the pool chosen by its dialect, every other backend gets a sized and instrumented queue pool.
+
+    :param url: str: The async database url
+    :param name: str: The name the pool statistics are reported under
+    :return: A dictionary of engine options
+    """
+    options = {'echo': settings.sqlalchemy_echo, 'pool_logging_name': name}
+    if make_url(url).get_backend_name() != 'sqlite':
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=settings.sqlalchemy_pool_size,
+            max_overflow=settings.sqlalchemy_max_overflow,
+            pool_timeout=settings.sqlalchemy_pool_timeout,
+            pool_recycle=settings.sqlalchemy_pool_recycle,
+            pool_pre_ping=settings.sqlalchemy_pool_pre_ping,
+        )
+    return options
+
+
+URI = async_url(settings.sqlalchemy_database_url)
 
-URI = settings.sqlalchemy_database_url
+engine = create_async_engine(URI, **engine_options(URI, 'primary'))
+DBSession = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
-engine = create_engine(URI, echo=True)
-DBSession = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+if settings.sqlalchemy_replica_url:
+    REPLICA_URI = async_url(settings.sqlalchemy_replica_url)
+    replica_engine = create_async_engine(REPLICA_URI, **engine_options(REPLICA_URI, 'replica'))
+    ReplicaDBSession = async_sessionmaker(bind=replica_engine, class_=AsyncSession, autoflush=False,
+                                          expire_on_commit=False)
+else:
+    replica_engine = None
+    ReplicaDBSession = DBSession
+
+
+def get_write_tracker() -> WriteTracker:
+    """
+    The get_write_tracker function creates the read-your-writes tracker. The window is shared through Redis
+    unless there is no replica to route to or settings.read_your_writes_backend is 'memory'.
+
+    :return: A WriteTracker
+    """
+    client = None
+    if settings.sqlalchemy_replica_url and settings.read_your_writes_backend != 'memory':
+        client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
+                             decode_responses=True)
+    return WriteTracker(settings.read_your_writes_seconds, client)
+
+
+write_tracker = get_write_tracker()
+
+
+@event.listens_for(Session, 'after_commit')
+def _track_write(session: Session):
+    """
+    The _track_write function opens the read-your-writes window of the request subject
+    as soon as its primary session commits.
+
+    :param session: Session: The session that has just committed
+    :return: None
+    """
+    write_tracker.mark(session.info.get('subject'))
+
+
+@asynccontextmanager
+async def _session_scope(session_factory: async_sessionmaker, subject: str | None):
+    async with session_factory() as db:
+        db.info['subject'] = subject
+        try:
+            yield db
+        except SQLAlchemyError as err:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
 
 
 # Dependency
-def get_db():
+async def get_db(request: Request):
     """
     The get_db function is a context manager that will automatically close the database session at the end of a request.
     It also handles any exceptions that occur during the request, rolling back any changes to the database if an exception occurs.
 
-    :return: A database connection, which is used by the route operations to query the database
+    :param request: Request: Used to find the user whose writes are tracked for read-your-writes
+    :return: An async database session, which is used by the route operations to query the database
+    """
+    async with _session_scope(DBSession, request_subject(request)) as db:
+        yield db
+
+
+# Dependency
+async def get_read_db(request: Request):
+    """
+    The get_read_db function is the dependency of read-only routes.
+    It returns a session on the read replica when one is configured, unless the user has written
+    within the last read_your_writes_seconds, in which case the primary is used so they see their own changes.
+
+    :param request: Request: Used to find the user of the request
+    :return: An async database session for read-only queries
     """
-    db = DBSession()
-    try:
+    subject = request_subject(request)
+    session_factory = ReplicaDBSession
+    if session_factory is not DBSession and await write_tracker.recently_wrote(subject):
+        session_factory = DBSession
+    async with _session_scope(session_factory, subject) as db:
         yield db
-    except SQLAlchemyError as err:
-        db.rollback()
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
-    finally:
-        db.close()
@@ -1,11 +1,22 @@
 import enum
-from sqlalchemy import Column, Integer, String, func, ForeignKey, Boolean, Text, Enum, Table
-from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, Float, func, ForeignKey, Boolean, Text, Enum, Table, Index, DDL, event
+from sqlalchemy import UniqueConstraint, CheckConstraint
+from sqlalchemy.orm import relationship, backref
 from sqlalchemy.sql.sqltypes import DateTime
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+
+def utcnow() -> datetime:
+    # Python side default of the created_at columns that keyset pagination sorts on: the value is bound like the
+    # cursor, so SQLite stores it in the same text format ('YYYY-MM-DD HH:MM:SS.ffffff') and the row comparison
+    # in src.services.pagination.keyset_page works. func.now() would store it without microseconds.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 post_m2m_tag = Table(
     "post_m2m_tag",
     Base.metadata,
@@ -30,12 +41,25 @@ class Photo(Base):
     title = Column(String(69), nullable=True)
     description = Column(String(777), nullable=True)
     tags = relationship('Tag', secondary=post_m2m_tag, backref='photos')
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    content_hash = Column(String(64), nullable=True, index=True)
+    storage_key = Column(String(255), nullable=True, index=True)
+    comment_count = Column(Integer, nullable=False, default=0, server_default='0')
+    # Kept by src.repository.ratings in the same UPDATE as the ratings change, rating_avg is NULL until rated.
+    rating_sum = Column(Integer, nullable=False, default=0, server_default='0')
+    rating_count = Column(Integer, nullable=False, default=0, server_default='0')
+    rating_avg = Column(Float, nullable=True)
 
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
     user = relationship('User', backref="photos")
 
+    __table_args__ = (
+        Index('ix_photos_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        Index('ix_photos_rating_avg_id', 'rating_avg', 'id'),
+    )
+    __mapper_args__ = {'eager_defaults': True}
+
 
 class User(Base):
     __tablename__ = "users"
@@ -46,9 +70,18 @@ class User(Base):
     avatar = Column(String(255), nullable=True)
     roles = Column('roles', Enum(Role), default=Role.user)
     is_active = Column(Boolean, default=True)
-    created_at = Column('created_at', DateTime, default=func.now())
+    created_at = Column('created_at', DateTime, default=utcnow)
+    # Deprecated: refresh tokens are tracked by src.services.refresh_tokens. The column is no longer written
+    # or read, it is kept so existing databases still match the model.
     refresh_token = Column(String(255), nullable=True)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    post_count = Column(Integer, nullable=False, default=0, server_default='0')
+    comment_count = Column(Integer, nullable=False, default=0, server_default='0')
+    rates_count = Column(Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
 
 
 class Tag(Base):
@@ -66,10 +99,89 @@ class Comment(Base):
 
     id = Column(Integer, primary_key=True)
     text = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=utcnow)
     updated_at = Column(DateTime, default=None, onupdate=func.now())
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
     photo_id = Column('photo_id', ForeignKey('photos.id', ondelete='CASCADE'), default=None)
 
     user = relationship('User', backref="comments")
     photo = relationship('Photo', backref="comments")
+
+    __table_args__ = (
+        Index('ix_comments_photo_id_created_at_id', 'photo_id', 'created_at', 'id'),
+        Index('ix_comments_user_id', 'user_id'),
+    )
+
+
+class Rating(Base):
+    __tablename__ = 'ratings'
+
+    id = Column(Integer, primary_key=True)
+    rate = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=func.now())
+    user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    photo_id = Column('photo_id', ForeignKey('photos.id', ondelete='CASCADE'), nullable=False)
+
+    user = relationship('User', backref="ratings")
+    photo = relationship('Photo', backref=backref("ratings", passive_deletes=True))
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'photo_id', name='uq_ratings_user_id_photo_id'),
+        CheckConstraint('rate BETWEEN 1 AND 5', name='ck_ratings_rate'),
+        Index('ix_ratings_photo_id', 'photo_id'),
+    )
+
+
+# Full-text search over photos.title and photos.description.
+# PostgreSQL keeps a generated tsvector column with a GIN index, SQLite an external content FTS5 table
+# synced by triggers. Both are created together with the photos table, see src.repository.photos.get_photos_by_info.
+PHOTO_SEARCH_DDL = {
+    'postgresql': [
+        "ALTER TABLE photos ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+        "(to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))) STORED",
+        "CREATE INDEX ix_photos_search_vector ON photos USING gin (search_vector)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE photos_fts USING fts5(title, description, content='photos', content_rowid='id')",
+        "CREATE TRIGGER photos_fts_ai AFTER INSERT ON photos BEGIN "
+        "INSERT INTO photos_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+        "CREATE TRIGGER photos_fts_ad AFTER DELETE ON photos BEGIN "
+        "INSERT INTO photos_fts(photos_fts, rowid, title, description) "
+        "VALUES ('delete', old.id, old.title, old.description); END",
+        "CREATE TRIGGER photos_fts_au AFTER UPDATE OF title, description ON photos BEGIN "
+        "INSERT INTO photos_fts(photos_fts, rowid, title, description) "
+        "VALUES ('delete', old.id, old.title, old.description); "
+        "INSERT INTO photos_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    ],
+}
+
+for dialect, statements in PHOTO_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(Photo.__table__, 'after_create', DDL(statement).execute_if(dialect=dialect))
+event.listen(Photo.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS photos_fts").execute_if(dialect='sqlite'))
+
+
+# Substring search over users.username, see src.repository.users.get_users_with_username.
+# PostgreSQL serves ILIKE '%...%' from a pg_trgm GIN index (the extension is created if missing),
+# SQLite matches an external content FTS5 table with the trigram tokenizer synced by triggers.
+USER_SEARCH_DDL = {
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX ix_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE users_fts USING fts5(username, content='users', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER users_fts_ai AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_fts(rowid, username) VALUES (new.id, new.username); END",
+        "CREATE TRIGGER users_fts_ad AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, username) VALUES ('delete', old.id, old.username); END",
+        "CREATE TRIGGER users_fts_au AFTER UPDATE OF username ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, username) VALUES ('delete', old.id, old.username); "
+        "INSERT INTO users_fts(rowid, username) VALUES (new.id, new.username); END",
+    ],
+}
+
+for dialect, statements in USER_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(User.__table__, 'after_create', DDL(statement).execute_if(dialect=dialect))
+event.listen(User.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS users_fts").execute_if(dialect='sqlite'))
@@ -0,0 +1,90 @@
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+
+
+class PoolStats:
+    """
+    Counters collected by InstrumentedQueuePool on every connection checkout.
+    Latencies are kept in seconds and reported in milliseconds.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_checkout_time = 0.0
+        self.max_checkout_time = 0.0
+
+    def record(self, elapsed: float, waited: bool, timed_out: bool):
+        """
+        The record function stores the result of a single connection checkout.
+
+        :param elapsed: float: Seconds spent inside the pool to get a connection
+        :param waited: bool: True if the pool was exhausted and the caller had to wait
+        :param timed_out: bool: True if the caller gave up after pool_timeout
+        :return: None
+        """
+        self.checkouts += 1
+        self.waits += waited
+        self.timeouts += timed_out
+        self.total_checkout_time += elapsed
+        self.max_checkout_time = max(self.max_checkout_time, elapsed)
+
+    def snapshot(self, pool: Pool) -> dict:
+        """
+        The snapshot function combines the counters with the current state of the pool.
+        Pools that are not queue based (e.g. NullPool used for SQLite) only report the counters.
+
+        :param pool: Pool: The pool of the engine to report on
+        :return: A dictionary with the pool statistics
+        """
+        stats = {
+            "pool_class": type(pool).__name__,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "avg_checkout_ms": round(self.total_checkout_time / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "max_checkout_ms": round(self.max_checkout_time * 1000, 3),
+        }
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        return stats
+
+
+pool_stats = {}
+
+
+def get_pool_stats(name: str) -> PoolStats:
+    """
+    The get_pool_stats function returns the counters of the pool with the given logging name,
+    so the primary and the replica engines are reported separately.
+
+    :param name: str: The pool_logging_name of the engine
+    :return: The PoolStats object of that pool
+    """
+    return pool_stats.setdefault(name, PoolStats())
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool that records checkout latency, waits and timeouts in pool_stats
+    under the pool_logging_name of its engine.
+    """
+
+    def connect(self):
+        waited = -1 < self._max_overflow <= self.overflow() and self.checkedin() == 0
+        timed_out = False
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            get_pool_stats(self.logging_name).record(time.perf_counter() - start, waited, timed_out)
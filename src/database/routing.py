@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import redis.asyncio as redis
+from fastapi import Request
+from jose import jwt, JWTError
+from redis.exceptions import RedisError
+
+
+class WriteTracker:
+    """
+    Remembers for a short window which subjects (user emails) have just committed a write,
+    so their following reads are served by the primary instead of a possibly lagging replica.
+    The window is kept in the process and, when a client is given, in the Redis key rw:<subject>
+    that expires with it, so a write seen by one process routes the reads of every process.
+    If Redis cannot be asked, reads go to the primary.
+    """
+
+    def __init__(self, window: float, client: redis.Redis | None = None):
+        self.window = window
+        self.client = client
+        self._writes = {}
+        self._pending = set()
+
+    @staticmethod
+    def _key(subject: str) -> str:
+        return f"rw:{subject}"
+
+    async def _publish(self, subject: str):
+        try:
+            await self.client.set(self._key(subject), 1, px=max(1, round(self.window * 1000)))
+        except RedisError:
+            pass
+
+    def mark(self, subject: str | None):
+        """
+        The mark function opens the read-your-writes window for a subject.
+        It is called from the synchronous after_commit event, so the Redis key is set by a task
+        of the running event loop.
+
+        :param subject: str | None: The subject of the request that committed a write
+        :return: None
+        """
+        if not subject or self.window <= 0:
+            return
+        now = time.monotonic()
+        if len(self._writes) > 10000:
+            self._writes = {key: until for key, until in self._writes.items() if until > now}
+        self._writes[subject] = now + self.window
+        if self.client is None:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._publish(subject))
+        except RuntimeError:
+            return
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def recently_wrote(self, subject: str | None) -> bool:
+        """
+        The recently_wrote function checks if the subject is still inside its read-your-writes window.
+
+        :param subject: str | None: The subject of the current request
+        :return: True if reads of this subject must go to the primary
+        """
+        if not subject:
+            return False
+        until = self._writes.get(subject)
+        if until is not None:
+            if until > time.monotonic():
+                return True
+            self._writes.pop(subject, None)
+        if self.client is None:
+            return False
+        try:
+            return bool(await self.client.exists(self._key(subject)))
+        except RedisError:
+            return True
+
+
+def request_subject(request: Request) -> str | None:
+    """
+    The request_subject function reads the subject of the bearer token without verifying it.
+    It is only used to pick a database, the token itself is still verified by the auth service.
+
+    :param request: Request: The incoming request
+    :return: The email from the token or None for anonymous requests
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.get_unverified_claims(token).get("sub")
+    except JWTError:
+        return None
@@ -1,13 +1,58 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from typing import List, AsyncIterator
 
-from src.database.models import User, Comment, Role
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.models import User, Comment, Role, Photo
 from src.schemas import CommentBase
+from src.services.pagination import keyset_page, paginate
+from src.repository.users import change_user_counters
+from src.services.response_cache import photos_cache, profiles_cache
+
+
+async def _change_comment_count(photo_id: int, delta: int, db: AsyncSession) -> int | None:
+    # A single UPDATE ... SET comment_count = comment_count + delta, it locks the row of the photo,
+    # so concurrent comments never lose an increment. Returns the owner of the photo, None if there is no photo.
+    result = await db.execute(update(Photo).where(Photo.id == photo_id)
+                              .values(comment_count=Photo.comment_count + delta).returning(Photo.user_id))
+    return result.scalar_one_or_none()
+
+
+async def get_comments_page(photo_id: int, cursor: str | None, limit: int,
+                            db: AsyncSession) -> tuple[List[Comment], str | None]:
+    """
+    The get_comments_page function returns one page of the comments of a photo, oldest first.
+    It continues after the (created_at, id) of the previous page and is served by the
+    (photo_id, created_at, id) index, so every page costs the same.
+
+    :param photo_id: int: The id of the photo
+    :param cursor: str | None: The next_cursor of the previous page, None for the first page
+    :param limit: int: Limit the number of comments returned
+    :param db: AsyncSession: Access the database
+    :return: A list of comments and the cursor of the next page
+    """
+    stmt = keyset_page(select(Comment).filter(Comment.photo_id == photo_id), Comment, cursor, limit, descending=False)
+    comments = await db.scalars(stmt)
+    return paginate(comments.all(), limit)
+
+
+async def stream_comments(db: AsyncSession) -> AsyncIterator[Comment]:
+    """
+    The stream_comments function walks all comments in id order through a server-side cursor,
+    fetching settings.stream_batch_size rows at a time instead of loading the whole table.
+
+    :param db: AsyncSession: Access the database
+    :return: An async iterator of comment objects
+    """
+    stmt = select(Comment).order_by(Comment.id).execution_options(yield_per=settings.stream_batch_size)
+    return await db.stream_scalars(stmt)
 
 
-async def create_comment(photo_id: int, body: CommentBase, db: Session, user: User) -> Comment:
+async def create_comment(photo_id: int, body: CommentBase, db: AsyncSession, user: User) -> Comment:
     """
     The create_comment function creates a new comment in the database.
+    The comment_count of the photo and of the user is incremented in the same transaction.
         Args:
             photo_id (int): The id of the photo to which we are adding a comment.
             body (CommentBase): A CommentBase object containing information about the new comment.
@@ -15,18 +60,25 @@ async def create_comment(photo_id: int, body: CommentBase, db: Session, user: Us
 
     :param photo_id: int: Specify the id of the photo that we want to add a comment to
     :param body: CommentBase: Get the text from the body of the request
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param user: User: Get the user_id of the person who is making a comment
-    :return: The newly created comment
+    :return: The newly created comment, or None if the photo does not exist
     """
+    owner_id = await _change_comment_count(photo_id, 1, db)
+    if owner_id is None:
+        await db.rollback()
+        return None
     new_comment = Comment(text=body.text, photo_id=photo_id, user_id=user.id)
     db.add(new_comment)
-    db.commit()
-    db.refresh(new_comment)
+    username = await change_user_counters(user.id, db, comment_count=1)
+    await db.commit()
+    await photos_cache.bump(owner_id)
+    await profiles_cache.bump(username)
+    await db.refresh(new_comment)
     return new_comment
 
 
-async def edit_comment(comment_id: int, body: CommentBase, db: Session, user: User) -> Comment | None:
+async def edit_comment(comment_id: int, body: CommentBase, db: AsyncSession, user: User) -> Comment | None:
     """
     The edit_comment function takes in a comment_id, body, db and user.
         It then queries the database for the comment with that id. If it exists,
@@ -36,34 +88,42 @@ async def edit_comment(comment_id: int, body: CommentBase, db: Session, user: Us
 
     :param comment_id: int: Identify the comment that is being edited
     :param body: CommentBase: Pass the text of the comment to be edited
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param user: User: Check if the user is an admin or moderator,
     :return: A comment or none
     """
-    comment = db.query(Comment).filter(Comment.id == comment_id).first()
+    comment = await db.scalar(select(Comment).filter(Comment.id == comment_id))
     if comment:
         if user.roles in [Role.admin, Role.moderator] or comment.user_id == user.id:
             comment.text = body.text
             comment.updated_at = func.now()
-            db.commit()
+            await db.commit()
+            await db.refresh(comment)
     return comment
 
 
-async def delete_comment(comment_id: int, db: Session, user: User) -> None:
+async def delete_comment(comment_id: int, db: AsyncSession, user: User) -> None:
     """
     The delete_comment function deletes a comment from the database.
+    The comment_count of the photo and of the author is decremented in the same transaction.
         Args:
             comment_id (int): The id of the comment to be deleted.
             db (Session): A connection to the database.
             user (User): The user who is deleting this post.
 
     :param comment_id: int: Specify which comment to delete
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param user: User: Check if the user is authorized to delete the comment
     :return: The comment that was deleted
     """
-    comment = db.query(Comment).filter(Comment.id == comment_id).first()
+    comment = await db.scalar(select(Comment).filter(Comment.id == comment_id))
     if comment:
-        db.delete(comment)
-        db.commit()
+        owner_id = await _change_comment_count(comment.photo_id, -1, db)
+        username = await change_user_counters(comment.user_id, db, comment_count=-1)
+        await db.delete(comment)
+        await db.commit()
+        if owner_id is not None:
+            await photos_cache.bump(owner_id)
+        if username is not None:
+            await profiles_cache.bump(username)
     return comment
@@ -1,18 +1,41 @@
-import cloudinary
-import qrcode
+import hashlib
 import io
-import cloudinary.uploader
 
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Photo, User
-from src.conf.config import cloudinary_config
+from src.conf.config import settings
+from src.database.models import Photo, User, Tag
 from src.schemas_of_transformation import TransformerModel
-
-
-async def transformer(photo_id: int, body: TransformerModel, user: User, db: Session) -> Photo | None:
-    photo = db.query(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)).first()
+from src.services.qr_cache import qr_cache
+from src.services.response_cache import photos_cache
+from src.services.storage import storage
+from src.services.transform_cache import transform_cache
+
+
+async def render_locally(source_key: str, content_hash: str | None, body: TransformerModel) -> str | None:
+    """
+    The render_locally function registers the transformation in the transform cache.
+    Nothing is rendered here, the image is rendered with Pillow by the first request to the returned url.
+    The url names the current content of the source, a source without a content hash (uploaded before
+    deduplication, under a key that is overwritten) is read and hashed here.
+
+    :param source_key: str: The key of the original asset
+    :param content_hash: str | None: The SHA-256 of the original asset, if known
+    :param body: TransformerModel: The transformation
+    :return: The url of the transformed image or None if the original asset does not exist
+    """
+    if content_hash is None:
+        try:
+            content_hash = hashlib.sha256(await storage.read(source_key)).hexdigest()
+        except FileNotFoundError:
+            return None
+    key = await transform_cache.register(source_key, content_hash, body.dict())
+    return f'{settings.transform_base_url}/{key}'
+
+
+async def transformer(photo_id: int, body: TransformerModel, user: User, db: AsyncSession) -> Photo | None:
+    photo = await db.scalar(select(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)))
     if photo:
         transformation = []
 
@@ -59,33 +82,54 @@ async def transformer(photo_id: int, body: TransformerModel, user: User, db: Ses
             [transformation.append(elem) for elem in trans_list]
 
         if transformation:
-            cloudinary_config()
-            url = cloudinary.CloudinaryImage(f'PhotoShareApp/{user.username}').build_url(
-                transformation=transformation
-            )
+            source_key = photo.storage_key or f'PhotoShareApp/{user.username}'
+            if settings.transform_engine == 'local':
+                url = await render_locally(source_key, photo.content_hash if photo.storage_key else None, body)
+                if url is None:
+                    return None
+            else:
+                url = storage.url(source_key, transformation=transformation)
             photo.qr_code_url = url
-            db.commit()
+            await db.commit()
+            await photos_cache.bump(user.id)
+            await qr_cache.prerender(url)
 
         return photo
 
 
-def show_qr_code(photo_id: int, user: User, db: Session):
-    photo = db.query(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)).first()
-    if photo:
-        if photo.qr_code_url:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=3,
-                border=4,
-            )
-            qr.add_data(photo.qr_code_url)
-            qr.make(fit=True)
-
-            img = qr.make_image(fill_color="black", back_color="white")
-
-            output = io.BytesIO()
-            img.save(output)
-            output.seek(0)
-
-            return output
+async def get_qr_code_url(photo_id: int, user: User, db: AsyncSession) -> str | None:
+    """
+    The get_qr_code_url function returns the url encoded in the QR code of a photo of the user.
+
+    :param photo_id: int: The id of the photo
+    :param user: User: The owner of the photo
+    :param db: AsyncSession: The database session
+    :return: The transformed url of the photo or None if the photo or its transformation does not exist
+    """
+    return await db.scalar(select(Photo.qr_code_url).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)))
+
+
+async def get_qr_code_urls(photo_ids: list[int] | None, tag: str | None, user: User,
+                           db: AsyncSession) -> list[tuple[int, str]]:
+    """
+    The get_qr_code_urls function returns the transformed urls of several photos of the user.
+    Photos without a transformation, of other users or that do not exist are left out.
+
+    :param photo_ids: list[int] | None: The ids of the photos, None for all photos of the user
+    :param tag: str | None: Only photos with this tag
+    :param user: User: The owner of the photos
+    :param db: AsyncSession: The database session
+    :return: (photo id, url) pairs ordered by photo id
+    """
+    stmt = select(Photo.id, Photo.qr_code_url).filter(and_(Photo.user_id == user.id, Photo.qr_code_url.isnot(None)))
+    if photo_ids is not None:
+        stmt = stmt.filter(Photo.id.in_(photo_ids))
+    if tag:
+        stmt = stmt.filter(Photo.tags.any(Tag.title == tag))
+    return list((await db.execute(stmt.order_by(Photo.id))).tuples())
+
+
+async def show_qr_code(photo_id: int, user: User, db: AsyncSession):
+    url = await get_qr_code_url(photo_id, user, db)
+    if url:
+        return io.BytesIO(await qr_cache.get(url))
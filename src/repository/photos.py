@@ -1,27 +1,85 @@
-from typing import List
+import re
+from datetime import datetime
+from typing import List, AsyncIterator
 
-from sqlalchemy import or_, and_
-from sqlalchemy.orm import Session
+from sqlalchemy import select, and_, func, table, column, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.conf.config import settings
 from src.database.models import Photo, User
 from src.schemas import PhotoUpdate, PhotoTitleUpdate, PhotoDescriptionUpdate
 from src.repository.tags import get_tags
+from src.repository.users import change_user_counters
+from src.repository.ratings import remove_photo_ratings
+from src.services.pagination import keyset_page, paginate
+from src.services.response_cache import photos_cache, profiles_cache
+from src.services.storage import storage
 
+photos_fts = table('photos_fts', column('rowid'), column('photos_fts'), column('rank'))
+search_vector = literal_column('photos.search_vector')
 
-async def get_photos(skip: int, limit: int, user: User, db: Session) -> List[Photo]:
+
+async def get_photos(skip: int, limit: int, user: User, db: AsyncSession) -> List[Photo]:
     """
-    The get_photos function returns a list of photos from the database.
+    The get_photos function returns a list of photos from the database, newest first.
+    The id breaks ties between photos created in the same second, so offset pages do not overlap.
 
     :param skip: int: Skip a certain number of photos
     :param limit: int: Limit the number of photos returned
     :param user: User: Filter the photos by user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A list of photo objects
     """
-    return db.query(Photo).filter(Photo.user_id == user.id).offset(skip).limit(limit).all()
+    photos = await db.scalars(select(Photo).filter(Photo.user_id == user.id)
+                              .order_by(Photo.created_at.desc(), Photo.id.desc()).offset(skip).limit(limit))
+    return photos.all()
+
+
+async def get_photos_version(user: User, db: AsyncSession) -> tuple:
+    """
+    The get_photos_version function returns what the list of the user's photos depends on:
+    the number of photos, the latest updated_at and the highest id. Any create, update or delete changes it,
+    so it validates cached lists without loading a single photo.
 
+    :param user: User: Filter the photos by user
+    :param db: AsyncSession: Access the database
+    :return: A (count, latest updated_at, highest id) tuple
+    """
+    row = await db.execute(select(func.count(Photo.id), func.max(Photo.updated_at), func.max(Photo.id))
+                           .filter(Photo.user_id == user.id))
+    return tuple(row.one())
 
-async def get_photos_by_id(photo_id: int, user: User, db: Session) -> Photo:
+
+async def get_photos_page(cursor: str | None, limit: int, user: User,
+                          db: AsyncSession) -> tuple[List[Photo], str | None]:
+    """
+    The get_photos_page function returns one page of the user's photos, newest first.
+    Unlike get_photos it continues after the (created_at, id) of the previous page instead of skipping rows,
+    so every page costs the same no matter how deep the user scrolls.
+
+    :param cursor: str | None: The next_cursor of the previous page, None for the first page
+    :param limit: int: Limit the number of photos returned
+    :param user: User: Filter the photos by user
+    :param db: AsyncSession: Access the database
+    :return: A list of photo objects and the cursor of the next page
+    """
+    photos = await db.scalars(keyset_page(select(Photo).filter(Photo.user_id == user.id), Photo, cursor, limit))
+    return paginate(photos.all(), limit)
+
+
+async def stream_photos(db: AsyncSession) -> AsyncIterator[Photo]:
+    """
+    The stream_photos function walks the photos of all users in id order through a server-side cursor,
+    fetching settings.stream_batch_size rows at a time instead of loading the whole table.
+
+    :param db: AsyncSession: Access the database
+    :return: An async iterator of photo objects
+    """
+    stmt = select(Photo).order_by(Photo.id).execution_options(yield_per=settings.stream_batch_size)
+    return await db.stream_scalars(stmt)
+
+
+async def get_photos_by_id(photo_id: int, user: User, db: AsyncSession) -> Photo:
     """
     The get_photos_by_id function takes in a photo_id and user, and returns the Photo object with that id.
         Args:
@@ -30,29 +88,110 @@ async def get_photos_by_id(photo_id: int, user: User, db: Session) -> Photo:
 
     :param photo_id: int: Get the photo by id
     :param user: User: Get the user_id of the photo
-    :param db: Session: Pass in a database session to the function
+    :param db: AsyncSession: Pass in a database session to the function
     :return: A single photo by its id and the user who owns it
     """
-    return db.query(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)).first()
+    return await db.scalar(select(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)))
+
+
+async def get_photo_version(photo_id: int, user: User, db: AsyncSession) -> datetime | None:
+    """
+    The get_photo_version function returns when a photo of the user was last changed, without loading it.
+
+    :param photo_id: int: Get the photo by id
+    :param user: User: Get the user_id of the photo
+    :param db: AsyncSession: Pass in a database session to the function
+    :return: The updated_at of the photo, or None if the user has no such photo
+    """
+    row = await db.execute(select(Photo.updated_at).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)))
+    row = row.first()
+    return None if row is None else row.updated_at or datetime.min
 
 
-async def get_photos_by_info(information: str, user: User, db: Session) -> List[Photo]:
+async def get_photos_by_info(information: str, skip: int, limit: int, user: User, db: AsyncSession) -> List[Photo]:
     """
-    The get_photos_by_info function takes in a string of information and a user object,
-    and returns all photos that match the given information. The function uses the SQLAlchemy ORM to query
-    the database for all photos with matching titles or descriptions.
+    The get_photos_by_info function takes in a search string and a user object,
+    and returns the user's photos whose title or description contain the words of the search, best matches first.
+    On PostgreSQL it matches the GIN indexed photos.search_vector and ranks with ts_rank,
+    on SQLite it uses the photos_fts FTS5 table and its bm25 rank.
 
     :param information: str: Search for photos by title or description
+    :param skip: int: Skip a certain number of matches
+    :param limit: int: Limit the number of photos returned
     :param user: User: Get the user id of the user who is logged in
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A list of photos that match the information provided by the user
     """
-    return db.query(Photo).filter(Photo.user_id == user.id).filter(or_(Photo.title == information,
-                                                                       Photo.description == information,
-                                                                       )).all()
+    stmt = select(Photo).filter(Photo.user_id == user.id)
+    if db.bind.dialect.name == 'postgresql':
+        query = func.websearch_to_tsquery('simple', information)
+        stmt = stmt.filter(search_vector.op('@@')(query)) \
+            .order_by(func.ts_rank(search_vector, query).desc(), Photo.id.desc())
+    else:
+        words = re.findall(r'\w+', information)
+        if not words:
+            return []
+        query = ' '.join(f'"{word}"' for word in words)
+        stmt = stmt.join(photos_fts, photos_fts.c.rowid == Photo.id) \
+            .filter(photos_fts.c.photos_fts.op('MATCH')(query)) \
+            .order_by(photos_fts.c.rank, Photo.id.desc())
+    photos = await db.scalars(stmt.offset(skip).limit(limit))
+    return photos.all()
+
+
+def asset_key(content_hash: str, user: User) -> str:
+    """
+    The asset_key function returns the storage key of an image with the given content hash.
+    Identical images share one asset per user, or across all users when dedup_across_users is set.
+
+    :param content_hash: str: The SHA-256 of the image
+    :param user: User: The user uploading the image
+    :return: The storage key of the asset
+    """
+    if settings.dedup_across_users:
+        return f'PhotoShareApp/{content_hash}'
+    return f'PhotoShareApp/{user.id}/{content_hash}'
+
+
+async def get_asset_photo(content_hash: str, user: User, db: AsyncSession) -> Photo | None:
+    """
+    The get_asset_photo function looks for a photo whose stored asset has the given content hash,
+    so an upload of the same bytes can point to that asset instead of storing it again.
+    The photo is locked until the transaction ends, so remove_photo cannot delete the asset
+    before the new photo that points to it is committed.
+
+    :param content_hash: str: The SHA-256 of the uploaded image
+    :param user: User: The user uploading the image, only their photos are considered unless dedup_across_users is set
+    :param db: AsyncSession: Access the database
+    :return: A photo with the same content or None
+    """
+    stmt = select(Photo).filter(Photo.content_hash == content_hash, Photo.storage_key.is_not(None))
+    if not settings.dedup_across_users:
+        stmt = stmt.filter(Photo.user_id == user.id)
+    return await db.scalar(stmt.limit(1).with_for_update())
+
+
+async def save_asset(file, content_hash: str, user: User, db: AsyncSession) -> tuple[str, str]:
+    """
+    The save_asset function stores an uploaded image and returns its storage key and url.
+    If the same image was stored before (see get_asset_photo) the existing asset is reused and nothing is uploaded.
+
+    :param file: A file-like object with the image, positioned at the start
+    :param content_hash: str: The SHA-256 of the image
+    :param user: User: The user uploading the image
+    :param db: AsyncSession: Access the database
+    :return: The storage key and the url of the image
+    """
+    asset = await get_asset_photo(content_hash, user, db)
+    if asset:
+        return asset.storage_key, asset.photo_url
+    key = asset_key(content_hash, user)
+    r = await storage.save(file, key)
+    return key, storage.url(key, version=r.get('version'), width=250, height=250, crop='fill')
 
 
-async def create_photo(title: str, description: str, tags: List, url, user: User, db: Session) -> Photo:
+async def create_photo(title: str, description: str, tags: List, url, user: User, db: AsyncSession,
+                       content_hash: str = None, storage_key: str = None) -> Photo:
     """
     The create_photo function creates a new photo in the database.
         Args:
@@ -66,25 +205,32 @@ async def create_photo(title: str, description: str, tags: List, url, user: User
     :param tags: List: Get the tags from the request body
     :param url: Store the url of the photo
     :param user: User: Get the user_id of the photo
-    :param db: Session: Create a database session
+    :param db: AsyncSession: Create a database session
+    :param content_hash: str: The SHA-256 of the image
+    :param storage_key: str: The key of the image in the storage backend
     :return: A photo object
     """
     if tags:
-        tags = get_tags(tags[0].split(","), user, db)
+        tags = await get_tags(tags[0].split(","), user, db)
     photo = Photo(
         photo_url=url,
         title=title,
         description=description,
         tags=tags,
+        content_hash=content_hash,
+        storage_key=storage_key,
         user_id=user.id
     )
     db.add(photo)
-    db.commit()
-    db.refresh(photo)
+    username = await change_user_counters(user.id, db, post_count=1)
+    await db.commit()
+    await photos_cache.bump(user.id)
+    await profiles_cache.bump(username)
+    await db.refresh(photo)
     return photo
 
 
-async def update_photo(photo_id: int, body: PhotoUpdate, user: User, db: Session) -> Photo | None:
+async def update_photo(photo_id: int, body: PhotoUpdate, user: User, db: AsyncSession) -> Photo | None:
     """
     The update_photo function updates a photo in the database.
         Args:
@@ -95,18 +241,19 @@ async def update_photo(photo_id: int, body: PhotoUpdate, user: User, db: Session
     :param photo_id: int: Specify the photo to update
     :param body: PhotoUpdate: Pass the data from the request body to update_photo
     :param user: User: Check if the user is authorized to delete a photo
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A photo or none
     """
-    photo = db.query(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)).first()
+    photo = await db.scalar(select(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)))
     if photo:
         photo.title = body.title
         photo.description = body.description
-        db.commit()
+        await db.commit()
+        await photos_cache.bump(user.id)
     return photo
 
 
-async def update_title_photo(photo_id: int, body: PhotoTitleUpdate, user: User, db: Session) -> Photo | None:
+async def update_title_photo(photo_id: int, body: PhotoTitleUpdate, user: User, db: AsyncSession) -> Photo | None:
     """
     The update_title_photo function updates the title of a photo in the database.
         Args:
@@ -117,18 +264,19 @@ async def update_title_photo(photo_id: int, body: PhotoTitleUpdate, user: User,
     :param photo_id: int: Identify the photo to be updated
     :param body: PhotoTitleUpdate: Pass the title of the photo to be updated
     :param user: User: Ensure that the user is authorized to update the photo
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The photo object if the update is successful
     """
-    photo = db.query(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)).first()
+    photo = await db.scalar(select(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)))
     if photo:
         photo.title = body.title
-        db.commit()
+        await db.commit()
+        await photos_cache.bump(user.id)
     return photo
 
 
 async def update_description_photo(photo_id: int, body: PhotoDescriptionUpdate, user: User,
-                                   db: Session) -> Photo | None:
+                                   db: AsyncSession) -> Photo | None:
     """
     The update_description_photo function updates the description of a photo in the database.
         Args:
@@ -139,31 +287,49 @@ async def update_description_photo(photo_id: int, body: PhotoDescriptionUpdate,
     :param photo_id: int: Identify the photo that is being updated
     :param body: PhotoDescriptionUpdate: Get the description from the request body
     :param user: User: Ensure that the user is authorized to update the photo
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The updated photo
     """
-    photo = db.query(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)).first()
+    photo = await db.scalar(select(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)))
     if photo:
         photo.description = body.description
-        db.commit()
+        await db.commit()
+        await photos_cache.bump(user.id)
     return photo
 
 
-async def remove_photo(photo_id: int, user: User, db: Session) -> Photo | None:
+async def remove_photo(photo_id: int, user: User, db: AsyncSession) -> Photo | None:
     """
     The remove_photo function removes a photo from the database.
+    Its stored image is deleted as well once no other photo points to it, its ratings are deleted with it.
+    The photos sharing the image are locked while the references are counted and the image is deleted,
+    and the deletion happens before the commit, so an upload reusing the image (see get_asset_photo)
+    either waits and stores it again or is counted as a reference.
         Args:
             photo_id (int): The id of the photo to be removed.
             user (User): The user who is removing the photo. This is used for authorization purposes, as only users can remove their own photos.
-            db (Session): A session object that allows us to interact with our database and commit changes we make to it.
+            db (AsyncSession): A session object that allows us to interact with our database and commit changes we make to it.
 
     :param photo_id: int: Specify the id of the photo to be removed
     :param user: User: Get the user_id from the database
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The photo that was removed, or none if the photo wasn't found
     """
-    photo = db.query(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)).first()
+    photo = await db.scalar(select(Photo).filter(and_(Photo.id == photo_id, Photo.user_id == user.id)))
     if photo:
-        db.delete(photo)
-        db.commit()
+        if photo.storage_key:
+            await db.execute(select(Photo.id).filter(Photo.storage_key == photo.storage_key)
+                             .order_by(Photo.id).with_for_update())
+        raters = await remove_photo_ratings(photo.id, db)
+        await db.delete(photo)
+        username = await change_user_counters(user.id, db, post_count=-1)
+        if photo.storage_key:
+            await db.flush()
+            references = await db.scalar(select(func.count(Photo.id)).filter(Photo.storage_key == photo.storage_key))
+            if not references:
+                await storage.delete(photo.storage_key)
+        await db.commit()
+        await photos_cache.bump(user.id)
+        for name in {username, *raters}:
+            await profiles_cache.bump(name)
     return photo
@@ -0,0 +1,132 @@
+from typing import List
+
+from sqlalchemy import select, update, delete, case, cast, Float
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import User, Photo, Rating
+from src.repository.users import change_user_counters
+from src.services.response_cache import photos_cache, profiles_cache
+
+
+async def _change_rating(photo_id: int, delta_sum: int, delta_count: int, db: AsyncSession) -> int | None:
+    # A single UPDATE of rating_sum, rating_count and rating_avg, it locks the row of the photo, so concurrent
+    # ratings never lose a change. The SET expressions read the old values, rating_avg becomes NULL without ratings.
+    # Returns the owner of the photo, None if there is no photo.
+    rating_sum = Photo.rating_sum + delta_sum
+    rating_count = Photo.rating_count + delta_count
+    rating_avg = case((rating_count > 0, cast(rating_sum, Float) / rating_count), else_=None)
+    result = await db.execute(update(Photo).where(Photo.id == photo_id)
+                              .values(rating_sum=rating_sum, rating_count=rating_count, rating_avg=rating_avg)
+                              .returning(Photo.user_id))
+    return result.scalar_one_or_none()
+
+
+async def _get_own_rating(photo_id: int, user: User, db: AsyncSession) -> Rating | None:
+    return await db.scalar(select(Rating).filter(Rating.photo_id == photo_id, Rating.user_id == user.id)
+                           .with_for_update())
+
+
+async def get_top_rated(skip: int, limit: int, min_rating: float | None, db: AsyncSession) -> List[Photo]:
+    """
+    The get_top_rated function returns the rated photos with the highest average rating first.
+    It reads the precomputed rating_avg, so the listing is served by the (rating_avg, id) index
+    without touching the ratings table.
+
+    :param skip: int: Skip a number of photos
+    :param limit: int: Limit the number of photos returned
+    :param min_rating: float | None: Only return photos rated at least this on average
+    :param db: AsyncSession: Access the database
+    :return: A list of photo objects
+    """
+    stmt = select(Photo).filter(Photo.rating_avg.isnot(None))
+    if min_rating is not None:
+        stmt = stmt.filter(Photo.rating_avg >= min_rating)
+    photos = await db.scalars(stmt.order_by(Photo.rating_avg.desc(), Photo.id.desc()).offset(skip).limit(limit))
+    return photos.all()
+
+
+def _is_duplicate_rating(error: IntegrityError) -> bool:
+    # PostgreSQL names the violated constraint, SQLite lists its columns.
+    message = str(error.orig)
+    return 'uq_ratings_user_id_photo_id' in message or 'UNIQUE constraint failed: ratings.' in message
+
+
+async def rate_photo(photo_id: int, rate: int, user: User, db: AsyncSession, retry: bool = True) -> Photo | None:
+    """
+    The rate_photo function rates a photo from 1 to 5, a user has one rating per photo and rating again changes it.
+    The aggregates of the photo and the rates_count of the user are updated in the same transaction.
+
+    :param photo_id: int: The id of the rated photo
+    :param rate: int: The rating from 1 to 5
+    :param user: User: The user who rates the photo
+    :param db: AsyncSession: Access the database
+    :param retry: bool: Try once more if a concurrent request of the same user inserted the rating first
+    :return: The rated photo, or None if the photo does not exist
+    """
+    username = None
+    rating = await _get_own_rating(photo_id, user, db)
+    if rating is None:
+        owner_id = await _change_rating(photo_id, rate, 1, db)
+        if owner_id is None:
+            await db.rollback()
+            return None
+        db.add(Rating(rate=rate, photo_id=photo_id, user_id=user.id))
+        try:
+            await db.flush()
+        except IntegrityError as error:
+            await db.rollback()
+            if not (retry and _is_duplicate_rating(error)):
+                raise
+            # A concurrent request of the same user rated the photo first, change that rating instead.
+            return await rate_photo(photo_id, rate, user, db, retry=False)
+        username = await change_user_counters(user.id, db, rates_count=1)
+    else:
+        owner_id = await _change_rating(photo_id, rate - rating.rate, 0, db)
+        rating.rate = rate
+    await db.commit()
+    await photos_cache.bump(owner_id)
+    if username is not None:
+        await profiles_cache.bump(username)
+    return await db.scalar(select(Photo).filter(Photo.id == photo_id))
+
+
+async def unrate_photo(photo_id: int, user: User, db: AsyncSession) -> Photo | None:
+    """
+    The unrate_photo function removes the rating the user gave a photo.
+    The aggregates of the photo and the rates_count of the user are updated in the same transaction.
+
+    :param photo_id: int: The id of the rated photo
+    :param user: User: The user who rated the photo
+    :param db: AsyncSession: Access the database
+    :return: The photo, or None if the user has not rated it
+    """
+    rating = await _get_own_rating(photo_id, user, db)
+    if rating is None:
+        return None
+    owner_id = await _change_rating(photo_id, -rating.rate, -1, db)
+    await db.delete(rating)
+    username = await change_user_counters(user.id, db, rates_count=-1)
+    await db.commit()
+    await photos_cache.bump(owner_id)
+    await profiles_cache.bump(username)
+    return await db.scalar(select(Photo).filter(Photo.id == photo_id))
+
+
+async def remove_photo_ratings(photo_id: int, db: AsyncSession) -> List[str]:
+    """
+    The remove_photo_ratings function deletes the ratings of a photo that is being removed and decrements
+    the rates_count of the users who rated it, in the current transaction.
+    Call profiles_cache.bump with the returned usernames after the commit.
+
+    :param photo_id: int: The id of the removed photo
+    :param db: AsyncSession: Access the database
+    :return: The usernames of the users who rated the photo
+    """
+    raters = select(Rating.user_id).filter(Rating.photo_id == photo_id)
+    result = await db.execute(update(User).where(User.id.in_(raters))
+                              .values(rates_count=User.rates_count - 1, updated_at=User.updated_at)
+                              .returning(User.username))
+    usernames = result.scalars().all()
+    await db.execute(delete(Rating).where(Rating.photo_id == photo_id))
+    return usernames
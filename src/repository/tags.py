@@ -1,28 +1,33 @@
-from sqlalchemy.orm import Session
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import Tag, User
 from src.schemas import TagBase
 
 
-async def create_tag(body: TagBase, user: User, db: Session) -> Tag:
+async def create_tag(body: TagBase, user: User, db: AsyncSession) -> Tag:
     """
     The create_tag function creates a new tag in the database.
 
     :param body: TagBase: Pass the request body to the function
     :param user: User: Get the user_id of the tag creator
-    :param db: Session: Access the database, and the user: user parameter is used to get the id of
+    :param db: AsyncSession: Access the database, and the user: user parameter is used to get the id of
     :return: A new tag
     """
-    tag = db.query(Tag).filter(Tag.title == body.title).first()
+    tag = await db.scalar(select(Tag).filter(Tag.title == body.title))
     if not tag:
         tag = Tag(title=body.title, user_id=user.id)
         db.add(tag)
-        db.commit()
-        db.refresh(tag)
+        await db.commit()
+        await db.refresh(tag)
     return tag
 
 
-async def update_tag(tag_id: int, body: TagBase, db: Session) -> Tag | None:
+async def update_tag(tag_id: int, body: TagBase, db: AsyncSession) -> Tag | None:
     """
     The update_tag function updates a tag in the database.
         Args:
@@ -31,38 +36,40 @@ async def update_tag(tag_id: int, body: TagBase, db: Session) -> Tag | None:
 
     :param tag_id: int: Specify the tag to be deleted
     :param body: TagBase: Pass the new tag title to the function
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The updated tag
     """
-    tag = db.query(Tag).filter(Tag.id == tag_id).first()
+    tag = await db.scalar(select(Tag).filter(Tag.id == tag_id))
     if tag:
         tag.title = body.title
-        db.commit()
+        await db.commit()
     return tag
 
 
-def get_tags(tag_titles: list, user: User, db: Session):
-
+async def get_tags(tag_titles: list, user: User, db: AsyncSession) -> List[Tag]:
     """
     The get_tags function takes a list of tag titles and a user object.
-    It then queries the database for each tag title in the list, returning any tags that already exist.
-    If no such tags are found, it creates new ones with the given title and user id.
+    It selects all the tags that already exist in one query and inserts the missing ones in one bulk
+    INSERT ... ON CONFLICT DO NOTHING against the unique tags.title index, so a tag created meanwhile
+    by a concurrent upload is picked up instead of failing. Nothing is committed here: the tags are
+    saved in the same transaction as the photo that uses them.
 
     :param tag_titles: list: Pass in a list of tags that will be used to create the post
     :param user: User: Get the user_id
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A list of tags
     """
-    tags = []
-    for tagg_title in tag_titles:
-        tag = db.query(Tag).filter(Tag.title == tagg_title).first()
-        if not tag:
-            tag = Tag(
-                title=tagg_title,
-                user_id=user.id,
-            )
-            db.add(tag)
-            db.commit()
-            db.refresh(tag)
-        tags.append(tag)
-    return tags
+    titles = list(dict.fromkeys(title.strip() for title in tag_titles if title.strip()))
+    if not titles:
+        return []
+    tags = {tag.title: tag for tag in await db.scalars(select(Tag).filter(Tag.title.in_(titles)))}
+    missing = [title for title in titles if title not in tags]
+    if missing:
+        insert = postgresql_insert if db.bind.dialect.name == 'postgresql' else sqlite_insert
+        stmt = insert(Tag).values([{'title': title, 'user_id': user.id} for title in missing]) \
+            .on_conflict_do_nothing(index_elements=[Tag.title]).returning(Tag)
+        tags.update((tag.title, tag) for tag in await db.scalars(stmt))
+        raced = [title for title in missing if title not in tags]
+        if raced:
+            tags.update((tag.title, tag) for tag in await db.scalars(select(Tag).filter(Tag.title.in_(raced))))
+    return [tags[title] for title in titles if title in tags]
@@ -1,34 +1,41 @@
-from typing import List
+from typing import List, AsyncIterator
 
-import cloudinary
-
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, table, column
+from sqlalchemy.ext.asyncio import AsyncSession
 from libgravatar import Gravatar
 
-from src.conf.config import cloudinary_config
+from src.conf.config import settings
 from src.database.models import User, Role
 from src.schemas import UserModel, UserProfileModel
+from src.services.pagination import keyset_page, paginate
+from src.services.principal_cache import principal_cache
+from src.services.refresh_tokens import refresh_tokens
+from src.services.response_cache import profiles_cache
+from src.services.storage import storage
+from src.services.username_index import username_index
+
+users_fts = table('users_fts', column('rowid'), column('users_fts'))
 
 
-async def get_user_by_email(email: str, db: Session) -> User | None:
+async def get_user_by_email(email: str, db: AsyncSession) -> User | None:
     """
     The get_user_by_email function takes in an email and a database session,
     and returns the user with that email if it exists. If no such user exists,
     it returns None.
 
     :param email: str: Filter the database by email
-    :param db: Session: Pass a database session to the function
+    :param db: AsyncSession: Pass a database session to the function
     :return: A user object or none
     """
-    return db.query(User).filter_by(email=email).first()
+    return await db.scalar(select(User).filter_by(email=email))
 
 
-async def create_user(body: UserModel, db: Session):
+async def create_user(body: UserModel, db: AsyncSession):
     """
     The create_user function creates a new user in the database.
 
     :param body: UserModel: Get the data from the request body
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A user object
     """
     g = Gravatar(body.email)
@@ -36,29 +43,13 @@ async def create_user(body: UserModel, db: Session):
 
     new_user = User(**body.dict(), avatar=g.get_image())
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    username_index.add(new_user.username)
     return new_user
 
 
-async def update_token(user: User, refresh_token, db: Session):
-    """
-    The update_token function updates the refresh token for a user in the database.
-        Args:
-            user (User): The User object to update.
-            refresh_token (str): The new refresh token to store in the database.
-            db (Session): A connection to our Postgres database.
-
-    :param user: User: Pass the user object to the function
-    :param refresh_token: Update the user's refresh token in the database
-    :param db: Session: Pass the database session to the function
-    :return: A user object
-    """
-    user.refresh_token = refresh_token
-    db.commit()
-
-
-async def get_me(user: User, db: Session) -> User:
+async def get_me(user: User, db: AsyncSession) -> User:
     """
     Получение текущего пользователя
 
@@ -67,11 +58,11 @@ async def get_me(user: User, db: Session) -> User:
     :return:
     """
 
-    user = db.query(User).filter(User.id == user.id).first()
+    user = await db.scalar(select(User).filter(User.id == user.id))
     return user
 
 
-async def edit_my_profile(file, new_username, user: User, db: Session) -> User:
+async def edit_my_profile(file, new_username, user: User, db: AsyncSession) -> User:
     """
     Редактирование профиля пользователя
 
@@ -82,22 +73,25 @@ async def edit_my_profile(file, new_username, user: User, db: Session) -> User:
     :return:
     """
 
-    me = db.query(User).filter(User.id == user.id).first()
+    me = await db.scalar(select(User).filter(User.id == user.id))
+    old_username = me.username
     if new_username:
         me.username = new_username
 
-    cloudinary_config()
-    cloudinary.uploader.upload(file.file, public_id=f'Photoshare/{me.username}',
-                               overwrite=True, invalidate=True)
-    url = cloudinary.CloudinaryImage(f'Photoshare/{me.username}') \
-        .build_url(width=250, height=250, crop='fill')
+    key = f'Photoshare/{me.username}'
+    await storage.save(file.file, key, invalidate=True)
+    url = storage.url(key, width=250, height=250, crop='fill')
     me.avatar = url
-    db.commit()
-    db.refresh(me)
+    await db.commit()
+    await principal_cache.invalidate(me.email)
+    await profiles_cache.bump(old_username)
+    await profiles_cache.bump(me.username)
+    username_index.rename(old_username, me.username)
+    await db.refresh(me)
     return me
 
 
-async def get_users(skip: int, limit: int, db: Session) -> List[User]:
+async def get_users(skip: int, limit: int, db: AsyncSession) -> List[User]:
     """
     Получение списка пользователей
 
@@ -107,36 +101,93 @@ async def get_users(skip: int, limit: int, db: Session) -> List[User]:
     :return:
     """
 
-    return db.query(User).offset(skip).limit(limit).all()
+    users = await db.scalars(select(User).offset(skip).limit(limit))
+    return users.all()
+
 
+async def get_users_page(cursor: str | None, limit: int, db: AsyncSession) -> tuple[List[User], str | None]:
+    """
+    Получение страницы пользователей по курсору (created_at, id), от новых к старым
 
-async def get_users_with_username(username: str, db: Session) -> List[User]:
+    :param cursor:
+    :param limit:
+    :param db:
+    :return:
     """
-    Получение списка пользователей по имени
+
+    users = await db.scalars(keyset_page(select(User), User, cursor, limit))
+    return paginate(users.all(), limit)
+
+
+async def stream_users(db: AsyncSession) -> AsyncIterator[User]:
+    """
+    Все пользователи по возрастанию id через серверный курсор: строки читаются порциями
+    по settings.stream_batch_size, весь список в память не загружается.
+
+    :param db:
+    :return: асинхронный итератор пользователей
+    """
+
+    stmt = select(User).order_by(User.id).execution_options(yield_per=settings.stream_batch_size)
+    return await db.stream_scalars(stmt)
+
+
+async def get_users_with_username(username: str, limit: int, db: AsyncSession) -> List[User]:
+    """
+    Получение списка пользователей, имя которых содержит строку (без учета регистра).
+    В PostgreSQL ILIKE использует GIN индекс pg_trgm, в SQLite поиск идет по таблице users_fts
+    с триграммным токенизатором. Строки короче трех символов не дают триграмм и ищутся перебором.
 
     :param username:
+    :param limit:
     :param db:
     :return:
     """
 
-    return db.query(User).filter(User.username.ilike(f'%{username}%')).all()
+    stmt = select(User)
+    if db.bind.dialect.name != 'sqlite' or len(username) < 3:
+        pattern = username.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        stmt = stmt.filter(User.username.ilike(f'%{pattern}%', escape='\\'))
+    else:
+        query = '"' + username.replace('"', '""') + '"'
+        stmt = stmt.join(users_fts, users_fts.c.rowid == User.id).filter(users_fts.c.users_fts.op('MATCH')(query))
+    users = await db.scalars(stmt.order_by(User.username, User.id).limit(limit))
+    return users.all()
 
 
-async def get_user_profile(username: str, db: Session) -> User:
+async def autocomplete_usernames(prefix: str, limit: int, db: AsyncSession) -> List[str]:
     """
-    Получение профиля пользователя по имени
+    Подсказки имен пользователей, начинающихся с prefix (без учета регистра), по алфавиту.
+    Берутся из отсортированного списка имен в памяти процесса, база читается только при его (пере)загрузке.
+
+    :param prefix:
+    :param limit:
+    :param db:
+    :return:
+    """
+
+    return await username_index.complete(prefix, limit, db)
+
+
+async def get_user_profile(username: str, db: AsyncSession) -> User:
+    """
+    Получение профиля пользователя по имени.
+    Количество фото, комментариев и оценок берется из счетчиков пользователя, без COUNT(*) по таблицам.
 
     :param username:
     :param db:
     :return:
     """
 
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).filter(User.username == username))
     if user:
         user_profile = UserProfileModel(
             username=user.username,
             email=user.email,
             avatar=user.avatar,
+            post_count=user.post_count,
+            comment_count=user.comment_count,
+            rates_count=user.rates_count,
             created_at=user.created_at,
             is_active=user.is_active
         )
@@ -144,7 +195,39 @@ async def get_user_profile(username: str, db: Session) -> User:
     return None
 
 
-async def ban_user(email: str, db: Session) -> None:
+async def get_user_profile_version(username: str, db: AsyncSession):
+    """
+    Получение id, времени последнего изменения и счетчиков профиля пользователя по имени, без загрузки профиля
+
+    :param username:
+    :param db:
+    :return:
+    """
+
+    row = await db.execute(select(User.id, User.updated_at, User.post_count, User.comment_count, User.rates_count)
+                           .filter(User.username == username).limit(1))
+    return row.first()
+
+
+async def change_user_counters(user_id: int, db: AsyncSession, **deltas) -> str | None:
+    """
+    Изменение счетчиков пользователя (post_count, comment_count, rates_count) в текущей транзакции.
+    Один UPDATE counter = counter + delta, параллельные изменения не теряются; updated_at не меняется.
+    После commit нужно вызвать profiles_cache.bump с возвращенным именем.
+
+    :param user_id:
+    :param db:
+    :param deltas: например post_count=1
+    :return: имя пользователя или None, если пользователя нет
+    """
+
+    values = {name: getattr(User, name) + delta for name, delta in deltas.items()}
+    result = await db.execute(update(User).where(User.id == user_id)
+                              .values(updated_at=User.updated_at, **values).returning(User.username))
+    return result.scalar_one_or_none()
+
+
+async def ban_user(email: str, db: AsyncSession) -> None:
     """
     Забанить пользователя
 
@@ -153,16 +236,19 @@ async def ban_user(email: str, db: Session) -> None:
     :return:
     """
 
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.scalar(select(User).filter(User.email == email))
     if user:
         user.is_active = False
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await principal_cache.invalidate(email)
+        await refresh_tokens.revoke_user(email)
+        await profiles_cache.bump(user.username)
+        await db.refresh(user)
         return user
     return None
 
 
-async def make_user_role(email: str, role: Role, db: Session) -> None:
+async def make_user_role(email: str, role: Role, db: AsyncSession) -> None:
     """
     Изменить роль пользователю
 
@@ -173,5 +259,6 @@ async def make_user_role(email: str, role: Role, db: Session) -> None:
     """
 
     user = await get_user_by_email(email, db)
-    user.role = role
-    db.commit()
+    user.roles = role
+    await db.commit()
+    await principal_cache.invalidate(email)
@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.db import get_read_db
+from src.database.models import Role
+from src.schemas import PhotoExport, CommentExport
+from src.repository import photos as repository_photos
+from src.repository import comments as repository_comments
+from src.services.ndjson import ndjson_response
+from src.services.roles import RoleChecker
+
+router = APIRouter(prefix='/admin', tags=["admin"])
+
+allowed_export = RoleChecker([Role.admin])
+
+
+@router.get("/export/photos", dependencies=[Depends(allowed_export)],
+            response_description="One photo per line, as application/x-ndjson")
+async def export_photos(db: AsyncSession = Depends(get_read_db)):
+    """
+    The export_photos function streams the photos of all users as newline delimited JSON, in id order.
+    Photos are read through a server-side cursor and serialized one by one, so the export never holds
+    the whole table in memory.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A streaming application/x-ndjson response
+    """
+    return ndjson_response(await repository_photos.stream_photos(db), PhotoExport, filename="photos.ndjson")
+
+
+@router.get("/export/comments", dependencies=[Depends(allowed_export)],
+            response_description="One comment per line, as application/x-ndjson")
+async def export_comments(db: AsyncSession = Depends(get_read_db)):
+    """
+    The export_comments function streams all comments as newline delimited JSON, in id order.
+    Comments are read through a server-side cursor and serialized one by one, so the export never holds
+    the whole table in memory.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A streaming application/x-ndjson response
+    """
+    return ndjson_response(await repository_comments.stream_comments(db), CommentExport,
+                           filename="comments.ndjson")
@@ -1,72 +1,84 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Security
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.conf.config import settings
+from src.database.db import get_db, get_read_db
 from src.schemas import UserModel, UserResponse, TokenModel
 from src.repository import users as repository_users
 from src.services.auth import auth_service
+from src.services.refresh_tokens import refresh_tokens
 
 router = APIRouter(prefix='/auth', tags=["auth"])
 security = HTTPBearer()
 
 
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, db: Session = Depends(get_db)):
+async def signup(body: UserModel, db: AsyncSession = Depends(get_db)):
     """
     The function creates a new user in the database.
 
     :param body: UserModel: Get the user information from the request body
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: A dict with two keys: user and detail
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User account already")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash_async(body.password)
     new_user = await repository_users.create_user(body, db)
     return new_user
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The function is used to authenticate a user.
+    Every login starts a new refresh token family, so each device keeps its own session.
 
     :param body: OAuth2PasswordRequestForm: Validate the request body
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A dict with the access_token, refresh_token and token type
     """
     user = await repository_users.get_user_by_email(body.username, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
-    if not auth_service.verify_password(body.password, user.password):
+    if not await auth_service.verify_password_async(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
     # Generate JWT
     access_token = await auth_service.create_access_token(data={"sub": user.email}, expires_delta=7200)
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    jti = refresh_tokens.new_token_id()
+    fid = await refresh_tokens.start_family(user.email, jti, settings.refresh_token_ttl)
+    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email, "jti": jti, "fid": fid},
+                                                            expires_delta=settings.refresh_token_ttl)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security),
+                        db: AsyncSession = Depends(get_read_db)):
     """
     The function is used to refresh the access token.
     It takes in a refresh token and returns an access_token, a new refresh_token, and the type of token (bearer).
+    The refresh token is rotated within its family in the refresh token store, the database is not written.
+    A refresh token that was already used revokes its family, the device has to log in again.
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A dictionary with the access_token, refresh_token and token_type
     """
     token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    claims = await auth_service.decode_refresh_claims(token)
+    email, jti, fid = claims.get("sub"), claims.get("jti"), claims.get("fid")
+    invalid_token = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    if not (email and jti and fid):
+        raise invalid_token
+    await auth_service.get_active_user(email, db, invalid_token)
+    new_jti = refresh_tokens.new_token_id()
+    if not await refresh_tokens.rotate(fid, email, jti, new_jti, settings.refresh_token_ttl):
+        raise invalid_token
 
     access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    refresh_token = await auth_service.create_refresh_token(data={"sub": email, "jti": new_jti, "fid": fid},
+                                                            expires_delta=settings.refresh_token_ttl)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
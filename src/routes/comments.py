@@ -1,8 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
-from src.schemas import CommentBase, CommentUpdate, CommentModel
+from src.database.db import get_db, get_read_db
+from src.schemas import CommentBase, CommentUpdate, CommentModel, CommentPage
 from src.repository import comments as repository_comments
 from src.services.auth import auth_service
 from src.services.roles import RoleChecker
@@ -17,7 +17,7 @@ allowed_remove_comments = RoleChecker([Role.admin, Role.moderator])
 
 
 @router.post("/new/{post_id}", response_model=CommentModel, dependencies=[Depends(allowed_create_comments)])
-async def create_comment(photo_id: int, body: CommentBase, db: Session = Depends(get_db),
+async def create_comment(photo_id: int, body: CommentBase, db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The create_comment function creates a new comment for the photo with the given ID.
@@ -26,16 +26,35 @@ async def create_comment(photo_id: int, body: CommentBase, db: Session = Depends
 
     :param photo_id: int: Specify the photo that the comment is being created for
     :param body: CommentBase: Validate the request body
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the user that is currently logged in
     :return: A comment object
     """
     new_comment = await repository_comments.create_comment(photo_id, body, db, current_user)
+    if new_comment is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="PHOTO NOT FOUND")
     return new_comment
 
 
+@router.get("/photo/{photo_id}", response_model=CommentPage, dependencies=[Depends(allowed_get_comments)])
+async def read_photo_comments(photo_id: int, cursor: str = None, limit: int = Query(default=25, ge=1, le=100),
+                              db: AsyncSession = Depends(get_read_db)):
+    """
+    The read_photo_comments function returns a page of the comments of a photo, oldest first.
+    Pass the next_cursor of the response as cursor to get the following page; it is null on the last page.
+
+    :param photo_id: int: Specify the photo whose comments are returned
+    :param cursor: str: The next_cursor of the previous page, omit for the first page
+    :param limit: int: Limit the number of comments returned
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A page of comment objects and the next cursor
+    """
+    comments, next_cursor = await repository_comments.get_comments_page(photo_id, cursor, limit, db)
+    return {"items": comments, "next_cursor": next_cursor}
+
+
 @router.put("/update/{comment_id}", response_model=CommentUpdate, dependencies=[Depends(allowed_update_comments)])
-async def update_comment(comment_id: int, body: CommentBase, db: Session = Depends(get_db),
+async def update_comment(comment_id: int, body: CommentBase, db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_comment function is used to edit a comment.
@@ -45,7 +64,7 @@ async def update_comment(comment_id: int, body: CommentBase, db: Session = Depen
 
     :param comment_id: int: Specify the comment that is to be deleted
     :param body: CommentBase: Pass the new comment body to the update_comment function
-    :param db: Session: Connect to the database
+    :param db: AsyncSession: Connect to the database
     :param current_user: User: Get the current user
     :return: The edited comment
     """
@@ -56,7 +75,7 @@ async def update_comment(comment_id: int, body: CommentBase, db: Session = Depen
 
 
 @router.delete("/delete/{comment_id}", response_model=CommentModel, dependencies=[Depends(allowed_remove_comments)])
-async def delete_comment(comment_id: int, db: Session = Depends(get_db),
+async def delete_comment(comment_id: int, db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The delete_comment function deletes a comment from the database.
@@ -64,7 +83,7 @@ async def delete_comment(comment_id: int, db: Session = Depends(get_db),
         and returns a dictionary containing information about that comment.
 
     :param comment_id: int: Get the comment id from the url
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Check if the user is logged in or not
     :return: A comment object, which is the deleted comment
     """
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, HTTPException, Depends, status
+
+from src.database.models import User
+from src.schemas import JobResponse
+from src.services.auth import auth_service
+from src.services.jobs import job_queue
+
+router = APIRouter(prefix='/jobs', tags=["jobs"])
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def read_job(job_id: str, current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The read_job function returns the status of a background job started by the current user,
+    e.g. an upload or a transformation requested with background=true.
+
+    :param job_id: str: The id returned in the 202 Accepted response
+    :param current_user: User: Get the current user
+    :return: The job with its status, progress, result and error
+    """
+    job = await job_queue.get(job_id)
+    if job is None or job['user_id'] != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
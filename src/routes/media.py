@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import FileResponse
+
+from src.services.storage import storage, LocalStorage, sniff_image_type
+
+router = APIRouter(prefix='/media', tags=["media"])
+
+
+@router.get("/{key:path}")
+async def read_media(key: str):
+    """
+    The read_media function serves an asset stored by the local storage backend.
+    The file is streamed from disk by FileResponse, it is never loaded into memory as a whole.
+
+    :param key: str: The key of the asset, e.g. PhotoShareApp/username
+    :return: The file of the asset
+    """
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    path = storage.path(key)
+    if not path.is_file():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    with open(path, 'rb') as file:
+        media_type = sniff_image_type(file.read(12)) or 'application/octet-stream'
+    return FileResponse(path, media_type=media_type)
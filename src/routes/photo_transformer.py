@@ -1,31 +1,42 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import StreamingResponse
 
 from src.database.db import get_db
 from src.database.models import User
 from src.schemas import PhotoResponse
 from src.services.auth import auth_service
-from src.schemas_of_transformation import TransformerModel
-from src.repository.photo_transformer import transformer, show_qr_code
+from src.schemas_of_transformation import TransformerModel, QRCodesExportModel
+from src.conf.config import settings
+from src.repository.photo_transformer import transformer, show_qr_code, get_qr_code_url, get_qr_code_urls
+from src.services.conditional import etag_matches
+from src.services.jobs import job_queue, accepted_response
+from src.services.qr_cache import qr_cache, zip_qr_codes
+from src.services.transform_cache import transform_cache, KEY_PATTERN
 
 router = APIRouter(prefix='/transformer', tags=["transformer"])
 
 
 @router.patch("/{photo_id}", response_model=PhotoResponse, status_code=status.HTTP_200_OK)
-async def photo_transform(photo_id: int, body: TransformerModel, db: Session = Depends(get_db),
+async def photo_transform(photo_id: int, body: TransformerModel, background: bool = False,
+                          db: AsyncSession = Depends(get_db),
                           current_user: User = Depends(auth_service.get_current_user)):
     """
     The photo_transform function takes a photo_id and a TransformerModel object as input.
     It then calls the transformer function, which returns either an image or None if no image is found.
     If an image is returned, it will be sent back to the client in JSON format.
+    With background=true the transformation runs in a worker and the function returns 202 Accepted with a job id.
 
     :param photo_id: int: Specify the photo id of the image to be transformed
     :param body: TransformerModel: Get the data from the request body
-    :param db: Session: Get a database session
+    :param background: bool: Run the transformation in a background job
+    :param db: AsyncSession: Get a database session
     :param current_user: User: Get the current user from the database
     :return: The transformed image
     """
+    if background:
+        job = await job_queue.enqueue('transform_photo', {'photo_id': photo_id, 'body': body.dict()}, current_user.id)
+        return accepted_response(job)
     photo = await transformer(photo_id, body, current_user, db)
     if photo is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Image not found')
@@ -33,7 +44,7 @@ async def photo_transform(photo_id: int, body: TransformerModel, db: Session = D
 
 
 @router.post("/qr_code/{photo_id}", status_code=status.HTTP_201_CREATED)
-def show_qr(photo_id: int, db: Session = Depends(get_db),
+async def show_qr(photo_id: int, db: AsyncSession = Depends(get_db),
             current_user: User = Depends(auth_service.get_current_user)):
     """
     The show_qr function takes a photo_id and returns the QR code for that image.
@@ -42,11 +53,81 @@ def show_qr(photo_id: int, db: Session = Depends(get_db),
         an image/png file with status code 201.
 
     :param photo_id: int: Specify the id of the photo to be shown
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the user that is currently logged in
     :return: A streamingresponse object, which is a subclass of response
     """
-    photo = show_qr_code(photo_id, current_user, db)
+    photo = await show_qr_code(photo_id, current_user, db)
     if photo is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Image not found')
     return StreamingResponse(photo, media_type="image/png", status_code=status.HTTP_201_CREATED)
+
+
+@router.post("/qr_codes/export")
+async def export_qr_codes(body: QRCodesExportModel, db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The export_qr_codes function streams a ZIP archive with the QR codes of several photos of the current user.
+    The photos are given by photo_ids, by a tag or by both, with neither all transformed photos of the user are
+    exported. Photos without a transformation are skipped. Each code is named <photo id>.png.
+
+    :param body: QRCodesExportModel: The ids of the photos and/or the tag
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the user that is currently logged in
+    :return: A streaming application/zip response
+    """
+    codes = await get_qr_code_urls(body.photo_ids, body.tag, current_user, db)
+    if not codes:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Image not found')
+    return StreamingResponse(zip_qr_codes(codes, qr_cache, settings.qr_export_concurrency),
+                             media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="qr_codes.zip"'})
+
+
+@router.get("/qr_code/{photo_id}")
+async def read_qr(photo_id: int, request: Request, db: AsyncSession = Depends(get_db),
+                  current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The read_qr function returns the QR code of the transformed photo from the QR code cache.
+    The response carries a strong ETag derived from the encoded url, a request with a matching
+    If-None-Match header gets 304 Not Modified without the image.
+
+    :param photo_id: int: Specify the id of the photo
+    :param request: Request: Read the If-None-Match header
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the user that is currently logged in
+    :return: The QR code as a PNG image
+    """
+    url = await get_qr_code_url(photo_id, current_user, db)
+    if not url:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Image not found')
+    headers = {"ETag": qr_cache.etag(url), "Cache-Control": "private, no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(await qr_cache.get(url), media_type="image/png", headers=headers)
+
+
+def _read_chunks(file, chunk_size: int = 64 * 1024):
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+@router.get("/image/{key}")
+async def read_transformed_image(key: str, request: Request):
+    """
+    The read_transformed_image function serves a transformed image from the transform cache.
+    The image is rendered on the first request for the key. A key names the content of the source
+    as well as the transformation, so clients and proxies may cache the response forever;
+    a request with a matching If-None-Match header gets 304 Not Modified without the image.
+
+    :param key: str: The key of the transformed image, as in the url set by photo_transform
+    :param request: Request: Read the If-None-Match header
+    :return: The PNG image
+    """
+    headers = {"ETag": f'"{key}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if KEY_PATTERN.fullmatch(key) and etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    image = await transform_cache.get(key)
+    headers["Content-Length"] = str(image.size)
+    return StreamingResponse(_read_chunks(image.file), media_type="image/png", headers=headers)
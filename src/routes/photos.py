@@ -1,16 +1,20 @@
+import json
 from typing import List
 
-from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Request
+from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Request, Response, Query
+from fastapi.encoders import jsonable_encoder
 from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
-import cloudinary.uploader
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.conf.config import cloudinary_config
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
 from src.database.models import User
-from src.schemas import PhotoResponse, PhotoUpdate, PhotoTitleUpdate, PhotoDescriptionUpdate
+from src.schemas import PhotoResponse, PhotoPage, PhotoUpdate, PhotoTitleUpdate, PhotoDescriptionUpdate
 from src.repository import photos as repository_photos
 from src.services.auth import auth_service
+from src.services.conditional import conditional_response, make_etag
+from src.services.response_cache import photos_cache
+from src.services.uploads import read_image_upload
+from src.services.jobs import job_queue, stage_upload, accepted_response
 
 
 router = APIRouter(prefix='/photos', tags=["photos"])
@@ -18,34 +22,88 @@ router = APIRouter(prefix='/photos', tags=["photos"])
 
 @router.get("/", response_model=List[PhotoResponse], description='No more than 10 requests per minute',
             dependencies=[Depends(RateLimiter(times=3, seconds=5))])
-async def read_photos(skip: int = 0, limit: int = 25, db: Session = Depends(get_db),
+async def read_photos(request: Request, response: Response, skip: int = 0, limit: int = 25,
+                      db: AsyncSession = Depends(get_db),
                       current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_photos function returns a list of photos.
+    The serialized list is cached per user and query in the photos response cache, writes to the user's
+    photos invalidate it. A cache miss reads the primary, not the replica: a lagging replica could
+    store a stale list under the version bumped by the last write. Cache hits do not query the database.
+    The response has an ETag, a request with a matching If-None-Match gets 304 Not Modified.
+    There is no Last-Modified, a deletion does not make the list newer.
 
+    :param request: Request: Read the conditional headers
+    :param response: Response: Receive the validators
     :param skip: int: Skip a number of photos in the database
     :param limit: int: Limit the number of photos returned
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user from the database
     :return: A list of photo objects
     """
-    photos = await repository_photos.get_photos(skip, limit, current_user, db)
-    return photos
+    cache_version = await photos_cache.version(current_user.id)
+    cached = await photos_cache.get(current_user.id, cache_version, skip=skip, limit=limit)
+    if cached is None:
+        version = await repository_photos.get_photos_version(current_user, db)
+        etag = make_etag('photos', current_user.id, skip, limit, *version)
+        not_modified = conditional_response(request, response, etag)
+        if not_modified:
+            return not_modified
+        photos = await repository_photos.get_photos(skip, limit, current_user, db)
+        body = json.dumps(jsonable_encoder([PhotoResponse.from_orm(photo) for photo in photos]),
+                          ensure_ascii=False, separators=(',', ':'))
+        cached = {"etag": etag, "body": body}
+        await photos_cache.set(current_user.id, cache_version, cached, skip=skip, limit=limit)
+    else:
+        not_modified = conditional_response(request, response, cached["etag"])
+        if not_modified:
+            return not_modified
+    return Response(cached["body"], media_type="application/json", headers=dict(response.headers))
+
+
+@router.get("/cursor/", response_model=PhotoPage, description='No more than 10 requests per minute',
+            dependencies=[Depends(RateLimiter(times=3, seconds=5))])
+async def read_photos_cursor(cursor: str = None, limit: int = Query(default=25, ge=1, le=100),
+                             db: AsyncSession = Depends(get_read_db),
+                             current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The read_photos_cursor function returns a page of the current user's photos, newest first.
+    Pass the next_cursor of the response as cursor to get the following page; it is null on the last page.
+
+    :param cursor: str: The next_cursor of the previous page, omit for the first page
+    :param limit: int: Limit the number of photos returned
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the current user from the database
+    :return: A page of photo objects and the next cursor
+    """
+    photos, next_cursor = await repository_photos.get_photos_page(cursor, limit, current_user, db)
+    return {"items": photos, "next_cursor": next_cursor}
 
 
 @router.get("/{photo_id}", response_model=PhotoResponse, description='No more than 10 requests per minute',
             dependencies=[Depends(RateLimiter(times=3, seconds=5))])
-async def read_photo_id(photo_id: int, db: Session = Depends(get_db),
+async def read_photo_id(photo_id: int, request: Request, response: Response,
+                        db: AsyncSession = Depends(get_read_db),
                         current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_photo_id function is a GET request that returns the photo with the given ID.
     If no such photo exists, it raises an HTTP 404 error.
+    The response has ETag and Last-Modified from updated_at, a request with a matching If-None-Match
+    or If-Modified-Since gets 304 Not Modified without the photo being loaded.
 
     :param photo_id: int: Specify the photo id of the image to be deleted
-    :param db: Session: Pass the database session to the function
+    :param request: Request: Read the conditional headers
+    :param response: Response: Receive the validators
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user
     :return: A photo object
     """
+    updated_at = await repository_photos.get_photo_version(photo_id, current_user, db)
+    if updated_at is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    not_modified = conditional_response(request, response, make_etag('photo', photo_id, updated_at), updated_at)
+    if not_modified:
+        return not_modified
     photo = await repository_photos.get_photos_by_id(photo_id, current_user, db)
     if photo is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
@@ -55,19 +113,23 @@ async def read_photo_id(photo_id: int, db: Session = Depends(get_db),
 @router.get("/search/{information}", response_model=List[PhotoResponse],
             description='No more than 10 requests per minute',
             dependencies=[Depends(RateLimiter(times=3, seconds=5))])
-async def read_photos_info(information: str, db: Session = Depends(get_db),
+async def read_photos_info(information: str, skip: int = 0, limit: int = Query(default=25, ge=1, le=100),
+                           db: AsyncSession = Depends(get_read_db),
                            current_user: User = Depends(auth_service.get_current_user)):
     """
-    The read_photos_info function will return a photo based on the information provided.
-        The function will first check if the user is logged in, and then it will search for a photo with that information.
+    The read_photos_info function will return photos based on the information provided.
+        The function will first check if the user is logged in, and then it will run a full-text search
+        over the titles and descriptions of their photos. Results are ranked, best match first.
         If no such photo exists, an HTTP 404 error code is returned.
 
     :param information: str: Get the information of a photo
-    :param db: Session: Get the database session
+    :param skip: int: Skip a number of matches
+    :param limit: int: Limit the number of photos returned
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user
     :return: Information about the photo by id
     """
-    contact = await repository_photos.get_photos_by_info(information, current_user, db)
+    contact = await repository_photos.get_photos_by_info(information, skip, limit, current_user, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Photo not found")
     return contact
@@ -76,33 +138,44 @@ async def read_photos_info(information: str, db: Session = Depends(get_db),
 @router.post("/", response_model=PhotoResponse, status_code=status.HTTP_201_CREATED,
              description='No more than 10 requests per minute',
              dependencies=[Depends(RateLimiter(times=3, seconds=5))])
-async def create_photo(title: str, description: str, tags: list, db: Session = Depends(get_db),
-                       file: UploadFile = File(),
+async def create_photo(request: Request, title: str, description: str, tags: list, background: bool = False,
+                       db: AsyncSession = Depends(get_db), file: UploadFile = File(),
                        current_user: User = Depends(auth_service.get_current_user)):
     """
     The create_photo function creates a new photo in the database.
         It takes in a title, description, and tags for the photo as well as an image file to upload.
-        The function then uses Cloudinary's API to upload the image file and return its URL.
+        The file is checked (size limit, image format) and hashed while it is received, so storage reads it once.
+        The function then uploads the image file to the storage backend and builds its URL,
+        unless the same image was uploaded before, in which case the stored image is reused.
         Finally, it returns a JSON response containing information about the newly created photo.
+        With background=true the checked file is handed to a worker instead and the function returns
+        202 Accepted with a job id; poll /api/jobs/{job_id} for the id of the created photo.
 
+    :param request: Request: Get the digest of the file computed while it was received
     :param title: str: Set the title of the photo
     :param description: str: Specify the description of the photo
     :param tags: list: Create a list of tags for the photo
-    :param db: Session: Pass the database session to the repository function
+    :param background: bool: Store the photo in a background job
+    :param db: AsyncSession: Pass the database session to the repository function
     :param file: UploadFile: Get the file from the request
     :param current_user: User: Get the current user's username and id
     :return: A photo object
     """
-    cloudinary_config()
-    r = cloudinary.uploader.upload(file.file, public_id=f'PhotoShareApp/{current_user.username}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'PhotoShareApp/{current_user.username}') \
-        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-    return await repository_photos.create_photo(title, description, tags, src_url, current_user, db)
+    upload = await read_image_upload(file, request)
+    if background:
+        staged_path = await stage_upload(upload.file)
+        job = await job_queue.enqueue('upload_photo', {'title': title, 'description': description, 'tags': tags,
+                                                       'content_hash': upload.sha256, 'staged_path': staged_path},
+                                      current_user.id)
+        return accepted_response(job)
+    key, src_url = await repository_photos.save_asset(upload.file, upload.sha256, current_user, db)
+    return await repository_photos.create_photo(title, description, tags, src_url, current_user, db,
+                                                content_hash=upload.sha256, storage_key=key)
 
 
 @router.put("/{photo_id}", response_model=PhotoResponse, description='No more than 10 requests per minute',
             dependencies=[Depends(RateLimiter(times=3, seconds=5))])
-async def update_photo(body: PhotoUpdate, photo_id: int, db: Session = Depends(get_db),
+async def update_photo(body: PhotoUpdate, photo_id: int, db: AsyncSession = Depends(get_db),
                        current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_photo function updates a photo in the database.
@@ -114,7 +187,7 @@ async def update_photo(body: PhotoUpdate, photo_id: int, db: Session = Depends(g
 
     :param body: PhotoUpdate: Get the information from the request body
     :param photo_id: int: Specify the id of the photo to be deleted
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user from the database
     :return: A photo object
     """
@@ -125,7 +198,7 @@ async def update_photo(body: PhotoUpdate, photo_id: int, db: Session = Depends(g
 
 
 @router.patch("/title/{photo_id}", response_model=PhotoResponse)
-async def update_title_photo(body: PhotoTitleUpdate, photo_id: int, db: Session = Depends(get_db),
+async def update_title_photo(body: PhotoTitleUpdate, photo_id: int, db: AsyncSession = Depends(get_db),
                              current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_title_photo function updates the title of a photo.
@@ -136,7 +209,7 @@ async def update_title_photo(body: PhotoTitleUpdate, photo_id: int, db: Session
 
     :param body: PhotoTitleUpdate: Get the new title from the request body
     :param photo_id: int: Get the photo id from the url
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the current user
     :return: The updated photo object
     """
@@ -147,18 +220,18 @@ async def update_title_photo(body: PhotoTitleUpdate, photo_id: int, db: Session
 
 
 @router.patch("/description/{photo_id}", response_model=PhotoResponse)
-async def update_description_photo(body: PhotoDescriptionUpdate, photo_id: int, db: Session = Depends(get_db),
+async def update_description_photo(body: PhotoDescriptionUpdate, photo_id: int, db: AsyncSession = Depends(get_db),
                                    current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_description_photo function updates the description of a photo.
         The function takes in a PhotoDescriptionUpdate object, which contains the new description for the photo.
         It also takes in an integer representing the id of the photo to be updated and two optional parameters:
-            - db: Session = Depends(get_db) is used to access our database using SQLAlchemy's session object.
+            - db: AsyncSession = Depends(get_db) is used to access our database using SQLAlchemy's session object.
                 This parameter is optional because it has a default value (Depends(get_db)) that will be used if no value is passed into this parameter when calling update_description_photo().
 
     :param body: PhotoDescriptionUpdate: Get the description from the request body
     :param photo_id: int: Identify the photo that is being updated
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param current_user: User: Check if the user is logged in
     :return: A photo object
     """
@@ -170,7 +243,7 @@ async def update_description_photo(body: PhotoDescriptionUpdate, photo_id: int,
 
 @router.delete("/{photo_id}", response_model=PhotoResponse, description='No more than 10 requests per minute',
                dependencies=[Depends(RateLimiter(times=3, seconds=5))])
-async def remove_photo(photo_id: int, db: Session = Depends(get_db),
+async def remove_photo(photo_id: int, db: AsyncSession = Depends(get_db),
                        current_user: User = Depends(auth_service.get_current_user)):
     """
     The remove_photo function removes a photo from the database.
@@ -178,7 +251,7 @@ async def remove_photo(photo_id: int, db: Session = Depends(get_db),
         and returns a dictionary containing information about that image.
 
     :param photo_id: int: Specify the id of the photo to be removed
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user and check if they are authorized to delete the image
     :return: A photo object
     """
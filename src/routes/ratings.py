@@ -0,0 +1,68 @@
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Depends, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.db import get_db, get_read_db
+from src.schemas import PhotoResponse, RatingBase
+from src.repository import ratings as repository_ratings
+from src.services.auth import auth_service
+from src.services.roles import RoleChecker
+from src.database.models import User, Role
+
+router = APIRouter(prefix='/ratings', tags=["ratings"])
+
+allowed_get_ratings = RoleChecker([Role.admin, Role.moderator, Role.user])
+allowed_rate_photos = RoleChecker([Role.admin, Role.moderator, Role.user])
+
+
+@router.get("/top", response_model=List[PhotoResponse], dependencies=[Depends(allowed_get_ratings)])
+async def read_top_rated(skip: int = 0, limit: int = Query(default=25, ge=1, le=100),
+                         min_rating: float = Query(default=None, ge=1, le=5),
+                         db: AsyncSession = Depends(get_read_db)):
+    """
+    The read_top_rated function returns the rated photos with the highest average rating first.
+    Declared before the /{photo_id} routes so "top" is never taken for a photo id.
+
+    :param skip: int: Skip a number of photos
+    :param limit: int: Limit the number of photos returned
+    :param min_rating: float: Only return photos rated at least this on average
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A list of photo objects
+    """
+    return await repository_ratings.get_top_rated(skip, limit, min_rating, db)
+
+
+@router.post("/{photo_id}", response_model=PhotoResponse, dependencies=[Depends(allowed_rate_photos)])
+async def rate_photo(photo_id: int, body: RatingBase, db: AsyncSession = Depends(get_db),
+                     current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The rate_photo function rates a photo from 1 to 5, rating it again changes the rating of the user.
+
+    :param photo_id: int: Specify the photo that is rated
+    :param body: RatingBase: Validate the rating
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the user that is currently logged in
+    :return: The photo with its updated rating_avg and rating_count
+    """
+    photo = await repository_ratings.rate_photo(photo_id, body.rate, current_user, db)
+    if photo is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="PHOTO NOT FOUND")
+    return photo
+
+
+@router.delete("/{photo_id}", response_model=PhotoResponse, dependencies=[Depends(allowed_rate_photos)])
+async def unrate_photo(photo_id: int, db: AsyncSession = Depends(get_db),
+                       current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The unrate_photo function removes the rating the current user gave a photo.
+
+    :param photo_id: int: Specify the photo that was rated
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the user that is currently logged in
+    :return: The photo with its updated rating_avg and rating_count
+    """
+    photo = await repository_ratings.unrate_photo(photo_id, current_user, db)
+    if photo is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="RATING NOT FOUND")
+    return photo
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.repository.tags import create_tag as repository_create_tag
 from src.repository.tags import update_tag as repository_update_tag
@@ -16,13 +16,13 @@ router = APIRouter(prefix='/tags', tags=["tags"])
 
 @router.post("/new/", response_model=TagResponse)
 async def create_tag(body: TagBase, current_user: User = Depends(auth_service.get_current_user),
-                     db: Session = Depends(get_db)):
+                     db: AsyncSession = Depends(get_db)):
     """
     The create_tag function creates a new tag in the database.
 
     :param body: TagBase: Create a new tag
     :param current_user: User: Get the current user from the auth_service
-    :param db: Session: Pass the database session to the repository function
+    :param db: AsyncSession: Pass the database session to the repository function
     :return: A tag object
     """
     return await repository_create_tag(body, current_user, db)
@@ -30,7 +30,7 @@ async def create_tag(body: TagBase, current_user: User = Depends(auth_service.ge
 
 @router.put("/update_tag/{tag_id}", response_model=TagResponse, dependencies=[Depends(allowed_edit_hashtag)])
 async def update_tag(body: TagBase, tag_id: int, current_user: User = Depends(auth_service.get_current_user),
-                     db: Session = Depends(get_db)):
+                     db: AsyncSession = Depends(get_db)):
     """
     The update_tag function updates a tag in the database.
         The function takes three arguments:
@@ -44,7 +44,7 @@ async def update_tag(body: TagBase, tag_id: int, current_user: User = Depends(au
     :param body: TagBase: Get the data from the request body
     :param tag_id: int: Specify which tag to delete
     :param current_user: User: Get the current user who is logged in
-    :param db: Session: Pass the database session to the repository function
+    :param db: AsyncSession: Pass the database session to the repository function
     :return: A tag object
     """
     tag = await repository_update_tag(tag_id, body, db)
@@ -1,16 +1,21 @@
 #routes/users.py
 from typing import List
 
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from src.database.db import get_db
-from src.schemas import UserResponse, UserProfileModel, RequestEmail, RequestRole
+from src.database.db import get_db, get_read_db
+from src.schemas import UserResponse, UserPage, UserProfileModel, RequestEmail, RequestRole
 from src.services.auth import auth_service
+from src.services.conditional import conditional_response, make_etag
+from src.services.ndjson import wants_ndjson, ndjson_response
+from src.services.response_cache import profiles_cache
 from src.services.roles import RoleChecker
 from src.database.models import Role, User
 from src.repository import users as repository_users
+from src.services.uploads import read_image_upload
 
 router = APIRouter(prefix='/users', tags=["users"])
 
@@ -24,37 +29,55 @@ allowed_change_user_role = RoleChecker([Role.admin])
 
 
 @router.get("/users/", response_model=List[UserResponse], tags=['users'])
-async def get_users(db: Session = Depends(get_db)):
+async def get_users(request: Request, output_format: str = Query(default=None, alias='format', regex='^(json|ndjson)$'),
+                    db: AsyncSession = Depends(get_read_db)):
     """
     Получить всех пользователей
 
+    С format=ndjson или заголовком Accept: application/x-ndjson пользователи отдаются потоком,
+    по одному JSON объекту на строку, без загрузки всего списка в память.
+    :param request:
+    :param output_format:
     :param db:
     :return:
     """
-    return db.query(User).all()
+    if wants_ndjson(request, output_format):
+        return ndjson_response(await repository_users.stream_users(db), UserResponse)
+    users = await db.scalars(select(User))
+    return users.all()
 
 
 @router.get("/my/", response_model=UserResponse)
-async def info_my_profile(current_user: User = Depends(auth_service.get_current_user),
-                          db: Session = Depends(get_db)):
+async def info_my_profile(request: Request, response: Response,
+                          current_user: User = Depends(auth_service.get_current_user),
+                          db: AsyncSession = Depends(get_read_db)):
     """
     Функция возвращает информацию о профиле текущего пользователя.
+    Ответ содержит ETag и Last-Modified по updated_at, на условный запрос с актуальными данными возвращается 304.
 
+    :param request:
+    :param response:
     :param current_user:
     :param db:
     :return:
     """
 
+    not_modified = conditional_response(request, response, make_etag('me', current_user.id, current_user.updated_at),
+                                        current_user.updated_at)
+    if not_modified:
+        return not_modified
     user = await repository_users.get_me(current_user, db)
     return user
 
 
 @router.put("/edit_me/", response_model=UserResponse, tags=['users'])
-async def edit_my_profile(avatar: UploadFile = File(), new_username: str = Form(None),
-                          current_user: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db)):
+async def edit_my_profile(request: Request, avatar: UploadFile = File(), new_username: str = Form(None),
+                          current_user: User = Depends(auth_service.get_current_user),
+                          db: AsyncSession = Depends(get_db)):
     """
     Функция edit_my_profile позволяет пользователю редактировать свой профиль.
 
+    :param request:
     :param avatar:
     :param new_username:
     :param current_user:
@@ -62,12 +85,13 @@ async def edit_my_profile(avatar: UploadFile = File(), new_username: str = Form(
     :return:
     """
 
-    updated_user = await repository_users.edit_my_profile(avatar, new_username, current_user, db)
+    upload = await read_image_upload(avatar, request)
+    updated_user = await repository_users.edit_my_profile(upload, new_username, current_user, db)
     return updated_user
 
 
 @router.get("/all", response_model=List[UserResponse], dependencies=[Depends(allowed_get_all_users)])
-async def read_all_users(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
+async def read_all_users(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_read_db)):
     """
     Получить всех пользователей
 
@@ -76,51 +100,111 @@ async def read_all_users(skip: int = 0, limit: int = 10, db: Session = Depends(g
     :param db:
     :return:
     """
-    return db.query(User).offset(skip).limit(limit).all()
+    return await repository_users.get_users(skip, limit, db)
+
+
+@router.get("/all/cursor/", response_model=UserPage, dependencies=[Depends(allowed_get_all_users)])
+async def read_all_users_cursor(cursor: str = None, limit: int = Query(default=10, ge=1, le=100),
+                                db: AsyncSession = Depends(get_read_db)):
+    """
+    Получить страницу пользователей по курсору. next_cursor из ответа передается как cursor
+    для следующей страницы, на последней странице он равен null.
+
+    :param cursor:
+    :param limit:
+    :param db:
+    :return:
+    """
+    users, next_cursor = await repository_users.get_users_page(cursor, limit, db)
+    return {"items": users, "next_cursor": next_cursor}
 
 
 @router.get("/users_with_username/{username}", response_model=List[UserResponse],
             dependencies=[Depends(allowed_get_user)])
-async def read_users_by_username(username: str, db: Session = Depends(get_db),
+async def read_users_by_username(username: str, limit: int = Query(default=25, ge=1, le=100),
+                                 db: AsyncSession = Depends(get_read_db),
                                  current_user: User = Depends(auth_service.get_current_user)):
     """
     Функция используется для чтения пользователей по имени пользователя.
 
-    Возвращается список пользователей с заданным именем пользователя.
+    Возвращается список пользователей (не больше limit), имя которых содержит заданную строку.
     :param username:
+    :param limit:
     :param db:
     :param current_user:
     :return:
     """
 
-    users = await repository_users.get_users_with_username(username, db)
+    users = await repository_users.get_users_with_username(username, limit, db)
     if not users:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
     return users
 
 
+@router.get("/autocomplete/", response_model=List[str], dependencies=[Depends(allowed_get_user)])
+async def autocomplete_usernames(prefix: str = Query(min_length=1, max_length=50),
+                                 limit: int = Query(default=10, ge=1, le=50),
+                                 db: AsyncSession = Depends(get_read_db),
+                                 current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Подсказки для поля поиска пользователей: имена, начинающиеся с prefix (без учета регистра), по алфавиту.
+
+    :param prefix:
+    :param limit:
+    :param db:
+    :param current_user:
+    :return:
+    """
+
+    return await repository_users.autocomplete_usernames(prefix, limit, db)
+
+
 @router.get("/user_profile_with_username/{username}", response_model=UserProfileModel,
             dependencies=[Depends(allowed_get_user)])
-async def read_user_profile_by_username(username: str, db: Session = Depends(get_db),
+async def read_user_profile_by_username(username: str, request: Request, response: Response,
+                                        db: AsyncSession = Depends(get_db),
                                         current_user: User = Depends(auth_service.get_current_user)):
     """
         Функция используется для чтения профиля пользователя по имени пользователя.
 
         Функция принимает имя пользователя в качестве аргумента и возвращает профиль пользователя, если он существует.
+        Ответ содержит ETag, на условный запрос с актуальными данными возвращается 304
+        без загрузки профиля. Last-Modified не отправляется: счетчики меняются без изменения updated_at,
+        и If-Modified-Since возвращал бы 304 с устаревшими счетчиками. Готовый профиль кешируется, запись в профиль или его счетчики сбрасывает кеш.
+        При промахе кеша профиль читается с основной базы: отстающая реплика могла бы сохранить
+        устаревший профиль под версией, которую только что увеличила запись.
     :param username:
+    :param request:
+    :param response:
     :param db:
     :param current_user:
     :return:
     """
 
-    user_profile = await repository_users.get_user_profile(username, db)
-    if user_profile is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
-    return user_profile
+    cache_version = await profiles_cache.version(username)
+    cached = await profiles_cache.get(username, cache_version)
+    if cached is None:
+        version = await repository_users.get_user_profile_version(username, db)
+        if version is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
+        etag = make_etag('profile', *version)
+        not_modified = conditional_response(request, response, etag)
+        if not_modified:
+            return not_modified
+        user_profile = await repository_users.get_user_profile(username, db)
+        if user_profile is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
+        cached = {"etag": etag, "body": user_profile.json()}
+        await profiles_cache.set(username, cache_version, cached)
+    else:
+        not_modified = conditional_response(request, response, cached["etag"])
+        if not_modified:
+            return not_modified
+    return Response(cached["body"], media_type="application/json", headers=dict(response.headers))
 
 
 @router.patch("/ban/{email}/", dependencies=[Depends(allowed_ban_user)])
-async def ban_user_by_email(body: RequestEmail, db: Session = Depends(get_db)):
+async def ban_user_by_email(body: RequestEmail, db: AsyncSession = Depends(get_db)):
     """
      Функция ban_user_by_email принимает адрес электронной почты пользователя и запрещает пользователю доступ к API.
 
@@ -144,7 +228,7 @@ async def ban_user_by_email(body: RequestEmail, db: Session = Depends(get_db)):
 
 
 @router.patch("/make_role/{email}/", dependencies=[Depends(allowed_change_user_role)])
-async def make_role_by_email(body: RequestRole, db: Session = Depends(get_db)):
+async def make_role_by_email(body: RequestRole, db: AsyncSession = Depends(get_db)):
     """
     Функция используется для изменения роли пользователя.
 
@@ -158,8 +242,8 @@ async def make_role_by_email(body: RequestRole, db: Session = Depends(get_db)):
     user = await repository_users.get_user_by_email(body.email, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="INVALID EMAIL")
-    if body.roles == user.role:
+    if body.roles == user.roles:
         return {"message": "USER ROLE EXISTS"}
     else:
-        await repository_users.make_user_role(body.email, body.role, db)
-        return {"message": f"USER CHANGE ROLE TO {body.role.value}"}
+        await repository_users.make_user_role(body.email, body.roles, db)
+        return {"message": f"USER CHANGE ROLE TO {body.roles.value}"}
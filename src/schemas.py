@@ -54,6 +54,9 @@ class PhotoResponse(PhotoBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    comment_count: int = 0
+    rating_count: int = 0
+    rating_avg: Optional[float]
 
     #    tags: List[TagResponse]
 
@@ -61,6 +64,16 @@ class PhotoResponse(PhotoBase):
         orm_mode = True
 
 
+class PhotoExport(PhotoResponse):
+    photo_url: Optional[str]
+    user_id: Optional[int]
+
+
+class PhotoPage(BaseModel):
+    items: List[PhotoResponse]
+    next_cursor: Optional[str]
+
+
 class UserModel(BaseModel):
     username: str = Field(min_length=6, max_length=12)
     email: EmailStr
@@ -79,6 +92,11 @@ class UserResponse(BaseModel):
         orm_mode = True
 
 
+class UserPage(BaseModel):
+    items: List[UserResponse]
+    next_cursor: Optional[str]
+
+
 class TokenModel(BaseModel):
     access_token: str
     refresh_token: str
@@ -120,8 +138,34 @@ class CommentModel(CommentBase):
         orm_mode = True
 
 
+class CommentPage(BaseModel):
+    items: List[CommentModel]
+    next_cursor: Optional[str]
+
+
+class CommentExport(CommentModel):
+    user_id: Optional[int]
+    photo_id: Optional[int]
+
+
 class CommentUpdate(CommentModel):
     updated_at = datetime
 
     class Config:
         orm_mode = True
+
+
+class RatingBase(BaseModel):
+    rate: int = Field(ge=1, le=5)
+
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    progress: int
+    result: Optional[dict]
+    error: Optional[str]
+    attempts: int
+    created_at: datetime
+    updated_at: datetime
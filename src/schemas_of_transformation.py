@@ -1,10 +1,17 @@
+from typing import List, Optional
+
 from pydantic import BaseModel, Field
 
+from src.conf.config import settings
+
+MAX_SIZE = settings.transform_max_size
+MAX_FONT_SIZE = settings.transform_max_font_size
+
 
 class CircleModel(BaseModel):
     use_filter: bool = False
-    height: int = Field(ge=0, default=400)
-    width: int = Field(ge=0, default=400)
+    height: int = Field(ge=0, le=MAX_SIZE, default=400)
+    width: int = Field(ge=0, le=MAX_SIZE, default=400)
 
 
 class EffectModel(BaseModel):
@@ -19,19 +26,19 @@ class ResizeModel(BaseModel):
     use_filter: bool = False
     crop: bool = False
     fill: bool = False
-    height: int = Field(ge=0, default=400)
-    width: int = Field(ge=0, default=400)
+    height: int = Field(ge=0, le=MAX_SIZE, default=400)
+    width: int = Field(ge=0, le=MAX_SIZE, default=400)
 
 
 class TextModel(BaseModel):
     use_filter: bool = False
-    font_size: int = Field(ge=0, default=70)
+    font_size: int = Field(ge=0, le=MAX_FONT_SIZE, default=70)
     text: str = Field(max_length=100, default="")
 
 
 class RotateModel(BaseModel):
     use_filter: bool = False
-    width: int = Field(ge=0, default=400)
+    width: int = Field(ge=0, le=MAX_SIZE, default=400)
     degree: int = Field(ge=-360, le=360, default=45)
 
 
@@ -41,3 +48,8 @@ class TransformerModel(BaseModel):
     resize: ResizeModel
     text: TextModel
     rotate: RotateModel
+
+
+class QRCodesExportModel(BaseModel):
+    photo_ids: Optional[List[int]] = Field(default=None, max_items=10000)
+    tag: Optional[str] = Field(default=None, max_length=25)
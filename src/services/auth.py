@@ -4,15 +4,18 @@ from typing import Optional
 from fastapi import HTTPException, status, Depends
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 
+from src.conf.config import settings
 from src.database.db import get_db
 from src.repository import users as repository_users
+from src.services.passwords import run_password_hashing
+from src.services.principal_cache import principal_cache
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
     SECRET_KEY = "secret_key"
     ALGORITHM = "HS256"
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
@@ -40,6 +43,27 @@ class Auth:
         """
         return self.pwd_context.hash(password)
 
+    async def verify_password_async(self, plain_password, hashed_password):
+        """
+        The function is verify_password run in the password hashing pool, use it in async handlers.
+
+        :param self: Represent the instance of the class
+        :param plain_password: Store the password that is entered by the user
+        :param hashed_password: Check if the password is correct
+        :return: A boolean value
+        """
+        return await run_password_hashing(self.verify_password, plain_password, hashed_password)
+
+    async def get_password_hash_async(self, password: str):
+        """
+        The function is get_password_hash run in the password hashing pool, use it in async handlers.
+
+        :param self: Represent the instance of the class
+        :param password: str: Get the password from the user
+        :return: A hash of the password
+        """
+        return await run_password_hashing(self.get_password_hash, password)
+
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
         """
         The create_access_token function creates a new access token for the user.
@@ -54,9 +78,9 @@ class Auth:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
-        encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
-        return encoded_refresh_token
+        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
+        encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        return encoded_access_token
 
     # define a function to generate a new refresh token
     async def create_refresh_token(self, data: dict, expires_delta: Optional[float] = None):
@@ -77,13 +101,15 @@ class Auth:
         encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_refresh_token
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
         """
         The function is a dependency that will be called by the FastAPI framework to retrieve the current user.
+        Only access tokens are accepted, a refresh token is only good for /api/auth/refresh_token.
+        The user comes from the principal cache, see get_active_user.
 
         :param self: Represent the instance of a class
         :param token: str: Get the token from the header of a request
-        :param db: Session: Get the database session
+        :param db: AsyncSession: Get the database session
         :return: The user object
         """
         credentials_exception = HTTPException(
@@ -95,7 +121,7 @@ class Auth:
         try:
             # Decode JWT
             payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'refresh_token':
+            if payload.get('scope') == 'access_token':
                 email = payload["sub"]
                 if email is None:
                     raise credentials_exception
@@ -104,9 +130,28 @@ class Auth:
         except JWTError as e:
             raise credentials_exception
 
-        user = await repository_users.get_user_by_email(email, db)
+        return await self.get_active_user(email, db, credentials_exception)
+
+    async def get_active_user(self, email: str, db: AsyncSession, not_found: HTTPException):
+        """
+        The function returns the user with the email from the principal cache, the database is only queried
+        on a miss. Banned (inactive) users are rejected with 403.
+
+        :param self: Represent the instance of a class
+        :param email: str: The subject of the token
+        :param db: AsyncSession: Get the database session
+        :param not_found: HTTPException: Raised if there is no such user
+        :return: The user object
+        """
+        user = await principal_cache.get(email)
         if user is None:
-            raise credentials_exception
+            generation = principal_cache.generation
+            user = await repository_users.get_user_by_email(email, db)
+            if user is None:
+                raise not_found
+            await principal_cache.put(user, generation)
+        if not user.is_active:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="USER NOT ACTIVE")
         return user
 
     async def decode_refresh_token(self, refresh_token: str):
@@ -117,11 +162,21 @@ class Auth:
         :param refresh_token: str: Pass the refresh token to the function
         :return: The email of the user
         """
+        payload = await self.decode_refresh_claims(refresh_token)
+        return payload['sub']
+
+    async def decode_refresh_claims(self, refresh_token: str):
+        """
+        The function takes a refresh token, verifies it and returns all its claims.
+
+        :param self: Represent the instance of the class
+        :param refresh_token: str: Pass the refresh token to the function
+        :return: The claims of the token: sub (the email), jti (the token id) and fid (the token family)
+        """
         try:
             payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
+                return payload
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
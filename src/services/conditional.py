@@ -0,0 +1,87 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts) -> str:
+    """
+    The make_etag function builds a strong entity tag from the values that determine a representation,
+    e.g. the id and updated_at of a row.
+
+    :param parts: The values the representation depends on
+    :return: The quoted entity tag
+    """
+    raw = json.dumps(parts, default=str, separators=(',', ':')).encode()
+    return f'"{hashlib.sha256(raw).hexdigest()[:32]}"'
+
+
+def _utc(value: datetime) -> datetime:
+    value = value.replace(microsecond=0)
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    The etag_matches function checks the If-None-Match header of a request against the current entity tag,
+    using the weak comparison that RFC 9110 prescribes for If-None-Match.
+
+    :param request: Request: The incoming request
+    :param etag: str: The quoted entity tag of the current representation
+    :return: True if the client already has the current representation and 304 Not Modified can be sent
+    """
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == current for tag in header.split(","))
+
+
+def not_modified_since(request: Request, last_modified: datetime | None) -> bool:
+    """
+    The not_modified_since function checks the If-Modified-Since header of a request, at the one second
+    resolution of HTTP dates. Naive datetimes from the database are taken as UTC.
+
+    :param request: Request: The incoming request
+    :param last_modified: datetime | None: When the representation last changed
+    :return: True if the representation has not changed since the date sent by the client
+    """
+    header = request.headers.get("If-Modified-Since")
+    if not header or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return _utc(last_modified) <= _utc(since)
+
+
+def conditional_response(request: Request, response: Response, etag: str,
+                         last_modified: datetime | None = None) -> Response | None:
+    """
+    The conditional_response function adds the validators of the current representation to the response
+    and answers a conditional request. If-None-Match takes precedence, If-Modified-Since is only
+    evaluated when it is absent. Validators are sent with Cache-Control: private, no-cache,
+    so clients revalidate every time and shared caches do not store per-user data.
+
+    :param request: Request: The incoming request
+    :param response: Response: The response of the route, receives the validators
+    :param etag: str: The entity tag from make_etag
+    :param last_modified: datetime | None: When the representation last changed, None to send no Last-Modified
+    :return: A 304 Not Modified response to return from the route, or None to build the full response
+    """
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_utc(last_modified), usegmt=True)
+    if request.headers.get("If-None-Match"):
+        fresh = etag_matches(request, etag)
+    else:
+        fresh = not_modified_since(request, last_modified)
+    if fresh:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import redis.asyncio as redis
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+from src.conf.config import settings
+from src.services.storage import run_storage_io
+
+
+class JobQueue(ABC):
+    """
+    A queue of background jobs with their status.
+    A job is a dictionary with id, kind, user_id, payload, status (queued, running, done, failed),
+    progress (0-100), result, error, attempts, created_at and updated_at.
+    A dequeued job stays in the list of the worker that took it until the worker finishes or requeues it,
+    so the jobs of a worker that dies are not lost: recover puts them back in the queue.
+    """
+
+    @staticmethod
+    def new_job(kind: str, payload: dict, user_id: int) -> dict:
+        now = datetime.utcnow().isoformat()
+        return {"id": uuid.uuid4().hex, "kind": kind, "user_id": user_id, "payload": payload, "status": "queued",
+                "progress": 0, "result": None, "error": None, "attempts": 0, "created_at": now, "updated_at": now}
+
+    @abstractmethod
+    async def enqueue(self, kind: str, payload: dict, user_id: int) -> dict:
+        """
+        The enqueue function stores a new job and puts it at the end of the queue.
+
+        :param kind: str: The name of the handler that runs the job
+        :param payload: dict: JSON serializable arguments of the handler
+        :param user_id: int: The owner of the job, only they can see its status
+        :return: The new job
+        """
+
+    @abstractmethod
+    async def requeue(self, worker: str, job_id: str, **fields) -> None:
+        """
+        The requeue function updates a job taken by a worker and puts it at the end of the queue again,
+        e.g. to retry it, in one step.
+
+        :param worker: str: The id of the worker that took the job
+        :param job_id: str: The id of the job
+        :param fields: The fields to change
+        :return: None
+        """
+
+    @abstractmethod
+    async def dequeue(self, worker: str, timeout: float) -> str | None:
+        """
+        The dequeue function waits for the next job and moves it to the list of the worker.
+
+        :param worker: str: The id of the worker
+        :param timeout: float: Seconds to wait
+        :return: The id of the job or None if the queue stayed empty
+        """
+
+    @abstractmethod
+    async def finish(self, worker: str, job_id: str, **fields) -> None:
+        """
+        The finish function updates a job taken by a worker, e.g. to done or failed, and removes it
+        from the list of the worker in one step. Without fields the job is only removed from the list.
+
+        :param worker: str: The id of the worker that took the job
+        :param job_id: str: The id of the job
+        :param fields: The fields to change
+        :return: None
+        """
+
+    @abstractmethod
+    async def heartbeat(self, worker: str, ttl: int) -> None:
+        """
+        The heartbeat function tells that a worker is alive for the next ttl seconds.
+
+        :param worker: str: The id of the worker
+        :param ttl: int: Seconds until the worker is considered dead
+        :return: None
+        """
+
+    @abstractmethod
+    async def recover(self) -> int:
+        """
+        The recover function puts the jobs of dead workers back in the queue.
+
+        :return: The number of jobs put back
+        """
+
+    @abstractmethod
+    async def get(self, job_id: str) -> dict | None:
+        """
+        The get function returns a job by id.
+
+        :param job_id: str: The id of the job
+        :return: The job or None if it does not exist or has expired
+        """
+
+    @abstractmethod
+    async def update(self, job_id: str, **fields) -> None:
+        """
+        The update function changes fields of a job, e.g. its status or progress.
+
+        :param job_id: str: The id of the job
+        :param fields: The fields to change
+        :return: None
+        """
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Jobs are kept in Redis hashes job:<id> that expire after job_ttl seconds, the queue is the list jobs:queue.
+    Any number of worker processes (python -m src.worker) can consume it.
+    A worker moves the job it takes to its list jobs:processing:<worker> with BLMOVE and keeps the key
+    jobs:worker:<worker> alive while it runs; workers are registered in the set jobs:workers.
+    """
+
+    QUEUE_KEY = "jobs:queue"
+    WORKERS_KEY = "jobs:workers"
+    JSON_FIELDS = ("payload", "result", "error")
+    INT_FIELDS = ("user_id", "progress", "attempts")
+
+    def __init__(self, client: redis.Redis):
+        self.client = client
+
+    @staticmethod
+    def _processing_key(worker: str) -> str:
+        return f"jobs:processing:{worker}"
+
+    def _encode(self, fields: dict) -> dict:
+        return {key: json.dumps(value) if key in self.JSON_FIELDS else value for key, value in fields.items()}
+
+    def _decode(self, fields: dict) -> dict:
+        job = {}
+        for key, value in fields.items():
+            if key in self.JSON_FIELDS:
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    # error text stored before error became a JSON field
+                    pass
+            elif key in self.INT_FIELDS:
+                value = int(value)
+            job[key] = value
+        return job
+
+    async def enqueue(self, kind: str, payload: dict, user_id: int) -> dict:
+        job = self.new_job(kind, payload, user_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(f"job:{job['id']}", mapping=self._encode(job))
+            pipe.expire(f"job:{job['id']}", settings.job_ttl)
+            pipe.lpush(self.QUEUE_KEY, job["id"])
+            await pipe.execute()
+        return job
+
+    def _update(self, pipe, job_id: str, fields: dict):
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        pipe.hset(f"job:{job_id}", mapping=self._encode(fields))
+
+    async def requeue(self, worker: str, job_id: str, **fields) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._update(pipe, job_id, fields)
+            pipe.lpush(self.QUEUE_KEY, job_id)
+            pipe.lrem(self._processing_key(worker), 1, job_id)
+            await pipe.execute()
+
+    async def dequeue(self, worker: str, timeout: float) -> str | None:
+        return await self.client.blmove(self.QUEUE_KEY, self._processing_key(worker), timeout, "RIGHT", "LEFT")
+
+    async def finish(self, worker: str, job_id: str, **fields) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            if fields:
+                self._update(pipe, job_id, fields)
+            pipe.lrem(self._processing_key(worker), 1, job_id)
+            await pipe.execute()
+
+    async def heartbeat(self, worker: str, ttl: int) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.sadd(self.WORKERS_KEY, worker)
+            pipe.set(f"jobs:worker:{worker}", 1, ex=ttl)
+            await pipe.execute()
+
+    async def recover(self) -> int:
+        recovered = 0
+        for worker in await self.client.smembers(self.WORKERS_KEY):
+            if await self.client.exists(f"jobs:worker:{worker}"):
+                continue
+            while job_id := await self.client.lmove(self._processing_key(worker), self.QUEUE_KEY, "RIGHT", "RIGHT"):
+                if await self.client.exists(f"job:{job_id}"):
+                    await self.client.hset(f"job:{job_id}", "status", "queued")
+                recovered += 1
+            await self.client.srem(self.WORKERS_KEY, worker)
+        return recovered
+
+    async def get(self, job_id: str) -> dict | None:
+        fields = await self.client.hgetall(f"job:{job_id}")
+        return self._decode(fields) if fields else None
+
+    async def update(self, job_id: str, **fields) -> None:
+        async with self.client.pipeline(transaction=False) as pipe:
+            self._update(pipe, job_id, fields)
+            await pipe.execute()
+
+
+class InMemoryJobQueue(JobQueue):
+    """
+    In-process stand-in for RedisJobQueue, used for tests and local runs.
+    The worker runs as a task of the application itself, its jobs die with the process, so there is
+    nothing to recover.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.queue = None
+
+    def _queue(self) -> asyncio.Queue:
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        return self.queue
+
+    async def enqueue(self, kind: str, payload: dict, user_id: int) -> dict:
+        job = self.new_job(kind, payload, user_id)
+        self.jobs[job["id"]] = job
+        self._queue().put_nowait(job["id"])
+        return dict(job)
+
+    async def requeue(self, worker: str, job_id: str, **fields) -> None:
+        await self.update(job_id, **fields)
+        self._queue().put_nowait(job_id)
+
+    async def dequeue(self, worker: str, timeout: float) -> str | None:
+        try:
+            return await asyncio.wait_for(self._queue().get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def finish(self, worker: str, job_id: str, **fields) -> None:
+        if fields:
+            await self.update(job_id, **fields)
+
+    async def heartbeat(self, worker: str, ttl: int) -> None:
+        pass
+
+    async def recover(self) -> int:
+        return 0
+
+    async def get(self, job_id: str) -> dict | None:
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        self.jobs[job_id].update(fields)
+
+
+def get_job_queue() -> JobQueue:
+    """
+    The get_job_queue function creates the job queue selected by settings.job_backend.
+
+    :return: A RedisJobQueue or an InMemoryJobQueue
+    """
+    if settings.job_backend == "memory":
+        return InMemoryJobQueue()
+    return RedisJobQueue(redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
+                                     decode_responses=True))
+
+
+job_queue = get_job_queue()
+
+
+def _copy_to(file, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(file, out, 1024 * 1024)
+
+
+async def stage_upload(file) -> str:
+    """
+    The stage_upload function copies an upload to job_staging_dir, where a worker picks it up.
+    With several worker hosts the directory must be shared between the API and the workers.
+
+    :param file: A file-like object positioned at the start of the upload
+    :return: The path of the staged file
+    """
+    path = os.path.join(settings.job_staging_dir, uuid.uuid4().hex)
+    await run_storage_io(_copy_to, file, path)
+    return path
+
+
+def accepted_response(job: dict) -> JSONResponse:
+    """
+    The accepted_response function answers a request whose work was queued as a job.
+
+    :param job: dict: The queued job
+    :return: A 202 Accepted response with the job id and the url to poll its status
+    """
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED,
+                        content={"job_id": job["id"], "status": job["status"], "status_url": f"/api/jobs/{job['id']}"})
@@ -0,0 +1,51 @@
+from typing import AsyncIterator, Type
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON = "application/x-ndjson"
+
+
+def wants_ndjson(request: Request, output_format: str | None = None) -> bool:
+    """
+    The wants_ndjson function tells if a listing should be streamed as NDJSON, either because the format
+    query parameter asks for it or, without one, because the Accept header lists application/x-ndjson.
+
+    :param request: Request: Read the Accept header
+    :param output_format: str | None: The format query parameter, 'json' or 'ndjson'
+    :return: True to stream NDJSON
+    """
+    if output_format:
+        return output_format == "ndjson"
+    return NDJSON in request.headers.get("accept", "")
+
+
+async def _lines(rows: AsyncIterator, model: Type[BaseModel], rows_per_chunk: int) -> AsyncIterator[bytes]:
+    chunk = []
+    async for row in rows:
+        chunk.append(model.from_orm(row).json())
+        if len(chunk) >= rows_per_chunk:
+            yield ("\n".join(chunk) + "\n").encode()
+            chunk = []
+    if chunk:
+        yield ("\n".join(chunk) + "\n").encode()
+
+
+def ndjson_response(rows: AsyncIterator, model: Type[BaseModel], filename: str | None = None,
+                    rows_per_chunk: int = 100) -> StreamingResponse:
+    """
+    The ndjson_response function streams rows as newline delimited JSON, one object per line.
+    Rows are serialized as they arrive from the database and sent in chunks of rows_per_chunk lines,
+    so the memory used does not depend on the number of rows.
+    Rows should come from a server-side cursor, e.g. AsyncSession.stream_scalars with yield_per.
+    The session must stay open until the response is sent, which the get_db and get_read_db dependencies do.
+
+    :param rows: AsyncIterator: The ORM objects to stream
+    :param model: Type[BaseModel]: The orm_mode schema each row is serialized with
+    :param filename: str | None: Send the response as a download with this file name
+    :param rows_per_chunk: int: The number of lines sent at once
+    :return: A streaming response
+    """
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'} if filename else None
+    return StreamingResponse(_lines(rows, model, rows_per_chunk), media_type=NDJSON, headers=headers)
@@ -0,0 +1,72 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, tuple_
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """
+    The encode_cursor function packs the sort key of the last row of a page into an opaque string.
+
+    :param created_at: datetime: The created_at of the last row
+    :param row_id: int: The id of the last row
+    :return: A url safe cursor
+    """
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    The decode_cursor function unpacks a cursor made by encode_cursor.
+
+    :param cursor: str: The cursor sent by the client
+    :return: The (created_at, id) sort key to continue after
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def keyset_page(stmt: Select, model, cursor: str | None, limit: int, descending: bool = True) -> Select:
+    """
+    The keyset_page function orders a select by (created_at, id) and continues after the cursor.
+    It asks for one row more than the limit so paginate can tell if there is a next page.
+    The filter is a row value comparison, so it is served by a (..., created_at, id) index at any depth.
+
+    :param stmt: Select: The select of the rows to paginate
+    :param model: The model with created_at and id columns
+    :param cursor: str | None: The cursor of the previous page, None for the first page
+    :param limit: int: The page size
+    :param descending: bool: Newest first when True
+    :return: The paginated select
+    """
+    key = tuple_(model.created_at, model.id)
+    if cursor:
+        after = tuple_(*decode_cursor(cursor))
+        stmt = stmt.filter(key < after if descending else key > after)
+    if descending:
+        stmt = stmt.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        stmt = stmt.order_by(model.created_at, model.id)
+    return stmt.limit(limit + 1)
+
+
+def paginate(rows: list, limit: int) -> tuple[list, str | None]:
+    """
+    The paginate function cuts the extra row fetched by keyset_page and builds the next cursor.
+
+    :param rows: list: The rows returned by a keyset_page select
+    :param limit: int: The page size
+    :return: The rows of the page and the cursor of the next page or None
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from src.conf.config import settings
+
+
+class PasswordHashingStats:
+    """
+    Counters of the password hashing executor. Queue time is how long a call waited for a free worker,
+    run time how long bcrypt took. Times are kept in seconds and reported in milliseconds.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.waiting = 0
+        self.running = 0
+        self.total_queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+
+    def record(self, queued: float, ran: float):
+        """
+        The record function stores the timings of a finished call.
+
+        :param queued: float: Seconds the call waited for a worker
+        :param ran: float: Seconds the call ran
+        :return: None
+        """
+        self.calls += 1
+        self.total_queue_time += queued
+        self.max_queue_time = max(self.max_queue_time, queued)
+        self.total_run_time += ran
+        self.max_run_time = max(self.max_run_time, ran)
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function reports the counters together with the current load of the executor.
+
+        :return: A dictionary with the statistics
+        """
+        return {
+            "workers": password_workers,
+            "bcrypt_rounds": settings.bcrypt_rounds,
+            "calls": self.calls,
+            "waiting": self.waiting,
+            "running": self.running,
+            "avg_queue_ms": round(self.total_queue_time / self.calls * 1000, 3) if self.calls else 0.0,
+            "max_queue_ms": round(self.max_queue_time * 1000, 3),
+            "avg_run_ms": round(self.total_run_time / self.calls * 1000, 3) if self.calls else 0.0,
+            "max_run_ms": round(self.max_run_time * 1000, 3),
+        }
+
+
+password_workers = settings.password_hash_workers or os.cpu_count() or 1
+password_executor = ThreadPoolExecutor(max_workers=password_workers, thread_name_prefix='bcrypt')
+password_stats = PasswordHashingStats()
+_stats_lock = threading.Lock()
+
+
+def _timed(func, submitted: float):
+    started = time.perf_counter()
+    with _stats_lock:
+        password_stats.waiting -= 1
+        password_stats.running += 1
+    try:
+        return func()
+    finally:
+        finished = time.perf_counter()
+        with _stats_lock:
+            password_stats.running -= 1
+            password_stats.record(started - submitted, finished - started)
+
+
+async def run_password_hashing(func, *args, **kwargs):
+    """
+    The run_password_hashing function runs a bcrypt call in the bounded password hashing thread pool,
+    so a burst of logins cannot block the event loop. bcrypt releases the GIL, so up to
+    password_hash_workers calls run in parallel and the rest wait in the queue of the pool.
+
+    :param func: The blocking function to call
+    :param args: Positional arguments for func
+    :param kwargs: Keyword arguments for func
+    :return: The result of func
+    """
+    loop = asyncio.get_running_loop()
+    with _stats_lock:
+        password_stats.waiting += 1
+    return await loop.run_in_executor(password_executor, _timed, partial(func, *args, **kwargs), time.perf_counter())
@@ -0,0 +1,167 @@
+import asyncio
+import enum
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from sqlalchemy import DateTime, Enum, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from src.conf.config import settings
+from src.database.models import User
+
+
+class PrincipalCache:
+    """
+    Authenticated users cached by email (the subject of their tokens), so authentication does not query
+    the database on every request. Entries are column values, every request gets its own detached User
+    built from them. The password hash, the refresh token and the activity counters are never cached,
+    the counters change without invalidating the cache.
+    The first tier is an in-process LRU whose entries expire after ttl seconds. The second tier is Redis,
+    shared by all processes; invalidations are then published so every process drops its copy.
+    Without a client only the first tier exists and an invalidation reaches only the current process,
+    so that mode is for a single process (tests, one worker).
+    """
+
+    CHANNEL = "principals:invalidate"
+    EXCLUDED = ("password", "refresh_token", "post_count", "comment_count", "rates_count")
+
+    def __init__(self, ttl: float, max_items: int, client: redis.Redis | None = None):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.client = client
+        self.items = OrderedDict()
+        self.generation = 0
+        self.columns = {attr.key: attr.columns[0] for attr in inspect(User).column_attrs
+                        if attr.key not in self.EXCLUDED}
+
+    def _fields(self, user: User) -> dict:
+        return {key: getattr(user, key) for key in self.columns}
+
+    def _build(self, fields: dict) -> User:
+        user = User(**fields)
+        make_transient_to_detached(user)
+        return user
+
+    def _encode(self, fields: dict) -> str:
+        return json.dumps({key: value.name if isinstance(value, enum.Enum) else
+                           value.isoformat() if isinstance(value, datetime) else value
+                           for key, value in fields.items()})
+
+    def _decode(self, raw: str) -> dict:
+        fields = json.loads(raw)
+        for key, value in fields.items():
+            column_type = self.columns[key].type
+            if value is not None and isinstance(column_type, Enum):
+                fields[key] = column_type.enum_class[value]
+            elif value is not None and isinstance(column_type, DateTime):
+                fields[key] = datetime.fromisoformat(value)
+        return fields
+
+    def _remember(self, email: str, fields: dict):
+        self.items[email] = (time.monotonic() + self.ttl, fields)
+        self.items.move_to_end(email)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    async def get(self, email: str) -> User | None:
+        """
+        The get function returns the cached user with the email.
+
+        :param email: str: The subject of the token
+        :return: A detached User or None if the user is not cached
+        """
+        item = self.items.get(email)
+        if item is not None:
+            if item[0] > time.monotonic():
+                self.items.move_to_end(email)
+                return self._build(item[1])
+            del self.items[email]
+        if self.client is None:
+            return None
+        generation = self.generation
+        try:
+            raw = await self.client.get(f"principal:{email}")
+        except RedisError:
+            return None
+        if raw is None:
+            return None
+        fields = self._decode(raw)
+        if generation == self.generation:
+            self._remember(email, fields)
+        return self._build(fields)
+
+    async def put(self, user: User, generation: int) -> None:
+        """
+        The put function caches a user loaded from the database.
+        It is skipped if an invalidation happened since generation was read, the user may be stale.
+
+        :param user: User: The user loaded from the database
+        :param generation: int: The generation of the cache read before the user was loaded
+        :return: None
+        """
+        if generation != self.generation:
+            return
+        fields = self._fields(user)
+        self._remember(user.email, fields)
+        if self.client is not None:
+            try:
+                await self.client.set(f"principal:{user.email}", self._encode(fields), ex=int(self.ttl))
+            except RedisError:
+                pass
+
+    async def invalidate(self, email: str) -> None:
+        """
+        The invalidate function drops a user from the cache, in all processes when Redis is used.
+        Call it after every committed change of the user.
+
+        :param email: str: The email of the changed user
+        :return: None
+        """
+        self.generation += 1
+        self.items.pop(email, None)
+        if self.client is not None:
+            try:
+                await self.client.delete(f"principal:{email}")
+                await self.client.publish(self.CHANNEL, email)
+            except RedisError:
+                pass
+
+    async def listen(self) -> None:
+        """
+        The listen function drops the users invalidated by other processes from the in-process tier.
+        It runs for the lifetime of the application.
+
+        :return: None
+        """
+        while True:
+            try:
+                async with self.client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.generation += 1
+                            self.items.pop(message["data"], None)
+            except RedisError:
+                self.items.clear()
+                await asyncio.sleep(1)
+
+
+def get_principal_cache() -> PrincipalCache:
+    """
+    The get_principal_cache function creates the principal cache with the Redis tier or, when
+    settings.principal_cache_backend is 'memory', in the process only.
+
+    :return: A PrincipalCache
+    """
+    client = None
+    if settings.principal_cache_backend != "memory":
+        client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
+                             decode_responses=True)
+    return PrincipalCache(settings.principal_cache_ttl, settings.principal_cache_size, client)
+
+
+principal_cache = get_principal_cache()
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import io
+import zipfile
+from collections import OrderedDict
+from typing import AsyncIterator
+
+import qrcode
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+
+
+def render_qr(url: str) -> bytes:
+    """
+    The render_qr function draws the QR code of a url.
+
+    :param url: str: The url to encode
+    :return: The QR code as PNG
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=3,
+        border=4,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    output = io.BytesIO()
+    img.save(output)
+    return output.getvalue()
+
+
+class QRCache:
+    """
+    Rendered QR codes keyed by the hash of their url, the PNG only depends on the url.
+    The first tier is an in-process LRU of max_items codes, the optional second tier is Redis,
+    shared by all processes, where codes expire after ttl seconds.
+    """
+
+    def __init__(self, max_items: int, client: redis.Redis | None = None, ttl: int = 0):
+        self.max_items = max_items
+        self.client = client
+        self.ttl = ttl
+        self.items = OrderedDict()
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def etag(self, url: str) -> str:
+        """
+        The etag function returns the strong entity tag of the QR code of a url.
+        It is known without rendering the code, so unchanged codes are answered with 304 right away.
+
+        :param url: str: The url encoded in the QR code
+        :return: The quoted entity tag
+        """
+        return f'"{self.key(url)}"'
+
+    def _remember(self, key: str, png: bytes):
+        self.items[key] = png
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    async def get(self, url: str) -> bytes:
+        """
+        The get function returns the QR code of a url from the cache, rendering and caching it on a miss.
+        Redis errors are not fatal, the code is rendered instead.
+
+        :param url: str: The url to encode
+        :return: The QR code as PNG
+        """
+        key = self.key(url)
+        png = self.items.get(key)
+        if png is not None:
+            self.items.move_to_end(key)
+            return png
+        if self.client is not None:
+            try:
+                png = await self.client.get(f'qr:{key}')
+            except RedisError:
+                png = None
+        if png is None:
+            png = await asyncio.to_thread(render_qr, url)
+            if self.client is not None:
+                try:
+                    await self.client.set(f'qr:{key}', png, ex=self.ttl)
+                except RedisError:
+                    pass
+        self._remember(key, png)
+        return png
+
+    async def prerender(self, url: str) -> None:
+        """
+        The prerender function renders and caches the QR code of a new url before anyone asks for it.
+
+        :param url: str: The url to encode
+        :return: None
+        """
+        await self.get(url)
+
+
+class _ZipSink:
+    """
+    A write-only, unseekable file for zipfile that hands out what was written since the last drain.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+async def zip_qr_codes(codes: list[tuple[int, str]], cache: "QRCache", concurrency: int) -> AsyncIterator[bytes]:
+    """
+    The zip_qr_codes function streams a ZIP archive with the QR codes of photos, one <photo id>.png per photo.
+    Up to concurrency codes are fetched or rendered at once and every code is written to the archive as soon
+    as it is ready, so only the codes in flight are held in memory. Entries are stored, PNG does not compress.
+
+    :param codes: list[tuple[int, str]]: (photo id, url) pairs
+    :param cache: QRCache: The cache the codes come from
+    :param concurrency: int: How many codes are rendered at the same time
+    :return: The chunks of the archive
+    """
+    async def fetch(photo_id: int, url: str) -> tuple[int, bytes]:
+        return photo_id, await cache.get(url)
+
+    sink = _ZipSink()
+    pending = set()
+    codes = iter(codes)
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        try:
+            while True:
+                for photo_id, url in codes:
+                    pending.add(asyncio.ensure_future(fetch(photo_id, url)))
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    photo_id, png = task.result()
+                    archive.writestr(f'{photo_id}.png', png)
+                yield sink.drain()
+        finally:
+            for task in pending:
+                task.cancel()
+    yield sink.drain()
+
+
+def get_qr_cache() -> QRCache:
+    """
+    The get_qr_cache function creates the QR code cache, with the Redis tier when settings.qr_cache_redis is set.
+
+    :return: A QRCache
+    """
+    client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0) if settings.qr_cache_redis else None
+    return QRCache(settings.qr_cache_size, client, settings.qr_cache_ttl)
+
+
+qr_cache = get_qr_cache()
@@ -0,0 +1,173 @@
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+import redis.asyncio as redis
+
+from src.conf.config import settings
+
+
+class RefreshTokenStore(ABC):
+    """
+    Refresh token families. Every login starts a family (one per device or session) whose id is the fid claim
+    of its refresh tokens. A family remembers the jti of its only valid refresh token; refreshing rotates it
+    to a new jti. Presenting an older token of the family means it was stolen or replayed, the whole family
+    is revoked. Families expire ttl seconds after their last rotation.
+    """
+
+    @staticmethod
+    def new_token_id() -> str:
+        return uuid.uuid4().hex
+
+    @abstractmethod
+    async def start_family(self, email: str, jti: str, ttl: int) -> str:
+        """
+        The start_family function starts a family with its first refresh token.
+
+        :param email: str: The owner of the family
+        :param jti: str: The id of the first refresh token
+        :param ttl: int: Seconds until the family expires
+        :return: The id of the family
+        """
+
+    @abstractmethod
+    async def rotate(self, fid: str, email: str, jti: str, new_jti: str, ttl: int) -> bool:
+        """
+        The rotate function replaces the current refresh token of a family, atomically.
+        If jti is not the current token the family is revoked.
+
+        :param fid: str: The id of the family
+        :param email: str: The owner of the family
+        :param jti: str: The id of the presented refresh token
+        :param new_jti: str: The id of the refresh token that replaces it
+        :param ttl: int: Seconds until the family expires
+        :return: True if the token was rotated, False if it was unknown, expired or reused
+        """
+
+    @abstractmethod
+    async def revoke_user(self, email: str) -> None:
+        """
+        The revoke_user function revokes all families of a user, e.g. when they are banned.
+
+        :param email: str: The owner of the families
+        :return: None
+        """
+
+
+class RedisRefreshTokenStore(RefreshTokenStore):
+    """
+    Families are Redis hashes rt:family:<fid> with the owner and the current jti, the families of a user
+    are listed in the set rt:user:<email>. Rotation is a Lua script, so concurrent refreshes of one token
+    cannot both succeed. A family that is revoked or found missing on rotation leaves the set at once,
+    families that simply expired are pruned from it when the user starts a new one.
+    """
+
+    ROTATE = """
+    local current = redis.call('HGET', KEYS[1], 'jti')
+    if not current or redis.call('HGET', KEYS[1], 'email') ~= ARGV[1] then
+        redis.call('SREM', KEYS[2], ARGV[5])
+        return 0
+    end
+    if current ~= ARGV[2] then
+        redis.call('DEL', KEYS[1])
+        redis.call('SREM', KEYS[2], ARGV[5])
+        return -1
+    end
+    redis.call('HSET', KEYS[1], 'jti', ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+    return 1
+    """
+
+    def __init__(self, client: redis.Redis):
+        self.client = client
+        self.rotate_script = client.register_script(self.ROTATE)
+
+    async def _prune(self, email: str):
+        fids = list(await self.client.smembers(f"rt:user:{email}"))
+        if not fids:
+            return
+        async with self.client.pipeline(transaction=False) as pipe:
+            for fid in fids:
+                pipe.exists(f"rt:family:{fid}")
+            alive = await pipe.execute()
+        expired = [fid for fid, exists in zip(fids, alive) if not exists]
+        if expired:
+            await self.client.srem(f"rt:user:{email}", *expired)
+
+    async def start_family(self, email: str, jti: str, ttl: int) -> str:
+        await self._prune(email)
+        fid = self.new_token_id()
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(f"rt:family:{fid}", mapping={"email": email, "jti": jti})
+            pipe.expire(f"rt:family:{fid}", ttl)
+            pipe.sadd(f"rt:user:{email}", fid)
+            pipe.expire(f"rt:user:{email}", ttl)
+            await pipe.execute()
+        return fid
+
+    async def rotate(self, fid: str, email: str, jti: str, new_jti: str, ttl: int) -> bool:
+        result = await self.rotate_script(keys=[f"rt:family:{fid}", f"rt:user:{email}"],
+                                          args=[email, jti, new_jti, ttl, fid])
+        return int(result) == 1
+
+    async def revoke_user(self, email: str) -> None:
+        fids = await self.client.smembers(f"rt:user:{email}")
+        async with self.client.pipeline(transaction=True) as pipe:
+            for fid in fids:
+                pipe.delete(f"rt:family:{fid}")
+            pipe.delete(f"rt:user:{email}")
+            await pipe.execute()
+
+
+class InMemoryRefreshTokenStore(RefreshTokenStore):
+    """
+    In-process stand-in for RedisRefreshTokenStore, used for tests and local runs.
+    """
+
+    def __init__(self):
+        self.families = {}
+
+    def _family(self, fid: str) -> dict | None:
+        family = self.families.get(fid)
+        if family is not None and family["expires"] <= time.monotonic():
+            del self.families[fid]
+            return None
+        return family
+
+    async def start_family(self, email: str, jti: str, ttl: int) -> str:
+        now = time.monotonic()
+        for fid in [fid for fid, family in self.families.items() if family["expires"] <= now]:
+            del self.families[fid]
+        fid = self.new_token_id()
+        self.families[fid] = {"email": email, "jti": jti, "expires": now + ttl}
+        return fid
+
+    async def rotate(self, fid: str, email: str, jti: str, new_jti: str, ttl: int) -> bool:
+        family = self._family(fid)
+        if family is None or family["email"] != email:
+            return False
+        if family["jti"] != jti:
+            del self.families[fid]
+            return False
+        family.update(jti=new_jti, expires=time.monotonic() + ttl)
+        return True
+
+    async def revoke_user(self, email: str) -> None:
+        for fid in [fid for fid, family in self.families.items() if family["email"] == email]:
+            del self.families[fid]
+
+
+def get_refresh_token_store() -> RefreshTokenStore:
+    """
+    The get_refresh_token_store function creates the refresh token store selected by settings.token_store_backend.
+
+    :return: A RedisRefreshTokenStore or an InMemoryRefreshTokenStore
+    """
+    if settings.token_store_backend == "memory":
+        return InMemoryRefreshTokenStore()
+    return RedisRefreshTokenStore(redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0,
+                                              encoding="utf-8", decode_responses=True))
+
+
+refresh_tokens = get_refresh_token_store()
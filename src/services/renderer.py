@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter, ImageFont, ImageOps
+
+from src.conf.config import settings
+from src.schemas_of_transformation import TransformerModel
+
+_executor = None
+
+
+def spec_hash(spec: dict) -> str:
+    """
+    The spec_hash function returns a canonical hash of a transformation spec (TransformerModel.dict()),
+    equal specs give the same hash whatever the order of their keys.
+
+    :param spec: dict: The transformation spec
+    :return: The SHA-256 hex digest of the canonical JSON of the spec
+    """
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def _font(size: int):
+    for name in ('DejaVuSerif-Bold.ttf', 'LiberationSerif-Bold.ttf', 'Times New Roman Bold.ttf'):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def _circle(image: Image.Image, spec: dict) -> Image.Image:
+    image = ImageOps.fit(image.convert('RGBA'), (spec['width'], spec['height']))
+    mask = Image.new('L', image.size, 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, image.width - 1, image.height - 1), fill=255)
+    image.putalpha(mask)
+    return image
+
+
+def _effect(image: Image.Image, spec: dict) -> Image.Image:
+    effect = None
+    for name in ('art_audrey', 'art_zorro', 'blur', 'cartoonify'):
+        if spec[name]:
+            effect = name
+    alpha = image.getchannel('A') if image.mode == 'RGBA' else None
+    rgb = image.convert('RGB')
+    if effect == 'art_audrey':
+        rgb = ImageEnhance.Contrast(ImageEnhance.Color(rgb).enhance(0.6)).enhance(1.3)
+    elif effect == 'art_zorro':
+        rgb = ImageEnhance.Contrast(ImageOps.grayscale(rgb)).enhance(1.5).convert('RGB')
+    elif effect == 'blur':
+        rgb = rgb.filter(ImageFilter.GaussianBlur(radius=10))
+    elif effect == 'cartoonify':
+        rgb = ImageOps.posterize(rgb.filter(ImageFilter.SMOOTH_MORE), 3).filter(ImageFilter.EDGE_ENHANCE_MORE)
+    if alpha is not None:
+        rgb.putalpha(alpha)
+    return rgb
+
+
+def _resize(image: Image.Image, spec: dict) -> Image.Image:
+    size = (spec['width'], spec['height'])
+    if spec['fill']:
+        return ImageOps.fit(image, size)
+    if spec['crop']:
+        width, height = min(size[0], image.width), min(size[1], image.height)
+        left, top = (image.width - width) // 2, (image.height - height) // 2
+        return image.crop((left, top, left + width, top + height))
+    return image
+
+
+def _text(image: Image.Image, spec: dict) -> Image.Image:
+    image = image.convert('RGBA')
+    draw = ImageDraw.Draw(image)
+    font = _font(spec['font_size'])
+    left, top, right, bottom = draw.textbbox((0, 0), spec['text'], font=font)
+    position = ((image.width - (right - left)) // 2, image.height - (bottom - top) - 20 - top)
+    draw.text(position, spec['text'], font=font, fill='#FFFF00')
+    return image
+
+
+def _rotate(image: Image.Image, spec: dict) -> Image.Image:
+    width = spec['width']
+    height = max(1, round(image.height * width / image.width))
+    if height > settings.transform_max_size:
+        raise ValueError(f'The scaled image would be {height} pixels high, more than {settings.transform_max_size}')
+    image = image.resize((width, height))
+    image = ImageOps.flip(image).convert('RGBA')
+    return image.rotate(-spec['degree'], expand=True, resample=Image.BICUBIC)
+
+
+def render(source: bytes, spec: dict) -> bytes:
+    """
+    The render function applies a TransformerModel pipeline to an image with Pillow, in the same order
+    and with the same conditions as the Cloudinary transformation built by transformer:
+    circle, effect, resize (crop/fill), yellow text at the bottom and rotate (scale, vertical flip, angle).
+    It is CPU bound and runs in the render process pool, see render_async.
+
+    :param source: bytes: The original image
+    :param spec: dict: TransformerModel.dict()
+    :return: The transformed image as PNG
+    """
+    image = Image.open(io.BytesIO(source))
+    image = ImageOps.exif_transpose(image)
+    circle, effect, resize, text, rotate = (spec[name] for name in ('circle', 'effect', 'resize', 'text', 'rotate'))
+    if circle['use_filter'] and circle['height'] and circle['width']:
+        image = _circle(image, circle)
+    if effect['use_filter']:
+        image = _effect(image, effect)
+    if resize['use_filter'] and resize['height'] and resize['width']:
+        image = _resize(image, resize)
+    if text['use_filter'] and text['font_size'] and text['text']:
+        image = _text(image, text)
+    if rotate['use_filter'] and rotate['width'] and rotate['degree']:
+        image = _rotate(image, rotate)
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def get_render_executor() -> ProcessPoolExecutor:
+    """
+    The get_render_executor function returns the process pool for rendering, created on first use
+    with render_workers processes (all available cores when it is 0).
+
+    :return: The render process pool
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.render_workers or os.cpu_count())
+    return _executor
+
+
+async def render_async(source: bytes, spec: dict) -> bytes:
+    """
+    The render_async function runs render in the render process pool without blocking the event loop.
+    The spec is validated again first, so a spec stored before the size limits were set is rejected
+    instead of reaching the pool. If a worker died (e.g. killed for running out of memory) the pool is
+    broken: it is replaced and the render is tried once more.
+
+    :param source: bytes: The original image
+    :param spec: dict: TransformerModel.dict()
+    :return: The transformed image as PNG
+    :raises ValueError: The spec is out of bounds
+    """
+    global _executor
+    TransformerModel.parse_obj(spec)
+    loop = asyncio.get_running_loop()
+    executor = get_render_executor()
+    try:
+        return await loop.run_in_executor(executor, render, source, spec)
+    except BrokenProcessPool:
+        if _executor is executor:
+            _executor = None
+            executor.shutdown(wait=False)
+        return await loop.run_in_executor(get_render_executor(), render, source, spec)
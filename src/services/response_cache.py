@@ -0,0 +1,166 @@
+import json
+import time
+from collections import OrderedDict
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+
+
+class ResponseCache:
+    """
+    Serialized responses cached per owner, e.g. per user id. Keys carry a version number per owner
+    that writes bump, so a write makes all cached responses of the owner unreachable at once and they expire after ttl seconds.
+    Entries live in Redis, shared by all processes, or in an in-process dict when no client is given.
+    Redis errors never fail a request, the response is built as if the cache missed.
+    Hits and misses are counted in Redis (or in the process) to check the cache is effective.
+    """
+
+    def __init__(self, namespace: str, ttl: int, client: redis.Redis | None = None, max_items: int = 10000):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.client = client
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.versions = {}
+        self.counters = {"hits": 0, "misses": 0, "errors": 0}
+
+    def _version_key(self, owner) -> str:
+        return f"cache:{self.namespace}:ver:{owner}"
+
+    def _key(self, owner, version: int, params: dict) -> str:
+        query = json.dumps(params, sort_keys=True, separators=(',', ':'))
+        return f"cache:{self.namespace}:{owner}:{version}:{query}"
+
+    async def _count(self, counter: str):
+        if self.client is None:
+            self.counters[counter] += 1
+            return
+        try:
+            await self.client.hincrby(f"cache:{self.namespace}:stats", counter, 1)
+        except RedisError:
+            self.counters["errors"] += 1
+
+    async def version(self, owner) -> int | None:
+        """
+        The version function returns the current version of the cached responses of an owner.
+
+        :param owner: The owner of the responses
+        :return: The version, or None if Redis is unavailable and the cache must be bypassed
+        """
+        if self.client is None:
+            return self.versions.get(owner, 0)
+        try:
+            return int(await self.client.get(self._version_key(owner)) or 0)
+        except RedisError:
+            self.counters["errors"] += 1
+            return None
+
+    async def get(self, owner, version: int | None, **params) -> dict | None:
+        """
+        The get function looks up a cached response.
+
+        :param owner: The owner of the response
+        :param version: int | None: The version returned by version
+        :param params: The query parameters the response depends on
+        :return: The cached entry (a dict with body and etag) or None on a miss
+        """
+        if version is None:
+            return None
+        key = self._key(owner, version, params)
+        entry = None
+        if self.client is None:
+            item = self.items.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self.items.move_to_end(key)
+                entry = item[1]
+        else:
+            try:
+                raw = await self.client.get(key)
+                entry = json.loads(raw) if raw else None
+            except RedisError:
+                self.counters["errors"] += 1
+        await self._count("hits" if entry is not None else "misses")
+        return entry
+
+    async def set(self, owner, version: int | None, entry: dict, **params) -> None:
+        """
+        The set function caches a response under the version it was read with.
+        A response built while a write bumped the version is stored under the old version and never served.
+
+        :param owner: The owner of the response
+        :param version: int | None: The version returned by version before the response was built
+        :param entry: dict: JSON serializable entry, e.g. the body and etag of the response
+        :param params: The query parameters the response depends on
+        :return: None
+        """
+        if version is None:
+            return
+        key = self._key(owner, version, params)
+        if self.client is None:
+            self.items[key] = (time.monotonic() + self.ttl, entry)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+            return
+        try:
+            await self.client.set(key, json.dumps(entry), ex=self.ttl)
+        except RedisError:
+            self.counters["errors"] += 1
+
+    async def bump(self, owner) -> None:
+        """
+        The bump function invalidates all cached responses of an owner, call it after every committed write
+        that changes them.
+
+        :param owner: The owner of the responses
+        :return: None
+        """
+        if self.client is None:
+            self.versions[owner] = self.versions.get(owner, 0) + 1
+            return
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.incr(self._version_key(owner))
+                pipe.expire(self._version_key(owner), self.ttl * 2)
+                await pipe.execute()
+        except RedisError:
+            self.counters["errors"] += 1
+
+    async def stats(self) -> dict:
+        """
+        The stats function reports the hits, misses and hit ratio of the cache since it was created or,
+        with Redis, of all processes, and the Redis errors seen by this process.
+
+        :return: A dictionary with the counters
+        """
+        counters = dict(self.counters)
+        if self.client is not None:
+            try:
+                shared = await self.client.hgetall(f"cache:{self.namespace}:stats")
+                counters.update({key.decode() if isinstance(key, bytes) else key: int(value)
+                                 for key, value in shared.items()})
+            except RedisError:
+                pass
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        counters["hit_ratio"] = round(counters.get("hits", 0) / lookups, 4) if lookups else None
+        return counters
+
+
+def get_response_cache(namespace: str) -> ResponseCache:
+    """
+    The get_response_cache function creates a response cache in Redis or, when settings.response_cache_backend
+    is 'memory', in the process.
+
+    :param namespace: str: The prefix of the keys of the cache
+    :return: A ResponseCache
+    """
+    client = None
+    if settings.response_cache_backend != "memory":
+        client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+    return ResponseCache(namespace, settings.response_cache_ttl, client)
+
+
+photos_cache = get_response_cache("photos")
+profiles_cache = get_response_cache("profiles")
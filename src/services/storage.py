@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import urlopen
+
+import cloudinary
+import cloudinary.uploader
+from fastapi import HTTPException, status
+
+from src.conf.config import settings, cloudinary_config
+
+storage_executor = ThreadPoolExecutor(max_workers=settings.storage_workers, thread_name_prefix='storage')
+
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    """
+    The sniff_image_type function detects the image format from the first bytes of a file.
+
+    :param head: bytes: At least the first 12 bytes of the file
+    :return: The media type of the image or None if it is not a supported image
+    """
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, media_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    return None
+
+
+async def run_storage_io(func, *args, **kwargs):
+    """
+    The run_storage_io function runs a blocking storage call in the bounded storage thread pool,
+    so the event loop keeps serving other requests while the file is transferred.
+    If the call does not finish within storage_timeout seconds the request fails with 504.
+
+    :param func: The blocking function to call
+    :param args: Positional arguments for func
+    :param kwargs: Keyword arguments for func
+    :return: The result of func
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(storage_executor, partial(func, *args, **kwargs)),
+                                      timeout=settings.storage_timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Storage timeout")
+
+
+class StorageBackend(ABC):
+    """
+    Where photos and avatars are kept. Assets are addressed by a key such as 'PhotoShareApp/<username>'.
+    A backend must implement every method, an incomplete one cannot be instantiated.
+    """
+
+    @abstractmethod
+    async def save(self, file, key: str, **options) -> dict:
+        """
+        The save function stores the content of a file-like object under the key, replacing any previous content.
+
+        :param file: A file-like object positioned at the start of the content
+        :param key: str: The key of the asset
+        :param options: Backend specific options
+        :return: A dictionary with at least the version of the stored asset
+        """
+
+    @abstractmethod
+    def url(self, key: str, version=None, **transformation) -> str:
+        """
+        The url function returns the public url of an asset.
+
+        :param key: str: The key of the asset
+        :param version: The version returned by save, used to bust caches
+        :param transformation: Cloudinary style transformation options
+        :return: The url of the asset
+        """
+
+    @abstractmethod
+    async def read(self, key: str) -> bytes:
+        """
+        The read function returns the content of an asset.
+        A missing asset raises FileNotFoundError, whatever the backend.
+
+        :param key: str: The key of the asset
+        :return: The content of the asset
+        """
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """
+        The delete function removes an asset. Missing assets are ignored.
+
+        :param key: str: The key of the asset
+        :return: None
+        """
+
+
+class CloudinaryStorage(StorageBackend):
+    """
+    Stores assets on Cloudinary, the key is the public id.
+    """
+
+    async def save(self, file, key: str, **options) -> dict:
+        cloudinary_config()
+        return await run_storage_io(cloudinary.uploader.upload, file, public_id=key, overwrite=True,
+                                    timeout=settings.storage_timeout, **options)
+
+    def url(self, key: str, version=None, **transformation) -> str:
+        cloudinary_config()
+        return cloudinary.CloudinaryImage(key).build_url(version=version, **transformation)
+
+    @staticmethod
+    def _download(url: str) -> bytes:
+        try:
+            with urlopen(url, timeout=settings.storage_timeout) as response:
+                return response.read()
+        except HTTPError as error:
+            if error.code == 404:
+                raise FileNotFoundError(url) from error
+            raise
+
+    async def read(self, key: str) -> bytes:
+        return await run_storage_io(self._download, self.url(key, secure=True))
+
+    async def delete(self, key: str) -> None:
+        cloudinary_config()
+        await run_storage_io(cloudinary.uploader.destroy, key, invalidate=True, timeout=settings.storage_timeout)
+
+
+class LocalStorage(StorageBackend):
+    """
+    Stores assets on the local disk under root/ab/cd/<sha256 of key>, so no directory grows too large.
+    Files are served by the /api/media route. Transformations are not applied by url, use transform_engine 'local' to render them.
+    """
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip('/')
+
+    def path(self, key: str) -> Path:
+        """
+        The path function maps a key to its file in the sharded directory layout.
+
+        :param key: str: The key of the asset
+        :return: The path of the file
+        """
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    @staticmethod
+    def _write(file, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{time.monotonic_ns()}.tmp')
+        with open(tmp_path, 'wb') as out:
+            shutil.copyfileobj(file, out, 1024 * 1024)
+        os.replace(tmp_path, path)
+
+    async def save(self, file, key: str, **options) -> dict:
+        await run_storage_io(self._write, file, self.path(key))
+        return {'version': int(time.time())}
+
+    def url(self, key: str, version=None, **transformation) -> str:
+        url = f'{self.base_url}/{quote(key)}'
+        return f'{url}?v={version}' if version else url
+
+    async def read(self, key: str) -> bytes:
+        return await run_storage_io(self.path(key).read_bytes)
+
+    async def delete(self, key: str) -> None:
+        await run_storage_io(self.path(key).unlink, missing_ok=True)
+
+
+def get_storage() -> StorageBackend:
+    """
+    The get_storage function creates the storage backend selected by settings.storage_backend.
+
+    :return: A CloudinaryStorage or a LocalStorage
+    """
+    if settings.storage_backend == 'local':
+        return LocalStorage(settings.storage_root, settings.storage_base_url)
+    return CloudinaryStorage()
+
+
+storage = get_storage()
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+from fastapi import HTTPException, status
+
+from src.conf.config import settings
+from src.services.renderer import render_async, spec_hash
+from src.services.storage import storage, run_storage_io
+
+KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+class CachedImage(NamedTuple):
+    file: BinaryIO
+    size: int
+
+
+class TransformCache:
+    """
+    Transformed images rendered on first request and kept on disk.
+    A key is the canonical hash of (source key, SHA-256 of the source content, transformation spec),
+    so it always names the same image: a source whose content no longer matches is not rendered.
+    The transformer only registers the spec of a key in a small sidecar file, the image is rendered
+    by the first request for it. Concurrent requests for a key share one render.
+    Rendered files count against max_bytes and are evicted least recently used first. Sidecars are never
+    evicted: the url of a key is stored in photo.qr_code_url, so an evicted image is rendered again
+    from its sidecar on the next request.
+    The index is kept per process, files written by another process are adopted on first use
+    and a file evicted by another process is simply rendered again.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.index = None
+        self.total = 0
+        self.inflight = {}
+
+    def _spec_path(self, key: str) -> Path:
+        return self.root / key[:2] / f'{key}.json'
+
+    def _image_path(self, key: str) -> Path:
+        return self.root / key[:2] / f'{key}.png'
+
+    def _load_index(self):
+        entries = []
+        for path in self.root.glob('*/*.png') if self.root.is_dir() else []:
+            stat = path.stat()
+            entries.append((stat.st_atime, path.stem, stat.st_size))
+        self.index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.total = sum(self.index.values())
+
+    def _account(self, key: str, size: int):
+        self.total += size
+        self.index[key] = self.index.get(key, 0) + size
+        self.index.move_to_end(key)
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{time.monotonic_ns()}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    async def register(self, source_key: str, content_hash: str, spec: dict) -> str:
+        """
+        The register function records how to render a transformation without rendering it.
+
+        :param source_key: str: The storage key of the original image
+        :param content_hash: str: The SHA-256 of the original image, the key changes with the content
+        :param spec: dict: TransformerModel.dict()
+        :return: The key of the transformed image
+        """
+        registration = {'source': source_key, 'content': content_hash, 'spec': spec}
+        key = spec_hash(registration)
+        if self.index is None:
+            await run_storage_io(self._load_index)
+        path = self._spec_path(key)
+        if not path.is_file():
+            await run_storage_io(self._write, path, json.dumps(registration, sort_keys=True).encode())
+        return key
+
+    def _unlink(self, keys: list):
+        for key in keys:
+            self._image_path(key).unlink(missing_ok=True)
+
+    async def _evict(self):
+        evicted = []
+        while self.total > self.max_bytes and len(self.index) > 1:
+            key, size = self.index.popitem(last=False)
+            self.total -= size
+            evicted.append(key)
+        if evicted:
+            await run_storage_io(self._unlink, evicted)
+
+    async def _render(self, key: str):
+        spec_path = self._spec_path(key)
+        try:
+            registration = json.loads(await run_storage_io(spec_path.read_bytes))
+            source = await storage.read(registration['source'])
+        except FileNotFoundError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+        if hashlib.sha256(source).hexdigest() != registration['content']:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+        try:
+            rendered = await render_async(source, registration['spec'])
+        except ValueError as error:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(error))
+        await run_storage_io(self._write, self._image_path(key), rendered)
+        self.total -= self.index.pop(key, 0)
+        self._account(key, len(rendered))
+        await self._evict()
+
+    async def _render_once(self, key: str):
+        future = self.inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            await self._render(key)
+            future.set_result(None)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+    async def get(self, key: str) -> CachedImage:
+        """
+        The get function returns the file of a transformed image, rendering it if it is not cached.
+        The file is returned open, so an eviction after get returns cannot take it away from the response.
+
+        :param key: str: The key returned by register
+        :return: The open PNG file and its size, the caller closes the file
+        """
+        if not KEY_PATTERN.fullmatch(key):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+        if self.index is None:
+            await run_storage_io(self._load_index)
+        for _ in range(3):
+            try:
+                file = open(self._image_path(key), 'rb')
+            except FileNotFoundError:
+                await self._render_once(key)
+                continue
+            size = os.fstat(file.fileno()).st_size
+            if key in self.index:
+                self.index.move_to_end(key)
+            else:
+                self._account(key, size)
+            return CachedImage(file, size)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Transform cache is full")
+
+
+transform_cache = TransformCache(settings.transform_cache_dir, settings.transform_cache_max_bytes)
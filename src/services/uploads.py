@@ -0,0 +1,227 @@
+import hashlib
+from typing import BinaryIO, NamedTuple
+
+from fastapi import HTTPException, Request, UploadFile, status
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.responses import JSONResponse
+
+from src.conf.config import settings
+from src.services.storage import sniff_image_type
+
+FORM_OVERHEAD = 1024 * 1024
+
+
+class UploadedImage(NamedTuple):
+    file: BinaryIO
+    size: int
+    sha256: str
+    media_type: str
+
+
+class UploadDigest(NamedTuple):
+    name: str
+    filename: str
+    size: int
+    sha256: str
+    head: bytes
+
+
+class UploadDigester:
+    """
+    Hashes the files of a multipart/form-data body while it is received. The body is fed chunk by chunk
+    to a multipart parser, the data of every part with a filename goes to its own SHA-256, its size is counted
+    and its first bytes are kept to sniff the format. The digests are keyed by the index of their part in the body,
+    two files with the same name and size cannot be mixed up. A body the parser cannot read disables the digests,
+    read_image_upload then falls back to reading the spooled file.
+    """
+
+    HEAD_SIZE = 16
+
+    def __init__(self, boundary: bytes):
+        self.digests = {}
+        self.failed = False
+        self._index = -1
+        self._header_field = b''
+        self._header_value = b''
+        self._disposition = b''
+        self._name = None
+        self._filename = None
+        self._hasher = None
+        self._size = 0
+        self._head = b''
+        self.parser = MultipartParser(boundary, callbacks={
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._index += 1
+        self._disposition = b''
+        self._hasher = None
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b'content-disposition':
+            self._disposition = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if b'filename' in options:
+            self._name = options.get(b'name', b'').decode('utf-8', errors='replace')
+            self._filename = options[b'filename'].decode('utf-8', errors='replace')
+            self._hasher = hashlib.sha256()
+            self._size = 0
+            self._head = b''
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._hasher is not None:
+            chunk = data[start:end]
+            self._hasher.update(chunk)
+            self._size += len(chunk)
+            if len(self._head) < self.HEAD_SIZE:
+                self._head += chunk[:self.HEAD_SIZE - len(self._head)]
+
+    def _on_part_end(self):
+        if self._hasher is not None:
+            self.digests[self._index] = UploadDigest(self._name, self._filename, self._size, self._hasher.hexdigest(),
+                                                     self._head)
+            self._hasher = None
+
+    def write(self, chunk: bytes) -> None:
+        """
+        The write function feeds the next chunk of the body to the parser.
+
+        :param chunk: bytes: The chunk as received
+        :return: None
+        """
+        if self.failed:
+            return
+        try:
+            self.parser.write(chunk)
+        except Exception:
+            self.failed = True
+            self.digests.clear()
+
+    @classmethod
+    def for_scope(cls, scope: Scope) -> 'UploadDigester | None':
+        """
+        The for_scope function creates a digester for a multipart/form-data request and publishes its digests
+        in the request state (request.state.upload_digests).
+
+        :param scope: Scope: The scope of the request
+        :return: An UploadDigester, or None if the request is not multipart/form-data
+        """
+        content_type = dict(scope['headers']).get(b'content-type', b'')
+        media_type, options = parse_options_header(content_type)
+        if media_type != b'multipart/form-data' or not options.get(b'boundary'):
+            return None
+        digester = cls(options[b'boundary'])
+        scope.setdefault('state', {})['upload_digests'] = digester.digests
+        return digester
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects request bodies larger than max_upload_size (plus room for the other form fields) with 413
+    while they are being received, instead of after the whole upload has been spooled.
+    The files of multipart bodies are hashed in the same pass, see UploadDigester.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int | None = None):
+        self.app = app
+        self.max_body_size = max_body_size or settings.max_upload_size + FORM_OVERHEAD
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        content_length = dict(scope['headers']).get(b'content-length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({'detail': 'File too large'}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            return await response(scope, receive, send)
+        received = 0
+        digester = UploadDigester.for_scope(scope)
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                body = message.get('body', b'')
+                received += len(body)
+                if received > self.max_body_size:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='File too large')
+                if digester is not None:
+                    digester.write(body)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _check_image(size: int, media_type: str | None):
+    if size > settings.max_upload_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='File too large')
+    if size == 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Empty file')
+    if media_type is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail='Unsupported image format')
+
+
+async def _find_digest(file: UploadFile, request: Request | None) -> UploadDigest | None:
+    digests = getattr(request.state, 'upload_digests', None) if request is not None else None
+    if not digests:
+        return None
+    # The form is already parsed for the route, it has one item per part in the order of the body.
+    for index, (name, value) in enumerate((await request.form()).multi_items()):
+        if value is file:
+            digest = digests.get(index)
+            if digest is not None and digest.name == name and digest.size == file.size:
+                return digest
+            return None
+    return None
+
+
+async def read_image_upload(file: UploadFile, request: Request | None = None) -> UploadedImage:
+    """
+    The read_image_upload function checks the size and format of an uploaded image and returns its SHA-256.
+    With the request, the digest that UploadSizeLimitMiddleware computed while the body was received is used,
+    so the spooled file is not read again before the storage backend reads it.
+    Without one (or if the body could not be digested) the file is read in one chunked pass:
+    it stops as soon as the size goes over max_upload_size, sniffs the format from the first chunk
+    and computes the SHA-256 incrementally, so memory use does not depend on the file size.
+
+    :param file: UploadFile: The uploaded file
+    :param request: Request: The request the file was uploaded with
+    :return: The file with its size, SHA-256 hex digest and media type
+    """
+    digest = await _find_digest(file, request)
+    if digest is not None:
+        media_type = sniff_image_type(digest.head)
+        _check_image(digest.size, media_type)
+        await file.seek(0)
+        return UploadedImage(file=file.file, size=digest.size, sha256=digest.sha256, media_type=media_type)
+
+    hasher = hashlib.sha256()
+    size = 0
+    media_type = None
+    await file.seek(0)
+    while chunk := await file.read(settings.upload_chunk_size):
+        if size == 0:
+            media_type = sniff_image_type(chunk)
+        size += len(chunk)
+        _check_image(size, media_type)
+        hasher.update(chunk)
+    _check_image(size, media_type)
+    await file.seek(0)
+    return UploadedImage(file=file.file, size=size, sha256=hasher.hexdigest(), media_type=media_type)
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.models import User
+
+
+class UsernameIndex:
+    """
+    Usernames kept in a sorted in-process list for prefix autocomplete. A lookup is a binary search for the
+    first key at or after the prefix followed by a walk over the matches, so it never touches the database.
+    Entries are distinct (casefolded username, username) pairs, matching is case-insensitive.
+    The list is loaded on the first lookup and updated incrementally on signup and rename in this process;
+    changes made by other processes show up when the list is reloaded, every refresh seconds.
+    """
+
+    def __init__(self, refresh: float):
+        self.refresh = refresh
+        self.entries = []
+        self.loaded_at = None
+        self.pending = None
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def _entry(username: str) -> tuple[str, str]:
+        return username.casefold(), username
+
+    def _apply(self, old: str | None, new: str | None):
+        entries = self.entries
+        if old:
+            entry = self._entry(old)
+            position = bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+        if new:
+            entry = self._entry(new)
+            position = bisect_left(entries, entry)
+            if position == len(entries) or entries[position] != entry:
+                entries.insert(position, entry)
+
+    def _change(self, old: str | None, new: str | None):
+        if self.pending is not None:
+            self.pending.append((old, new))
+        if self.loaded_at is not None:
+            self._apply(old, new)
+
+    def add(self, username: str) -> None:
+        """
+        The add function adds the username of a new user, call it after the user is committed.
+
+        :param username: str: The username of the new user
+        :return: None
+        """
+        self._change(None, username)
+
+    def rename(self, old: str, new: str) -> None:
+        """
+        The rename function replaces the username of a renamed user, call it after the rename is committed.
+
+        :param old: str: The previous username
+        :param new: str: The new username
+        :return: None
+        """
+        if old != new:
+            self._change(old, new)
+
+    async def load(self, db: AsyncSession) -> None:
+        """
+        The load function reads all usernames from the database and replaces the list.
+        Changes made while the usernames are read are applied to the new list, so none of them is lost.
+
+        :param db: AsyncSession: Access the database
+        :return: None
+        """
+        self.pending = []
+        try:
+            usernames = await db.scalars(select(User.username).filter(User.username.isnot(None)))
+            entries = sorted({self._entry(username) for username in usernames})
+            self.entries, pending = entries, self.pending
+            for old, new in pending:
+                self._apply(old, new)
+            self.loaded_at = time.monotonic()
+        finally:
+            self.pending = None
+
+    async def complete(self, prefix: str, limit: int, db: AsyncSession) -> List[str]:
+        """
+        The complete function returns the usernames that start with the prefix, in alphabetical order.
+
+        :param prefix: str: The beginning of the username, case-insensitive
+        :param limit: int: The maximum number of usernames returned
+        :param db: AsyncSession: Access the database if the list has to be (re)loaded
+        :return: A list of usernames
+        """
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh:
+            async with self.lock:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh:
+                    await self.load(db)
+        key = prefix.casefold()
+        entries = self.entries
+        suggestions = []
+        for position in range(bisect_left(entries, (key,)), len(entries)):
+            if len(suggestions) >= limit or not entries[position][0].startswith(key):
+                break
+            suggestions.append(entries[position][1])
+        return suggestions
+
+
+username_index = UsernameIndex(settings.username_index_refresh)
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from src.conf.config import settings
+from src.database.db import DBSession
+from src.database.models import User
+from src.repository import photos as repository_photos
+from src.repository.photo_transformer import transformer
+from src.schemas_of_transformation import TransformerModel
+from src.services.jobs import JobQueue, job_queue
+
+logger = logging.getLogger(__name__)
+
+job_handlers = {}
+
+
+class JobError(Exception):
+    """
+    A job failure that retrying will not fix, e.g. the photo was deleted meanwhile.
+    """
+
+
+def job_handler(kind: str):
+    """
+    The job_handler decorator registers the coroutine that runs the jobs of the given kind.
+    Handlers are called with the job, the queue (to report progress) and a database session,
+    and return a JSON serializable result.
+
+    :param kind: str: The kind of the jobs
+    :return: The decorator
+    """
+    def register(func):
+        job_handlers[kind] = func
+        return func
+    return register
+
+
+@job_handler('upload_photo')
+async def upload_photo(job: dict, queue: JobQueue, db) -> dict:
+    payload = job['payload']
+    user = await db.get(User, job['user_id'])
+    if user is None:
+        raise JobError('User not found')
+    with open(payload['staged_path'], 'rb') as file:
+        key, url = await repository_photos.save_asset(file, payload['content_hash'], user, db)
+    await queue.update(job['id'], progress=60)
+    photo = await repository_photos.create_photo(payload['title'], payload['description'], payload['tags'], url, user,
+                                                 db, content_hash=payload['content_hash'], storage_key=key)
+    return {'photo_id': photo.id, 'photo_url': photo.photo_url}
+
+
+@job_handler('transform_photo')
+async def transform_photo(job: dict, queue: JobQueue, db) -> dict:
+    payload = job['payload']
+    user = await db.get(User, job['user_id'])
+    if user is None:
+        raise JobError('User not found')
+    photo = await transformer(payload['photo_id'], TransformerModel(**payload['body']), user, db)
+    if photo is None:
+        raise JobError('Image not found')
+    return {'photo_id': photo.id, 'qr_code_url': photo.qr_code_url}
+
+
+def _cleanup(job: dict):
+    staged_path = job['payload'].get('staged_path')
+    if staged_path and os.path.exists(staged_path):
+        os.remove(staged_path)
+
+
+async def run_job(job_id: str, queue: JobQueue, worker: str):
+    """
+    The run_job function runs one job and records its outcome.
+    A failed job is queued again until it has been tried job_max_attempts times, unless it raised JobError.
+    A job that has expired or was already finished (taken back from a worker that died after finishing it)
+    is dropped.
+
+    :param job_id: str: The id of the job
+    :param queue: JobQueue: The queue the job came from
+    :param worker: str: The id of the worker running the job
+    :return: None
+    """
+    job = await queue.get(job_id)
+    if job is None or job['status'] in ('done', 'failed'):
+        await queue.finish(worker, job_id)
+        return
+    attempts = job['attempts'] + 1
+    await queue.update(job_id, status='running', attempts=attempts, progress=10)
+    try:
+        async with DBSession() as db:
+            result = await job_handlers[job['kind']](job, queue, db)
+    except Exception as err:
+        logger.exception('Job %s (%s) failed, attempt %s', job_id, job['kind'], attempts)
+        if isinstance(err, JobError) or attempts >= settings.job_max_attempts:
+            await queue.finish(worker, job_id, status='failed', error=str(err) or type(err).__name__)
+            _cleanup(job)
+        else:
+            await queue.requeue(worker, job_id, status='queued', error=str(err) or type(err).__name__)
+        return
+    await queue.finish(worker, job_id, status='done', progress=100, result=result, error=None)
+    _cleanup(job)
+
+
+async def _keep_alive(queue: JobQueue, worker: str):
+    while True:
+        await asyncio.sleep(settings.job_worker_ttl / 3)
+        try:
+            await queue.heartbeat(worker, settings.job_worker_ttl)
+        except Exception:
+            logger.exception('Heartbeat of worker %s failed', worker)
+
+
+async def _recover(queue: JobQueue):
+    while True:
+        try:
+            recovered = await queue.recover()
+            if recovered:
+                logger.warning('Requeued %s jobs of dead workers', recovered)
+        except Exception:
+            logger.exception('Recovering the jobs of dead workers failed')
+        await asyncio.sleep(settings.job_worker_ttl)
+
+
+async def run_worker(queue: JobQueue = job_queue):
+    """
+    The run_worker function takes jobs from the queue and runs them, one at a time, forever.
+    The worker refreshes its heartbeat every job_worker_ttl / 3 seconds, even while a job runs;
+    if it stops for job_worker_ttl seconds its job is given to another worker.
+
+    :param queue: JobQueue: The queue to consume
+    :return: None
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    await queue.heartbeat(worker, settings.job_worker_ttl)
+    keep_alive = asyncio.create_task(_keep_alive(queue, worker))
+    try:
+        while True:
+            job_id = await queue.dequeue(worker, timeout=5)
+            if job_id:
+                await run_job(job_id, queue, worker)
+    finally:
+        keep_alive.cancel()
+
+
+async def run_workers(queue: JobQueue = job_queue):
+    """
+    The run_workers function runs job_concurrency workers on the same queue, and puts the jobs of
+    dead workers back in the queue every job_worker_ttl seconds.
+
+    :param queue: JobQueue: The queue to consume
+    :return: None
+    """
+    await asyncio.gather(_recover(queue), *(run_worker(queue) for _ in range(settings.job_concurrency)))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_workers())
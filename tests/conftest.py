@@ -0,0 +1,133 @@
+import os
+import tempfile
+from contextlib import asynccontextmanager
+
+os.environ.setdefault('SQLALCHEMY_DATABASE_URL', 'sqlite+aiosqlite://')
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+os.environ.setdefault('RESPONSE_CACHE_BACKEND', 'memory')
+os.environ.setdefault('TOKEN_STORE_BACKEND', 'memory')
+os.environ.setdefault('PRINCIPAL_CACHE_BACKEND', 'memory')
+os.environ.setdefault('READ_YOUR_WRITES_BACKEND', 'memory')
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+_files = tempfile.mkdtemp(prefix='photoshare-tests-')
+os.environ.setdefault('STORAGE_ROOT', os.path.join(_files, 'media'))
+os.environ.setdefault('TRANSFORM_CACHE_DIR', os.path.join(_files, 'transform_cache'))
+os.environ.setdefault('JOB_STAGING_DIR', os.path.join(_files, 'staging'))
+os.environ.setdefault('JOB_BACKEND', 'memory')
+
+import asyncio  # noqa: E402
+
+import pytest  # noqa: E402
+from fastapi import Request, Response  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from fastapi_limiter.depends import RateLimiter  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker  # noqa: E402
+from sqlalchemy.pool import NullPool  # noqa: E402
+
+from src.database import db as db_module  # noqa: E402
+from src.database.models import Base  # noqa: E402
+
+
+@asynccontextmanager
+async def database(path):
+    """
+    An AsyncSession on a fresh SQLite database file with all tables created.
+    """
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}/test.db')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    try:
+        async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+            yield db
+    finally:
+        await engine.dispose()
+
+
+async def _no_rate_limit(self, request: Request, response: Response):
+    return None
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """
+    A TestClient of the application on a fresh SQLite database, with the in-process caches emptied.
+    The startup event (Redis rate limiter, workers) is not run, rate limits are disabled.
+    """
+    import main
+    from src.services.principal_cache import principal_cache
+    from src.services.qr_cache import qr_cache
+    from src.services.refresh_tokens import refresh_tokens
+    from src.services.response_cache import photos_cache, profiles_cache
+    from src.services.username_index import username_index
+
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path}/app.db', poolclass=NullPool)
+
+    async def create_all():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    asyncio.run(create_all())
+
+    session_factory = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    monkeypatch.setattr(db_module, 'DBSession', session_factory)
+    monkeypatch.setattr(db_module, 'ReplicaDBSession', session_factory)
+    monkeypatch.setattr(RateLimiter, '__call__', _no_rate_limit)
+    for cache in (photos_cache, profiles_cache):
+        cache.items.clear()
+        cache.versions.clear()
+    principal_cache.items.clear()
+    qr_cache.items.clear()
+    refresh_tokens.families.clear()
+    db_module.write_tracker._writes.clear()
+    username_index.entries, username_index.loaded_at = [], None
+    yield TestClient(main.app)
+    asyncio.run(engine.dispose())
+
+
+def signup(client, username: str, email: str, password: str = 'secret1') -> dict:
+    """
+    Signs a user up and logs them in, returns the Authorization header of their access token.
+    """
+    response = client.post('/api/auth/signup', json={'username': username, 'email': email, 'password': password})
+    assert response.status_code == 201, response.text
+    response = client.post('/api/auth/login', data={'username': email, 'password': password})
+    assert response.status_code == 200, response.text
+    return {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+
+def make_admin(email: str):
+    """
+    Gives a signed up user the admin role directly in the database.
+    """
+    from sqlalchemy import update
+    from src.database.models import Role, User
+    from src.services.principal_cache import principal_cache
+
+    async def promote():
+        async with db_module.DBSession() as db:
+            await db.execute(update(User).where(User.email == email).values(roles=Role.admin))
+            await db.commit()
+        await principal_cache.invalidate(email)
+    asyncio.run(promote())
+
+
+def png(color=(200, 30, 30), size=(64, 48)) -> bytes:
+    """
+    A small PNG image of one color.
+    """
+    from io import BytesIO
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def upload_photo(client, headers: dict, title: str = 'title', color=(200, 30, 30), tags: str = 'tag') -> dict:
+    """
+    Uploads a photo through the API and returns the created photo.
+    """
+    response = client.post('/api/photos/', headers=headers,
+                           params={'title': title, 'description': 'description'}, data={'tags': tags},
+                           files={'file': (f'{title}.png', png(color), 'image/png')})
+    assert response.status_code == 201, response.text
+    return response.json()
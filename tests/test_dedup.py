@@ -0,0 +1,49 @@
+from conftest import signup, upload_photo
+from src.conf.config import settings
+from src.services.storage import storage
+
+
+def spy_saves(monkeypatch) -> list:
+    keys = []
+    save = storage.save
+
+    async def counting_save(file, key, **options):
+        keys.append(key)
+        return await save(file, key, **options)
+
+    monkeypatch.setattr(storage, 'save', counting_save)
+    return keys
+
+
+def test_same_image_is_stored_once_and_deleted_with_its_last_photo(client, monkeypatch):
+    saved = spy_saves(monkeypatch)
+    headers = signup(client, 'dedup11', 'dedup@example.com')
+    first = upload_photo(client, headers, title='first')
+    second = upload_photo(client, headers, title='second')
+    upload_photo(client, headers, title='other', color=(0, 90, 0))
+    assert len(saved) == 2
+    shared = storage.path(saved[0])
+
+    assert client.delete(f"/api/photos/{first['id']}", headers=headers).status_code == 200
+    assert shared.exists()
+    assert client.delete(f"/api/photos/{second['id']}", headers=headers).status_code == 200
+    assert not shared.exists()
+    assert storage.path(saved[1]).exists()
+
+
+def test_dedup_across_users_is_optional(client, monkeypatch):
+    saved = spy_saves(monkeypatch)
+    alice = signup(client, 'alice11', 'alice@example.com')
+    bob = signup(client, 'bobby11', 'bob@example.com')
+
+    upload_photo(client, alice, title='alice')
+    upload_photo(client, bob, title='bob')
+    assert len(saved) == 2
+
+    monkeypatch.setattr(settings, 'dedup_across_users', True)
+    upload_photo(client, alice, title='alice', color=(0, 0, 90))
+    mine = upload_photo(client, bob, title='bob', color=(0, 0, 90))
+    assert len(saved) == 3
+
+    assert client.delete(f"/api/photos/{mine['id']}", headers=bob).status_code == 200
+    assert storage.path(saved[2]).exists()
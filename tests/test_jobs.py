@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from src.services.jobs import InMemoryJobQueue, JobQueue, RedisJobQueue
+from src.worker import job_handlers, run_job
+
+
+def test_queue_interface_is_abstract():
+    with pytest.raises(TypeError):
+        JobQueue()
+
+
+def test_redis_fields_round_trip_free_text():
+    queue = RedisJobQueue(client=None)
+    job = queue.new_job('upload_photo', {'title': 'null'}, 1)
+    job.update(status='failed', error='null')
+    encoded = queue._encode(job)
+    assert queue._decode(encoded) == job
+    assert queue._decode(queue._encode({'error': None, 'result': None})) == {'error': None, 'result': None}
+
+
+def test_failed_job_is_retried_then_failed(monkeypatch):
+    calls = []
+
+    async def flaky(job, queue, db):
+        calls.append(job['id'])
+        raise RuntimeError('boom')
+
+    monkeypatch.setitem(job_handlers, 'flaky', flaky)
+
+    async def scenario():
+        queue = InMemoryJobQueue()
+        job = await queue.enqueue('flaky', {}, 1)
+        for _ in range(3):
+            job_id = await queue.dequeue('w1', timeout=1)
+            await run_job(job_id, queue, 'w1')
+        assert await queue.dequeue('w1', timeout=0.01) is None
+        return await queue.get(job['id'])
+
+    job = asyncio.run(scenario())
+    assert len(calls) == 3
+    assert job['status'] == 'failed' and job['error'] == 'boom' and job['attempts'] == 3
+
+
+def test_finished_job_taken_again_is_dropped(monkeypatch):
+    calls = []
+
+    async def once(job, queue, db):
+        calls.append(job['id'])
+        return {'ok': True}
+
+    monkeypatch.setitem(job_handlers, 'once', once)
+
+    async def scenario():
+        queue = InMemoryJobQueue()
+        job = await queue.enqueue('once', {}, 1)
+        await run_job(await queue.dequeue('w1', timeout=1), queue, 'w1')
+        await run_job(job['id'], queue, 'w2')
+        return await queue.get(job['id'])
+
+    job = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert job['status'] == 'done' and job['result'] == {'ok': True}
+
+
+def test_redis_error_stored_as_raw_text_is_read():
+    assert RedisJobQueue(client=None)._decode({'error': 'boom'}) == {'error': 'boom'}
@@ -0,0 +1,73 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from conftest import make_admin, signup, upload_photo
+from src.schemas import CommentBase
+from src.services.ndjson import _lines
+
+
+def lines(response) -> list:
+    assert response.status_code == 200, response.text
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert response.text.endswith('\n')
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_users_are_streamed_on_request(client):
+    signup(client, 'stream1', 'a@example.com')
+    signup(client, 'stream2', 'b@example.com')
+
+    listed = client.get('/api/users/users/').json()
+    streamed = lines(client.get('/api/users/users/', params={'format': 'ndjson'}))
+    assert [user['username'] for user in streamed] == ['stream1', 'stream2']
+    assert sorted(listed, key=lambda user: user['id']) == streamed
+    assert lines(client.get('/api/users/users/', headers={'Accept': 'application/x-ndjson'})) == streamed
+    response = client.get('/api/users/users/', params={'format': 'json'}, headers={'Accept': 'application/x-ndjson'})
+    assert response.headers['content-type'] == 'application/json'
+    assert client.get('/api/users/users/', params={'format': 'xml'}).status_code == 422
+
+
+def test_admin_exports_photos_and_comments(client):
+    headers = signup(client, 'export1', 'export@example.com')
+    first = upload_photo(client, headers, title='first', color=(10, 10, 10))
+    second = upload_photo(client, headers, title='second', color=(20, 20, 20))
+    for text in ('nice', 'great'):
+        response = client.post(f"/api/comments/new/{first['id']}", headers=headers, params={'photo_id': first['id']},
+                               json=CommentBase(text=text).dict())
+        assert response.status_code == 200, response.text
+
+    assert client.get('/api/admin/export/photos', headers=headers).status_code == 403
+    make_admin('export@example.com')
+
+    response = client.get('/api/admin/export/photos', headers=headers)
+    assert 'photos.ndjson' in response.headers['content-disposition']
+    photos = lines(response)
+    assert [photo['id'] for photo in photos] == [first['id'], second['id']]
+    assert photos[0]['title'] == 'first' and photos[0]['comment_count'] == 2
+
+    comments = lines(client.get('/api/admin/export/comments', headers=headers))
+    assert [(comment['text'], comment['photo_id']) for comment in comments] == [('nice', first['id']),
+                                                                               ('great', first['id'])]
+
+
+class Row(BaseModel):
+    text: str
+
+    class Config:
+        orm_mode = True
+
+
+def test_rows_are_sent_in_chunks():
+    async def rows():
+        for number in range(5):
+            yield SimpleNamespace(text=f'row {number}')
+
+    async def scenario():
+        return [chunk async for chunk in _lines(rows(), Row, 2)]
+
+    chunks = asyncio.run(scenario())
+    assert [chunk.count(b'\n') for chunk in chunks] == [2, 2, 1]
+    assert json.loads(chunks[-1]) == {'text': 'row 4'}
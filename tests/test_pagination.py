@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime
+
+from conftest import database
+from src.database.models import Comment, Photo, User
+from src.repository.comments import get_comments_page
+from src.repository.photos import get_photos, get_photos_page
+from src.repository.users import get_users_page
+
+
+async def walk(fetch_page, max_pages: int = 50) -> list:
+    ids, cursor = [], None
+    for _ in range(max_pages):
+        rows, cursor = await fetch_page(cursor)
+        ids.extend(row.id for row in rows)
+        if cursor is None:
+            return ids
+    raise AssertionError(f'pagination did not end, ids so far: {ids}')
+
+
+def newest_first(rows) -> list:
+    return [row.id for row in sorted(rows, key=lambda row: (row.created_at, row.id), reverse=True)]
+
+
+def test_photo_pages_within_one_second(tmp_path):
+    async def scenario():
+        async with database(tmp_path) as db:
+            user = User(username='pager1', email='pager1@example.com', password='x')
+            db.add(user)
+            await db.commit()
+            same_second = datetime(2024, 1, 1, 12, 0, 0)
+            photos = [Photo(title=f'p{i}', user_id=user.id) for i in range(7)]
+            photos += [Photo(title=f's{i}', user_id=user.id, created_at=same_second) for i in range(5)]
+            db.add_all(photos)
+            await db.commit()
+
+            ids = await walk(lambda cursor: get_photos_page(cursor, 2, user, db))
+            assert ids == newest_first(photos)
+
+    asyncio.run(scenario())
+
+
+def test_user_pages_within_one_second(tmp_path):
+    async def scenario():
+        async with database(tmp_path) as db:
+            users = [User(username=f'pager{i}', email=f'pager{i}@example.com', password='x') for i in range(9)]
+            db.add_all(users)
+            await db.commit()
+
+            ids = await walk(lambda cursor: get_users_page(cursor, 2, db))
+            assert ids == newest_first(users)
+
+    asyncio.run(scenario())
+
+
+def test_comment_pages_within_one_second(tmp_path):
+    async def scenario():
+        async with database(tmp_path) as db:
+            user = User(username='pager1', email='pager1@example.com', password='x')
+            db.add(user)
+            await db.commit()
+            photo = Photo(title='p', user_id=user.id)
+            db.add(photo)
+            await db.commit()
+            same_second = datetime(2024, 1, 1, 12, 0, 0)
+            comments = [Comment(text=f'c{i}', user_id=user.id, photo_id=photo.id) for i in range(7)]
+            comments += [Comment(text=f's{i}', user_id=user.id, photo_id=photo.id, created_at=same_second)
+                         for i in range(5)]
+            db.add_all(comments)
+            await db.commit()
+
+            ids = await walk(lambda cursor: get_comments_page(photo.id, cursor, 2, db))
+            assert ids == newest_first(comments)[::-1]
+
+    asyncio.run(scenario())
+
+
+def test_photo_offset_pages_within_one_second(tmp_path):
+    async def scenario():
+        async with database(tmp_path) as db:
+            user = User(username='pager1', email='pager1@example.com', password='x')
+            db.add(user)
+            await db.commit()
+            same_second = datetime(2024, 1, 1, 12, 0, 0)
+            photos = [Photo(title=f's{i}', user_id=user.id, created_at=same_second) for i in range(5)]
+            photos += [Photo(title=f'p{i}', user_id=user.id) for i in range(4)]
+            db.add_all(photos)
+            await db.commit()
+
+            ids = []
+            for skip in range(0, len(photos), 2):
+                ids.extend(photo.id for photo in await get_photos(skip, 2, user, db))
+            assert ids == newest_first(photos)
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+from conftest import make_admin, signup
+from src.services.auth import auth_service
+from src.services.passwords import password_stats, password_workers, run_password_hashing
+
+
+def test_hashing_runs_in_the_bounded_pool():
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def slow_hash():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+        return threading.current_thread().name
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        task = asyncio.ensure_future(ticker())
+        names = await asyncio.gather(*(run_password_hashing(slow_hash) for _ in range(password_workers * 2)))
+        task.cancel()
+        return names, ticks
+
+    calls = password_stats.calls
+    names, ticks = asyncio.run(scenario())
+    assert all(name.startswith('bcrypt') for name in names)
+    assert peak == password_workers
+    assert ticks > 5
+    assert password_stats.calls == calls + password_workers * 2
+    assert password_stats.max_queue_time > 0
+    assert password_stats.waiting == password_stats.running == 0
+
+
+def test_passwords_are_hashed_and_verified_off_the_loop():
+    async def scenario():
+        hashed = await auth_service.get_password_hash_async('secret1')
+        return (hashed, await auth_service.verify_password_async('secret1', hashed),
+                await auth_service.verify_password_async('wrong11', hashed))
+
+    hashed, right, wrong = asyncio.run(scenario())
+    assert hashed.startswith('$2b$') and right and not wrong
+
+
+def test_login_and_password_stats(client):
+    headers = signup(client, 'hasher1', 'hash@example.com')
+    response = client.post('/api/auth/login', data={'username': 'hash@example.com', 'password': 'wrong11'})
+    assert response.status_code == 401
+    assert client.get('/api/password_stats', headers=headers).status_code == 403
+
+    make_admin('hash@example.com')
+    stats = client.get('/api/password_stats', headers=headers).json()
+    assert stats['workers'] == password_workers and stats['calls'] >= 3
+    assert {'avg_queue_ms', 'max_queue_ms', 'avg_run_ms', 'max_run_ms', 'bcrypt_rounds'} <= stats.keys()
@@ -0,0 +1,55 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from conftest import make_admin, signup
+from src.conf.config import settings
+from src.database.db import async_url, engine_options
+from src.database.pool import InstrumentedQueuePool, get_pool_stats, pool_stats
+
+
+def test_async_url_swaps_the_driver():
+    assert async_url('postgresql+psycopg2://u:p@db/app') == 'postgresql+asyncpg://u:p@db/app'
+    assert async_url('sqlite:///./app.db') == 'sqlite+aiosqlite:///./app.db'
+    assert async_url('postgresql+asyncpg://u:p@db/app') == 'postgresql+asyncpg://u:p@db/app'
+
+
+def test_engine_options_come_from_settings(monkeypatch):
+    monkeypatch.setattr(settings, 'sqlalchemy_pool_size', 7)
+    monkeypatch.setattr(settings, 'sqlalchemy_max_overflow', 3)
+    monkeypatch.setattr(settings, 'sqlalchemy_echo', False)
+    options = engine_options('postgresql+asyncpg://u:p@db/app', 'primary')
+    assert options['poolclass'] is InstrumentedQueuePool
+    assert (options['pool_size'], options['max_overflow'], options['echo']) == (7, 3, False)
+    assert options['pool_logging_name'] == 'primary'
+    assert 'poolclass' not in engine_options('sqlite+aiosqlite:///./app.db', 'primary')
+
+
+def test_checkouts_are_counted(tmp_path):
+    async def scenario():
+        engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path}/pool.db', poolclass=InstrumentedQueuePool,
+                                     pool_size=1, max_overflow=0, pool_logging_name='pool-test')
+        try:
+            for _ in range(3):
+                async with engine.connect() as conn:
+                    await conn.execute(text('SELECT 1'))
+            return get_pool_stats('pool-test').snapshot(engine.pool)
+        finally:
+            await engine.dispose()
+            pool_stats.pop('pool-test', None)
+
+    stats = asyncio.run(scenario())
+    assert stats['pool_class'] == 'InstrumentedQueuePool'
+    assert (stats['checkouts'], stats['waits'], stats['timeouts']) == (3, 0, 0)
+    assert (stats['size'], stats['checkedout']) == (1, 0)
+    assert stats['max_checkout_ms'] >= stats['avg_checkout_ms'] >= 0
+
+
+def test_pool_stats_are_for_admins(client):
+    headers = signup(client, 'pooler1', 'pool@example.com')
+    assert client.get('/api/pool_stats', headers=headers).status_code == 403
+    make_admin('pool@example.com')
+    response = client.get('/api/pool_stats', headers=headers)
+    assert response.status_code == 200
+    assert {'checkouts', 'waits', 'timeouts', 'avg_checkout_ms'} <= response.json()['primary'].keys()
@@ -0,0 +1,72 @@
+import asyncio
+
+from conftest import make_admin, png, signup
+from src.database.models import User
+from src.repository import users as repository_users
+from src.services.principal_cache import PrincipalCache, principal_cache
+
+
+def count_lookups(monkeypatch) -> list:
+    emails = []
+    get_user_by_email = repository_users.get_user_by_email
+
+    async def counting_lookup(email, db):
+        emails.append(email)
+        return await get_user_by_email(email, db)
+
+    monkeypatch.setattr(repository_users, 'get_user_by_email', counting_lookup)
+    return emails
+
+
+def test_authentication_is_served_from_the_cache(client, monkeypatch):
+    headers = signup(client, 'cached1', 'cached@example.com')
+    lookups = count_lookups(monkeypatch)
+    for _ in range(3):
+        assert client.get('/api/users/my/', headers=headers).status_code == 200
+    assert lookups == ['cached@example.com']
+    fields = principal_cache.items['cached@example.com'][1]
+    assert fields['email'] == 'cached@example.com' and 'password' not in fields
+
+
+def test_role_changes_and_bans_take_effect_immediately(client):
+    admin = signup(client, 'admin11', 'admin@example.com')
+    target = signup(client, 'target1', 'target@example.com')
+    make_admin('admin@example.com')
+    assert client.get('/api/users/all', headers=target).status_code == 403
+
+    response = client.patch('/api/users/make_role/target@example.com/', headers=admin,
+                            json={'email': 'target@example.com', 'roles': 'admin'})
+    assert response.status_code == 200, response.text
+    assert client.get('/api/users/all', headers=target).status_code == 200
+
+    response = client.patch('/api/users/make_role/target@example.com/', headers=admin,
+                            json={'email': 'target@example.com', 'roles': 'user'})
+    assert response.status_code == 200, response.text
+    assert client.get('/api/users/all', headers=target).status_code == 403
+
+    response = client.patch('/api/users/ban/target@example.com/', headers=admin, json={'email': 'target@example.com'})
+    assert response.status_code == 200, response.text
+    assert client.get('/api/users/my/', headers=target).status_code == 403
+
+
+def test_profile_edit_is_seen_by_the_next_request(client):
+    headers = signup(client, 'before1', 'edit@example.com')
+    assert client.get('/api/users/my/', headers=headers).json()['username'] == 'before1'
+    response = client.put('/api/users/edit_me/', headers=headers, data={'new_username': 'after11'},
+                          files={'avatar': ('avatar.png', png(), 'image/png')})
+    assert response.status_code == 200, response.text
+    assert client.get('/api/users/my/', headers=headers).json()['username'] == 'after11'
+
+
+def test_user_loaded_before_an_invalidation_is_not_cached():
+    async def scenario():
+        cache = PrincipalCache(ttl=60, max_items=10)
+        user = User(id=1, username='stale11', email='stale@example.com', is_active=True)
+        generation = cache.generation
+        await cache.invalidate('stale@example.com')
+        await cache.put(user, generation)
+        assert await cache.get('stale@example.com') is None
+        await cache.put(user, cache.generation)
+        assert (await cache.get('stale@example.com')).username == 'stale11'
+
+    asyncio.run(scenario())
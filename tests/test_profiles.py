@@ -0,0 +1,21 @@
+from conftest import signup, upload_photo
+
+
+def test_profile_revalidation_sees_counter_changes(client):
+    headers = signup(client, 'profile1', 'profile1@example.com')
+    url = '/api/users/user_profile_with_username/profile1'
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['post_count'] == 0
+    assert 'last-modified' not in response.headers
+    etag = response.headers['etag']
+    assert client.get(url, headers={**headers, 'If-None-Match': etag}).status_code == 304
+
+    upload_photo(client, headers)
+
+    response = client.get(url, headers={**headers, 'If-None-Match': etag,
+                                         'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+    assert response.json()['post_count'] == 1
+    response = client.get(url, headers={**headers, 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import io
+import zipfile
+
+from conftest import signup, upload_photo
+from src.conf.config import settings
+from src.services import qr_cache as qr_cache_module
+from src.services.qr_cache import QRCache, qr_cache, zip_qr_codes
+
+
+def transform(client, headers: dict, photo_id: int, degree: int = 45):
+    spec = {'circle': {}, 'effect': {}, 'resize': {}, 'text': {},
+            'rotate': {'use_filter': True, 'width': 100, 'degree': degree}}
+    response = client.patch(f'/api/transformer/{photo_id}', headers=headers, json=spec)
+    assert response.status_code == 200, response.text
+
+
+def count_renders(monkeypatch) -> list:
+    urls = []
+    render_qr = qr_cache_module.render_qr
+
+    def counting_render(url):
+        urls.append(url)
+        return render_qr(url)
+
+    monkeypatch.setattr(qr_cache_module, 'render_qr', counting_render)
+    return urls
+
+
+def test_qr_code_is_prerendered_and_revalidated(client, monkeypatch):
+    monkeypatch.setattr(settings, 'transform_engine', 'local')
+    render_qr = qr_cache_module.render_qr
+    renders = count_renders(monkeypatch)
+    headers = signup(client, 'qrcode1', 'qr@example.com')
+    photo = upload_photo(client, headers)
+    assert client.get(f"/api/transformer/qr_code/{photo['id']}", headers=headers).status_code == 404
+
+    transform(client, headers, photo['id'])
+    assert len(renders) == 1
+    response = client.get(f"/api/transformer/qr_code/{photo['id']}", headers=headers)
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'image/png'
+    assert response.headers['etag'] == f'"{hashlib.sha256(renders[0].encode()).hexdigest()}"'
+    assert response.content == render_qr(renders[0])
+
+    etag = response.headers['etag']
+    response = client.get(f"/api/transformer/qr_code/{photo['id']}", headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304 and response.content == b''
+    assert client.post(f"/api/transformer/qr_code/{photo['id']}", headers=headers).status_code == 201
+    assert len(renders) == 1
+
+    transform(client, headers, photo['id'], degree=90)
+    response = client.get(f"/api/transformer/qr_code/{photo['id']}", headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['etag'] != etag
+    assert len(renders) == 2
+
+
+def test_qr_codes_of_other_users_are_not_served(client):
+    headers = signup(client, 'qrcode1', 'qr@example.com')
+    other = signup(client, 'qrcode2', 'qr2@example.com')
+    photo = upload_photo(client, headers)
+    transform(client, headers, photo['id'])
+    assert client.get(f"/api/transformer/qr_code/{photo['id']}", headers=other).status_code == 404
+
+
+def test_least_recently_used_codes_are_dropped():
+    async def scenario():
+        cache = QRCache(max_items=2)
+        for url in ('http://a', 'http://b', 'http://a', 'http://c'):
+            await cache.get(url)
+        return set(cache.items)
+
+    assert asyncio.run(scenario()) == {QRCache.key('http://a'), QRCache.key('http://c')}
+    assert qr_cache.etag('http://a') == f"\"{QRCache.key('http://a')}\""
+
+
+def unzip(content: bytes) -> dict:
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        assert archive.testzip() is None
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_qr_codes_are_exported_as_zip(client, monkeypatch):
+    monkeypatch.setattr(settings, 'transform_engine', 'local')
+    headers = signup(client, 'qrcode1', 'qr@example.com')
+    beach = upload_photo(client, headers, title='beach', color=(10, 10, 10), tags='sea')
+    city = upload_photo(client, headers, title='city', color=(20, 20, 20), tags='town')
+    plain = upload_photo(client, headers, title='plain', color=(30, 30, 30), tags='sea')
+    transform(client, headers, beach['id'])
+    transform(client, headers, city['id'])
+
+    response = client.post('/api/transformer/qr_codes/export', headers=headers,
+                           json={'photo_ids': [beach['id'], city['id'], plain['id']]})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/zip'
+    files = unzip(response.content)
+    assert sorted(files) == sorted(f"{photo['id']}.png" for photo in (beach, city))
+    qr = client.get(f"/api/transformer/qr_code/{beach['id']}", headers=headers)
+    assert files[f"{beach['id']}.png"] == qr.content
+
+    response = client.post('/api/transformer/qr_codes/export', headers=headers, json={'tag': 'sea'})
+    assert list(unzip(response.content)) == [f"{beach['id']}.png"]
+    assert len(unzip(client.post('/api/transformer/qr_codes/export', headers=headers, json={}).content)) == 2
+    response = client.post('/api/transformer/qr_codes/export', headers=headers, json={'photo_ids': [plain['id']]})
+    assert response.status_code == 404
+
+
+def test_zip_is_streamed_with_bounded_concurrency():
+    class SlowCache:
+        def __init__(self):
+            self.running = self.peak = 0
+
+        async def get(self, url):
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            await asyncio.sleep(0.001)
+            self.running -= 1
+            return url.encode() * 100
+
+    async def scenario():
+        cache = SlowCache()
+        codes = [(photo_id, f'http://photo/{photo_id}') for photo_id in range(20)]
+        chunks = [chunk async for chunk in zip_qr_codes(codes, cache, 4)]
+        return cache.peak, chunks
+
+    peak, chunks = asyncio.run(scenario())
+    assert peak == 4
+    assert len([chunk for chunk in chunks if chunk]) > 1
+    files = unzip(b''.join(chunks))
+    assert len(files) == 20 and files['7.png'] == b'http://photo/7' * 100
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from conftest import database
+from src.database.models import Photo, Rating, User
+from src.repository import ratings as repository_ratings
+
+
+async def rated_photo(db) -> tuple[User, int]:
+    # Like the principal cache, the rater is detached, a rollback does not expire it.
+    owner = User(username='owner1', email='owner1@example.com', password='x')
+    rater = User(username='rater1', email='rater1@example.com', password='x')
+    db.add_all([owner, rater])
+    await db.commit()
+    photo = Photo(title='rated', user_id=owner.id)
+    db.add(photo)
+    await db.commit()
+    db.expunge(rater)
+    await repository_ratings.rate_photo(photo.id, 2, rater, db)
+    return rater, photo.id
+
+
+def test_rating_inserted_concurrently_is_changed(tmp_path, monkeypatch):
+    async def scenario():
+        async with database(tmp_path) as db:
+            rater, photo_id = await rated_photo(db)
+            get_own_rating = repository_ratings._get_own_rating
+            misses = []
+
+            async def lagging(photo_id, user, session):
+                # The first lookup misses the rating, as if it was inserted right after it.
+                if not misses:
+                    misses.append(photo_id)
+                    return None
+                return await get_own_rating(photo_id, user, session)
+
+            monkeypatch.setattr(repository_ratings, '_get_own_rating', lagging)
+            photo = await repository_ratings.rate_photo(photo_id, 5, rater, db)
+            assert (photo.rating_sum, photo.rating_count) == (5, 1)
+            assert (await db.scalars(select(Rating.rate))).all() == [5]
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_rating_is_retried_only_once(tmp_path, monkeypatch):
+    async def scenario():
+        async with database(tmp_path) as db:
+            rater, photo_id = await rated_photo(db)
+            lookups = []
+
+            async def always_missing(photo_id, user, session):
+                lookups.append(photo_id)
+                return None
+
+            monkeypatch.setattr(repository_ratings, '_get_own_rating', always_missing)
+            with pytest.raises(IntegrityError):
+                await repository_ratings.rate_photo(photo_id, 5, rater, db)
+            assert len(lookups) == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from src.services.refresh_tokens import InMemoryRefreshTokenStore, RefreshTokenStore
+
+
+def test_store_interface_is_abstract():
+    with pytest.raises(TypeError):
+        RefreshTokenStore()
+
+
+def test_reused_token_revokes_family_and_expired_families_are_pruned():
+    async def scenario():
+        store = InMemoryRefreshTokenStore()
+        fid = await store.start_family('a@example.com', 'jti1', 60)
+        assert await store.rotate(fid, 'a@example.com', 'jti1', 'jti2', 60)
+        assert not await store.rotate(fid, 'a@example.com', 'jti1', 'jti3', 60)
+        assert not await store.rotate(fid, 'a@example.com', 'jti2', 'jti3', 60)
+        assert fid not in store.families
+
+        expired = await store.start_family('a@example.com', 'jti4', 0)
+        await store.start_family('a@example.com', 'jti5', 60)
+        assert expired not in store.families
+        assert len(store.families) == 1
+
+    asyncio.run(scenario())
+
+
+def test_tokens_only_work_in_their_own_scope(client):
+    response = client.post('/api/auth/signup', json={'username': 'scoped1', 'email': 's@example.com',
+                                                     'password': 'secret1'})
+    assert response.status_code == 201, response.text
+    tokens = client.post('/api/auth/login', data={'username': 's@example.com', 'password': 'secret1'}).json()
+    access = {'Authorization': f"Bearer {tokens['access_token']}"}
+    refresh = {'Authorization': f"Bearer {tokens['refresh_token']}"}
+
+    assert client.get('/api/users/my/', headers=access).status_code == 200
+    assert client.get('/api/users/my/', headers=refresh).status_code == 401
+    assert client.get('/api/auth/refresh_token', headers=access).status_code == 401
+
+    assert client.get('/api/auth/refresh_token', headers=refresh).status_code == 200
+    assert client.get('/api/auth/refresh_token', headers=refresh).status_code == 401
+    assert client.get('/api/users/my/', headers=refresh).status_code == 401
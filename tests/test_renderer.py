@@ -0,0 +1,71 @@
+import asyncio
+import io
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from PIL import Image
+from pydantic import ValidationError
+
+from src.conf.config import settings
+from src.schemas_of_transformation import TransformerModel
+from src.services import renderer
+
+SPEC = TransformerModel(circle={}, effect={}, resize={}, text={}, rotate={'use_filter': True, 'width': 50}).dict()
+
+
+def png(size) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 0, 0)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class BrokenExecutor:
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool('A worker died'))
+        return future
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+@pytest.mark.parametrize('field, value', [
+    ('resize', {'use_filter': True, 'width': settings.transform_max_size + 1}),
+    ('circle', {'use_filter': True, 'height': settings.transform_max_size + 1}),
+    ('text', {'use_filter': True, 'text': 'hi', 'font_size': settings.transform_max_font_size + 1}),
+])
+def test_oversized_spec_is_rejected(field, value):
+    with pytest.raises(ValidationError):
+        TransformerModel(**dict(SPEC, **{field: value}))
+
+
+def test_oversized_stored_spec_is_not_rendered(monkeypatch):
+    broken = BrokenExecutor()
+    monkeypatch.setattr(renderer, '_executor', broken)
+    spec = dict(SPEC, resize={'use_filter': True, 'fill': False, 'width': 10 ** 6, 'height': 10 ** 6})
+    with pytest.raises(ValueError):
+        asyncio.run(renderer.render_async(png((80, 60)), spec))
+    assert not broken.shut_down
+
+
+def test_tall_source_is_not_scaled_past_the_limit():
+    with pytest.raises(ValueError):
+        renderer.render(png((1, settings.transform_max_size)), SPEC)
+
+
+def test_broken_pool_is_replaced_and_render_retried(monkeypatch):
+    broken = BrokenExecutor()
+    monkeypatch.setattr(renderer, '_executor', broken)
+    monkeypatch.setattr(renderer, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    try:
+        rendered = asyncio.run(renderer.render_async(png((80, 60)), SPEC))
+        assert broken.shut_down
+        assert renderer._executor is not broken
+        assert Image.open(io.BytesIO(rendered)).format == 'PNG'
+    finally:
+        if renderer._executor is not broken:
+            renderer._executor.shutdown()
@@ -0,0 +1,60 @@
+import asyncio
+
+from redis.exceptions import RedisError
+
+from src.database.routing import WriteTracker
+
+
+class FakeRedis:
+    def __init__(self):
+        self.keys = {}
+
+    async def set(self, key, value, px=None):
+        self.keys[key] = (value, px)
+
+    async def exists(self, key):
+        return int(key in self.keys)
+
+
+class DownRedis:
+    async def set(self, key, value, px=None):
+        raise RedisError('down')
+
+    async def exists(self, key):
+        raise RedisError('down')
+
+
+def test_write_window_is_shared_between_processes():
+    async def scenario():
+        client = FakeRedis()
+        writer, reader = WriteTracker(5, client), WriteTracker(5, client)
+        assert not await reader.recently_wrote('a@example.com')
+        writer.mark('a@example.com')
+        await asyncio.sleep(0)
+        assert client.keys['rw:a@example.com'] == (1, 5000)
+        assert await reader.recently_wrote('a@example.com')
+        assert not await reader.recently_wrote('b@example.com')
+
+    asyncio.run(scenario())
+
+
+def test_reads_go_to_primary_when_redis_is_down():
+    async def scenario():
+        tracker = WriteTracker(5, DownRedis())
+        tracker.mark('a@example.com')
+        await asyncio.sleep(0)
+        assert await tracker.recently_wrote('b@example.com')
+        assert not await tracker.recently_wrote(None)
+
+    asyncio.run(scenario())
+
+
+def test_window_expires_in_process():
+    async def scenario():
+        tracker = WriteTracker(0.01)
+        tracker.mark('a@example.com')
+        assert await tracker.recently_wrote('a@example.com')
+        await asyncio.sleep(0.02)
+        assert not await tracker.recently_wrote('a@example.com')
+
+    asyncio.run(scenario())
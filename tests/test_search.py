@@ -0,0 +1,37 @@
+from conftest import signup, upload_photo
+
+
+def search(client, headers, information: str, **params) -> list:
+    response = client.get(f'/api/photos/search/{information}', headers=headers, params=params)
+    assert response.status_code == 200, response.text
+    return [photo['title'] for photo in response.json()]
+
+
+def test_photos_are_searched_by_words_and_ranked(client):
+    headers = signup(client, 'seeker1', 'seeker@example.com')
+    other = signup(client, 'other11', 'other@example.com')
+    upload_photo(client, headers, title='mountain lake', color=(10, 10, 10))
+    upload_photo(client, headers, title='mountain mountain mountain', color=(20, 20, 20))
+    upload_photo(client, headers, title='city', color=(30, 30, 30))
+    upload_photo(client, other, title='mountain', color=(40, 40, 40))
+
+    assert search(client, headers, 'mountain') == ['mountain mountain mountain', 'mountain lake']
+    assert search(client, headers, 'Lake') == ['mountain lake']
+    assert search(client, headers, 'mountain', skip=1, limit=1) == ['mountain lake']
+    assert search(client, headers, 'description', limit=2) == search(client, headers, 'description')[:2]
+    assert search(client, headers, 'mount') == []
+    assert search(client, headers, '"*') == []
+
+
+def test_search_follows_title_changes_and_deletes(client):
+    headers = signup(client, 'seeker1', 'seeker@example.com')
+    lake = upload_photo(client, headers, title='lake', color=(10, 10, 10))
+    sea = upload_photo(client, headers, title='sea', color=(20, 20, 20))
+
+    response = client.patch(f"/api/photos/title/{lake['id']}", headers=headers, json={'title': 'river'})
+    assert response.status_code == 200, response.text
+    assert search(client, headers, 'lake') == []
+    assert search(client, headers, 'river') == ['river']
+
+    assert client.delete(f"/api/photos/{sea['id']}", headers=headers).status_code == 200
+    assert search(client, headers, 'sea') == []
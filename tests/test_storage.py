@@ -0,0 +1,34 @@
+from urllib.error import HTTPError
+
+import pytest
+
+from src.services import storage as storage_module
+from src.services.storage import StorageBackend, LocalStorage, CloudinaryStorage
+
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class NoDelete(StorageBackend):
+        async def save(self, file, key: str, **options) -> dict:
+            return {}
+
+        def url(self, key: str, version=None, **transformation) -> str:
+            return key
+
+        async def read(self, key: str) -> bytes:
+            return b''
+
+    with pytest.raises(TypeError, match='delete'):
+        NoDelete()
+
+
+def test_local_storage_is_complete(tmp_path):
+    assert LocalStorage(str(tmp_path), 'http://testserver/api/media').url('a/b') == 'http://testserver/api/media/a/b'
+
+
+def test_missing_cloudinary_asset_is_file_not_found(monkeypatch):
+    def not_found(url, timeout):
+        raise HTTPError(url, 404, 'Not Found', {}, None)
+
+    monkeypatch.setattr(storage_module, 'urlopen', not_found)
+    with pytest.raises(FileNotFoundError):
+        CloudinaryStorage._download('https://res.cloudinary.com/demo/image/upload/missing')
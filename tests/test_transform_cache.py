@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from src.schemas_of_transformation import TransformerModel
+from src.services import transform_cache as transform_cache_module
+from src.services.storage import LocalStorage
+from src.services.transform_cache import TransformCache
+
+SPEC = TransformerModel(circle={}, effect={}, resize={}, text={}, rotate={'use_filter': True, 'width': 50}).dict()
+
+
+def png(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (80, 60), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    storage = LocalStorage(str(tmp_path / 'media'), 'http://testserver/api/media')
+    monkeypatch.setattr(transform_cache_module, 'storage', storage)
+    return storage
+
+
+def image_usage(cache: TransformCache) -> int:
+    return sum(path.stat().st_size for path in cache.root.glob('*/*.png'))
+
+
+def test_replaced_source_is_not_rendered(tmp_path, storage):
+    async def scenario():
+        cache = TransformCache(str(tmp_path / 'cache'), 10 ** 7)
+        original = png((200, 0, 0))
+        await storage.save(io.BytesIO(original), 'PhotoShareApp/legacy')
+        key = await cache.register('PhotoShareApp/legacy', hashlib.sha256(original).hexdigest(), SPEC)
+        await storage.save(io.BytesIO(png((0, 0, 200))), 'PhotoShareApp/legacy')
+
+        with pytest.raises(HTTPException) as error:
+            await cache.get(key)
+        assert error.value.status_code == 404
+
+    asyncio.run(scenario())
+
+
+def test_eviction_keeps_sidecars_and_open_files(tmp_path, storage):
+    async def scenario():
+        cache = TransformCache(str(tmp_path / 'cache'), 10 ** 7)
+        source = png((200, 0, 0))
+        await storage.save(io.BytesIO(source), 'photos/a')
+        content_hash = hashlib.sha256(source).hexdigest()
+        keys = [await cache.register('photos/a', content_hash, dict(SPEC, rotate=dict(SPEC['rotate'], degree=degree)))
+                for degree in range(1, 6)]
+        images = [await cache.get(key) for key in keys]
+        assert cache.total == image_usage(cache)
+
+        cache.max_bytes = cache.total // 2
+        await cache._evict()
+        assert cache.total == image_usage(cache)
+        assert len(list(cache.root.glob('*/*.png'))) == len(cache.index) < len(keys)
+        assert len(list(cache.root.glob('*/*.json'))) == len(keys)
+        for image in images:
+            with image.file:
+                assert len(image.file.read()) == image.size
+
+        cache.max_bytes = 10 ** 7
+        with (await cache.get(keys[0])).file as file:
+            assert file.read() == cache._image_path(keys[0]).read_bytes()
+
+    asyncio.run(scenario())
@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+import io
+
+from starlette.datastructures import FormData, Headers, UploadFile
+
+from src.services.uploads import UploadDigester, read_image_upload
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+
+
+def multipart_body(boundary: str, *contents: bytes) -> bytes:
+    body = f'--{boundary}\r\nContent-Disposition: form-data; name="title"\r\n\r\nsunset\r\n'.encode()
+    for content in contents:
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="x.png"\r\n'
+                 f'Content-Type: image/png\r\n\r\n').encode() + content + b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode()
+
+
+def digest_body(body: bytes, boundary: str) -> dict:
+    scope = {'type': 'http', 'headers': [(b'content-type', f'multipart/form-data; boundary={boundary}'.encode())]}
+    digester = UploadDigester.for_scope(scope)
+    for start in range(0, len(body), 7):
+        digester.write(body[start:start + 7])
+    return scope['state']
+
+
+class FakeRequest:
+    def __init__(self, state: dict, *files: UploadFile):
+        self.state = type('State', (), state)()
+        self._form = FormData([('title', 'sunset')] + [('file', file) for file in files])
+
+    async def form(self):
+        return self._form
+
+
+class Unreadable(io.BytesIO):
+    def read(self, *args):
+        raise AssertionError('the file is read again')
+
+
+def test_digest_is_computed_while_the_body_arrives():
+    boundary = 'b0undary'
+    state = digest_body(multipart_body(boundary, PNG), boundary)
+
+    [(index, digest)] = state['upload_digests'].items()
+    assert index == 1
+    assert (digest.name, digest.filename, digest.size) == ('file', 'x.png', len(PNG))
+    assert digest.sha256 == hashlib.sha256(PNG).hexdigest()
+
+    upload = UploadFile(Unreadable(PNG), size=len(PNG), filename='x.png', headers=Headers())
+    image = asyncio.run(read_image_upload(upload, FakeRequest(state, upload)))
+    assert (image.sha256, image.size, image.media_type) == (digest.sha256, len(PNG), 'image/png')
+
+
+def test_without_digest_the_file_is_read():
+    upload = UploadFile(io.BytesIO(PNG), size=len(PNG), filename='x.png', headers=Headers())
+    image = asyncio.run(read_image_upload(upload))
+    assert (image.sha256, image.media_type) == (hashlib.sha256(PNG).hexdigest(), 'image/png')
+
+
+def test_files_with_the_same_name_and_size_keep_their_own_digest():
+    boundary = 'b0undary'
+    other = PNG[:-1] + b'\x00'
+    state = digest_body(multipart_body(boundary, PNG, other), boundary)
+    first = UploadFile(Unreadable(PNG), size=len(PNG), filename='x.png', headers=Headers())
+    second = UploadFile(Unreadable(other), size=len(other), filename='x.png', headers=Headers())
+    request = FakeRequest(state, first, second)
+
+    assert asyncio.run(read_image_upload(second, request)).sha256 == hashlib.sha256(other).hexdigest()
+    assert asyncio.run(read_image_upload(first, request)).sha256 == hashlib.sha256(PNG).hexdigest()
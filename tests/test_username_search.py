@@ -0,0 +1,67 @@
+import asyncio
+
+from conftest import png, signup
+from src.services.username_index import UsernameIndex
+
+
+def search(client, headers, username: str, **params):
+    response = client.get(f'/api/users/users_with_username/{username}', headers=headers, params=params)
+    if response.status_code == 404:
+        return []
+    assert response.status_code == 200, response.text
+    return [user['username'] for user in response.json()]
+
+
+def complete(client, headers, prefix: str, **params) -> list:
+    response = client.get('/api/users/autocomplete/', headers=headers, params={'prefix': prefix, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_usernames_are_searched_by_substring(client):
+    headers = signup(client, 'Alpha11', 'a@example.com')
+    signup(client, 'alphabet', 'b@example.com')
+    signup(client, 'betamax1', 'c@example.com')
+
+    assert search(client, headers, 'PHA') == ['Alpha11', 'alphabet']
+    assert search(client, headers, 'pha', limit=1) == ['Alpha11']
+    assert search(client, headers, 'ax') == ['betamax1']
+    assert search(client, headers, 'bet') == ['alphabet', 'betamax1']
+    assert search(client, headers, 'gamma') == []
+    assert search(client, headers, '%') == []
+    assert search(client, headers, 'a"b') == []
+
+
+def test_usernames_are_completed_by_prefix(client):
+    headers = signup(client, 'Alpha11', 'a@example.com')
+    signup(client, 'alphabet', 'b@example.com')
+    signup(client, 'betamax1', 'c@example.com')
+
+    assert complete(client, headers, 'al') == ['Alpha11', 'alphabet']
+    assert complete(client, headers, 'AL', limit=1) == ['Alpha11']
+    assert complete(client, headers, 'x') == []
+
+    signup(client, 'alpine11', 'd@example.com')
+    assert complete(client, headers, 'alp') == ['Alpha11', 'alphabet', 'alpine11']
+    response = client.put('/api/users/edit_me/', headers=headers, data={'new_username': 'omega11'},
+                          files={'avatar': ('avatar.png', png(), 'image/png')})
+    assert response.status_code == 200, response.text
+    assert complete(client, headers, 'alp') == ['alphabet', 'alpine11']
+    assert complete(client, headers, 'ome') == ['omega11']
+    assert search(client, headers, 'mega') == ['omega11']
+
+
+def test_changes_during_a_reload_are_kept():
+    class Rows:
+        def __init__(self, index):
+            self.index = index
+
+        async def scalars(self, stmt):
+            self.index.add('newcomer')
+            return ['Bravo11', 'alpha11']
+
+    async def scenario():
+        index = UsernameIndex(refresh=60)
+        return await index.complete('', 10, Rows(index))
+
+    assert asyncio.run(scenario()) == ['alpha11', 'Bravo11', 'newcomer']